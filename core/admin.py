@@ -1,11 +1,53 @@
-from django.contrib import admin
-from .models import Producto, Promocion, Cliente, Categoria, Marca, Proveedor
+import os
+
+from django.contrib import admin, messages
+from django.core.exceptions import PermissionDenied
+from django.http import FileResponse, Http404
+from django.shortcuts import get_object_or_404, redirect
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+from django.utils.html import format_html
+from .models import Producto, Promocion, Cliente, Categoria, Marca, Proveedor, Trabajo
 from import_export.admin import ImportExportModelAdmin
 from .resources import ProductoResource
+from . import exportacion, trabajos
 from .models import PromocionTicker
 
+class ExportacionRapidaMixin:
+    """
+    Agrega "Exportar CSV/XLSX" a la lista del admin usando core.exportacion: se
+    respetan los filtros y la búsqueda de la lista, pero las filas se leen por
+    bloques en vez de cargar todo el queryset (el export de import_export no escala).
+    El CSV se manda al momento; el XLSX se arma en segundo plano (core.trabajos).
+    """
+    exportacion = None  # llave de exportacion.COLUMNAS
+
+    def get_urls(self):
+        opts = self.model._meta
+        urls = [
+            path(
+                "exportar/<str:formato>/",
+                self.admin_site.admin_view(self.exportar_rapido),
+                name=f"{opts.app_label}_{opts.model_name}_exportar_rapido",
+            ),
+        ]
+        return urls + super().get_urls()
+
+    def exportar_rapido(self, request, formato):
+        if not self.has_export_permission(request):
+            return redirect(f"admin:{self.model._meta.app_label}_{self.model._meta.model_name}_changelist")
+        queryset = self.get_changelist_instance(request).get_queryset(request)
+        if formato != "xlsx":
+            return exportacion.respuesta(self.exportacion, formato, queryset)
+        trabajo = trabajos.encolar(
+            "exportar", usuario=request.user,
+            nombre=self.exportacion, filtros=request.GET.urlencode(),
+        )
+        messages.info(request, f"Se está generando el archivo ({trabajo}). Te avisaremos cuando esté listo.")
+        return redirect("admin:core_trabajo_change", trabajo.pk)
+
 @admin.register(Producto)
-class ProductoAdmin(ImportExportModelAdmin): # Habilita Import/Export
+class ProductoAdmin(ExportacionRapidaMixin, ImportExportModelAdmin): # Habilita Import/Export
     resource_class = ProductoResource
     list_display = (
         "nombre", "clave", "categoria", "marca", "proveedor", 
@@ -19,6 +61,90 @@ class ProductoAdmin(ImportExportModelAdmin): # Habilita Import/Export
     )
     # Filtros laterales para facilitar la navegación
     list_filter = ("categoria", "marca", "proveedor", "departamento")
+    change_list_template = "admin/core/producto/change_list.html"
+    exportacion = "productos"
+
+    def get_urls(self):
+        urls = [
+            path(
+                "importacion-masiva/",
+                self.admin_site.admin_view(self.importacion_masiva),
+                name="core_producto_importacion_masiva",
+            ),
+        ]
+        return urls + super().get_urls()
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related("categoria", "marca", "proveedor")
+
+    def importacion_masiva(self, request):
+        """Encola la importación de listas de precios grandes (core.importacion, vía run_worker)."""
+        if not self.has_import_permission(request):
+            return redirect("admin:core_producto_changelist")
+
+        if request.method == "POST" and request.FILES.get("archivo"):
+            trabajo = trabajos.encolar(
+                "importar_productos", usuario=request.user, archivo=request.FILES["archivo"],
+                dry_run=bool(request.POST.get("dry_run")),
+            )
+            messages.info(request, f"La importación quedó en cola ({trabajo}). Verás el avance en las notificaciones.")
+            return redirect("admin:core_trabajo_change", trabajo.pk)
+
+        context = {
+            **self.admin_site.each_context(request),
+            "opts": self.model._meta,
+            "title": "Importación masiva de productos",
+        }
+        return TemplateResponse(request, "admin/core/producto/importacion_masiva.html", context)
+
+@admin.register(Trabajo)
+class TrabajoAdmin(admin.ModelAdmin):
+    list_display = ("id", "tipo", "estado", "progreso", "usuario", "creado", "terminado", "descargar")
+    list_filter = ("estado", "tipo")
+    fields = ("tipo", "estado", "progreso", "mensaje", "nombre_archivo", "descargar", "usuario", "creado", "iniciado", "terminado")
+    readonly_fields = fields
+
+    def get_urls(self):
+        urls = [
+            path(
+                "<int:trabajo_id>/resultado/",
+                self.admin_site.admin_view(self.resultado),
+                name="core_trabajo_resultado",
+            ),
+        ]
+        return urls + super().get_urls()
+
+    def resultado(self, request, trabajo_id):
+        """El archivo generado, sólo para quien lanzó el trabajo o un superusuario (no es público)."""
+        trabajo = get_object_or_404(Trabajo, pk=trabajo_id)
+        if not self.has_view_permission(request, trabajo) or not (
+            request.user.is_superuser or trabajo.usuario_id == request.user.pk
+        ):
+            raise PermissionDenied
+        if not trabajo.resultado:
+            raise Http404("El trabajo no generó archivo")
+        # admin_view ya la marca private y no-store: ninguna caché guarda una copia
+        return FileResponse(
+            trabajo.resultado.open("rb"), as_attachment=True,
+            filename=f"{trabajo.parametros.get('nombre', trabajo.tipo)}-{trabajo.pk}.xlsx",
+        )
+
+    @admin.display(description="Archivo de entrada")
+    def nombre_archivo(self, obj):
+        return os.path.basename(obj.archivo.name) if obj.archivo else "-"
+
+    @admin.display(description="Resultado")
+    def descargar(self, obj):
+        if not obj.resultado:
+            return "-"
+        return format_html('<a href="{}">Descargar</a>', reverse("admin:core_trabajo_resultado", args=[obj.pk]))
+
+    def has_add_permission(self, request):
+        # Los trabajos sólo se crean desde las pantallas que los encolan
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
 
 @admin.register(Marca)
 class MarcaAdmin(admin.ModelAdmin):
@@ -31,7 +157,9 @@ class ProveedorAdmin(admin.ModelAdmin):
     search_fields = ("nombre",)
 
 @admin.register(Cliente)
-class ClienteAdmin(ImportExportModelAdmin): 
+class ClienteAdmin(ExportacionRapidaMixin, ImportExportModelAdmin): 
+    change_list_template = "admin/core/cliente/change_list.html"
+    exportacion = "clientes"
     list_display = ("nombre", "correo", "telefono", "rfc", "ciudad")
     search_fields = ("nombre", "correo", "rfc")
 
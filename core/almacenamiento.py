@@ -0,0 +1,135 @@
+"""
+Storage de imágenes nombradas por su contenido.
+
+``FileSystemStorage`` le agrega un sufijo al azar a cada archivo repetido
+(``cemento_cruz_azul_0plEVrh.webp``), así cada vez que se vuelve a subir la
+misma foto se guarda otra copia. Aquí el nombre es el sha256 del contenido:
+subir la misma imagen dos veces da el mismo nombre y un solo archivo, y como un
+nombre nunca cambia de contenido se puede servir con caché "immutable".
+
+``EstaticosComprimidos`` hace lo mismo para los estáticos de ``collectstatic``.
+
+Los archivos de los trabajos (listas de proveedores, exportaciones con datos
+de clientes) van aparte, fuera de MEDIA_ROOT (``almacenamiento_privado``): sólo
+se descargan por la vista del admin que revisa quién los pide.
+"""
+import gzip
+import hashlib
+import os
+import posixpath
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+
+try:
+    import brotli
+except ImportError:  # opcional: sin él sólo se generan los .gz
+    brotli = None
+
+LARGO_HASH = 32
+
+
+def hash_contenido(content):
+    digest = hashlib.sha256()
+    for bloque in content.chunks():
+        digest.update(bloque)
+    if hasattr(content, "seek"):
+        content.seek(0)
+    return digest.hexdigest()[:LARGO_HASH]
+
+
+def es_nombre_por_contenido(nombre):
+    base = posixpath.splitext(posixpath.basename(nombre))[0]
+    return len(base) == LARGO_HASH and all(c in "0123456789abcdef" for c in base)
+
+
+class AlmacenamientoPorContenido(FileSystemStorage):
+    # Archivos derivados (core.miniaturas) que ya traen un nombre calculado del contenido del original
+    CARPETAS_DERIVADAS = ("miniaturas",)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, "chunks"):
+            content = File(content, name)
+        if set(posixpath.dirname(name).split("/")) & set(self.CARPETAS_DERIVADAS):
+            return super().save(name, content, max_length)
+
+        extension = posixpath.splitext(name)[1].lower()
+        nombre = posixpath.join(posixpath.dirname(name), hash_contenido(content) + extension)
+        if self.exists(nombre):
+            # Ya está: no se escribe otra copia
+            return nombre
+        return super().save(nombre, content, max_length)
+
+
+def almacenamiento_imagenes():
+    """Callable para ``ImageField(storage=...)``: la migración no guarda la ruta de MEDIA_ROOT."""
+    return _almacenamiento
+
+
+_almacenamiento = AlmacenamientoPorContenido()
+
+
+class AlmacenamientoPrivado(FileSystemStorage):
+    """Archivos en ARCHIVOS_PRIVADOS_ROOT, sin URL pública."""
+
+    # Se leen en cada uso (no cached_property) para respetar override_settings
+    @property
+    def base_location(self):
+        return settings.ARCHIVOS_PRIVADOS_ROOT
+
+    @property
+    def location(self):
+        return os.path.abspath(self.base_location)
+
+    def url(self, name):
+        raise ValueError("Los archivos privados no tienen URL: se descargan por su vista")
+
+
+def almacenamiento_privado():
+    """Callable para ``FileField(storage=...)`` de ``Trabajo``."""
+    return _privado
+
+
+_privado = AlmacenamientoPrivado()
+
+
+class EstaticosComprimidos(ManifestStaticFilesStorage):
+    """
+    Estáticos con hash en el nombre y, junto a cada archivo de texto, sus
+    versiones .gz y .br para que ``core.medios`` (o nginx con ``gzip_static``)
+    las mande sin comprimir en cada petición.
+    """
+    EXTENSIONES_COMPRIMIBLES = (".css", ".js", ".mjs", ".map", ".svg", ".json", ".txt", ".html", ".xml", ".ico")
+    # Por debajo de esto la compresión no ahorra una ida y vuelta
+    TAMANO_MINIMO = 512
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for original in sorted(paths):
+            if not original.lower().endswith(self.EXTENSIONES_COMPRIMIBLES):
+                continue
+            # La copia sin hash (por si algo la pide directo) y la que usan las plantillas
+            for nombre in {original, self.stored_name(original)}:
+                self._comprimir(nombre)
+
+    def _comprimir(self, nombre):
+        with self.open(nombre) as archivo:
+            contenido = archivo.read()
+        if len(contenido) < self.TAMANO_MINIMO:
+            return
+        variantes = {".gz": gzip.compress(contenido, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            variantes[".br"] = brotli.compress(contenido)
+        for extension, comprimido in variantes.items():
+            if len(comprimido) >= len(contenido):
+                continue
+            if self.exists(nombre + extension):
+                self.delete(nombre + extension)
+            self._save(nombre + extension, ContentFile(comprimido))
@@ -0,0 +1,133 @@
+"""
+Bandeja de salida de avisos por WebSocket.
+
+Las señales mandaban los avisos con ``async_to_sync(group_send)`` dentro del
+``post_save``: la petición esperaba a la capa de canales (y dentro de
+``convertir_a_pedido``, con la transacción abierta) y además consultaba el
+cliente y su usuario sólo para poner el nombre en el aviso.
+
+``events.publicar`` espera a que la transacción se confirme (si se revierte no
+se avisa nada) y ``encolar``, la única entrada de esta bandeja, sólo anota un
+mensaje compacto. Un hilo por proceso vacía la bandeja en
+lotes: completa los datos que falten con una consulta por lote
+(``@preparador``) y los manda a la capa de canales en una sola vuelta del
+event loop. La petición ya no depende de cuántos admins estén conectados.
+
+Los avisos viven en memoria: si el proceso termina antes de mandarlos se
+pierden. Los que se encolan con ``guardar`` quedan además en ``Aviso`` con un
+número de secuencia (``mensaje["secuencia"]``) para repetírselos a quien se
+reconecte (``NotificacionConsumer``).
+"""
+import logging
+import os
+import queue
+import threading
+from collections import defaultdict
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Aviso
+
+logger = logging.getLogger(__name__)
+
+TAMANO_LOTE = 200
+PREPARADORES = {}
+
+_cola = queue.Queue()
+_candado = threading.Lock()
+_hilo = None
+_pid = None
+
+
+def preparador(tipo):
+    """Registra ``funcion(mensajes)`` para completar en lote los mensajes de ``tipo`` antes de enviarlos."""
+    def registrar(funcion):
+        PREPARADORES[tipo] = funcion
+        return funcion
+    return registrar
+
+
+def encolar(grupo, mensaje, guardar=False):
+    """
+    Agrega ``mensaje`` a la bandeja de inmediato, sin esperar a ninguna
+    transacción. Con ``guardar`` se le asigna secuencia y se puede repetir.
+    """
+    _asegurar_hilo()
+    _cola.put((grupo, mensaje, guardar))
+
+
+def _asegurar_hilo():
+    global _hilo, _pid
+    # Después de un fork el hilo del proceso padre no existe en el hijo
+    if _hilo is not None and _hilo.is_alive() and _pid == os.getpid():
+        return
+    with _candado:
+        if _hilo is None or not _hilo.is_alive() or _pid != os.getpid():
+            _pid = os.getpid()
+            _hilo = threading.Thread(target=_trabajar, name="bandeja-salida", daemon=True)
+            _hilo.start()
+
+
+def _trabajar():
+    while True:
+        lote = [_cola.get()]
+        while len(lote) < TAMANO_LOTE:
+            try:
+                lote.append(_cola.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            enviar_lote(lote)
+        except Exception:
+            logger.exception("No se pudieron enviar %s avisos", len(lote))
+        finally:
+            # Los preparadores consultan la base desde este hilo
+            connection.close()
+            for _ in lote:
+                _cola.task_done()
+
+
+def enviar_lote(lote):
+    """Completa, guarda y envía una lista de (grupo, mensaje, guardar) en orden."""
+    por_tipo = defaultdict(list)
+    for _, mensaje, _ in lote:
+        por_tipo[mensaje["type"]].append(mensaje)
+    for tipo, mensajes in por_tipo.items():
+        if tipo in PREPARADORES:
+            PREPARADORES[tipo](mensajes)
+    _guardar([(grupo, mensaje) for grupo, mensaje, guardar in lote if guardar])
+
+    async def enviar():
+        capa = get_channel_layer()
+        for grupo, mensaje, _ in lote:
+            await capa.group_send(grupo, mensaje)
+
+    async_to_sync(enviar)()
+
+
+def _guardar(avisos):
+    if not avisos:
+        return
+    guardados = [Aviso(grupo=grupo, contenido=mensaje) for grupo, mensaje in avisos]
+    # Los ids son las secuencias. SQLite y PostgreSQL los devuelven en el
+    # bulk_create (RETURNING); MySQL no, ahí se guardan de uno en uno.
+    if connection.features.can_return_rows_from_bulk_insert:
+        Aviso.objects.bulk_create(guardados)
+    else:
+        with transaction.atomic():
+            for aviso in guardados:
+                aviso.save()
+    for aviso, (_, mensaje) in zip(guardados, avisos):
+        mensaje["secuencia"] = aviso.pk
+    limite = timezone.now() - timedelta(seconds=settings.AVISOS_HISTORIAL_SEGUNDOS)
+    Aviso.objects.filter(creado__lt=limite).delete()
+
+
+def esperar():
+    """Bloquea hasta que se hayan enviado los avisos pendientes (pruebas, cierre ordenado)."""
+    _cola.join()
@@ -0,0 +1,180 @@
+"""
+Servicio de búsqueda de texto completo para el catálogo de productos.
+
+En SQLite se usa una tabla virtual FTS5 y en MySQL una tabla espejo con índice
+FULLTEXT. El contenido se guarda ya pasado por ``normalizar_texto`` para que las
+búsquedas ignoren acentos y mayúsculas. En cualquier otro motor se recurre a
+``icontains``.
+"""
+import re
+import threading
+from contextlib import contextmanager
+
+from django.db import connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .utils import normalizar_texto
+
+TABLA = "core_producto_fts"
+COLUMNAS = ("nombre", "clave", "descripcion", "departamento", "marca", "proveedor")
+# Valores que se leen de Producto para llenar cada columna del índice
+ORIGEN = ("nombre", "clave", "descripcion", "departamento", "marca__nombre", "proveedor__nombre")
+# Pesos bm25 por columna: el nombre y la clave pesan más que la descripción
+PESOS = (10.0, 8.0, 2.0, 1.0, 1.0, 1.0)
+LOTE = 500
+
+_estado = threading.local()
+
+
+def motor_soportado(connection):
+    return connection.vendor in ("sqlite", "mysql")
+
+
+def crear_indice(schema_editor):
+    connection = schema_editor.connection
+    columnas = ", ".join(COLUMNAS)
+    if connection.vendor == "sqlite":
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLA} "
+            f"USING fts5({columnas}, tokenize='unicode61 remove_diacritics 2')"
+        )
+    elif connection.vendor == "mysql":
+        definicion = ", ".join(f"{c} LONGTEXT" for c in COLUMNAS)
+        schema_editor.execute(
+            f"CREATE TABLE IF NOT EXISTS {TABLA} (rowid BIGINT PRIMARY KEY, {definicion}, "
+            f"FULLTEXT KEY {TABLA}_texto ({columnas})) ENGINE=InnoDB"
+        )
+
+
+def eliminar_indice(schema_editor):
+    if motor_soportado(schema_editor.connection):
+        schema_editor.execute(f"DROP TABLE IF EXISTS {TABLA}")
+
+
+def _modelo_producto():
+    from .models import Producto
+    return Producto
+
+
+def _documentos(filas):
+    return [(pk, *(normalizar_texto(valor) for valor in valores)) for pk, *valores in filas]
+
+
+def indexar_productos(ids, using="default", modelo=None):
+    """Vuelve a escribir en el índice las filas de los productos indicados."""
+    ids = list(ids)
+    connection = connections[using]
+    if not ids or not motor_soportado(connection):
+        return
+    Producto = modelo or _modelo_producto()
+    marcadores = ", ".join(["%s"] * (len(COLUMNAS) + 1))
+    insertar = f"INSERT INTO {TABLA} (rowid, {', '.join(COLUMNAS)}) VALUES ({marcadores})"
+
+    with connection.cursor() as cursor:
+        for inicio in range(0, len(ids), LOTE):
+            lote = ids[inicio:inicio + LOTE]
+            filas = Producto.objects.using(using).filter(pk__in=lote).values_list("pk", *ORIGEN)
+            cursor.execute(
+                f"DELETE FROM {TABLA} WHERE rowid IN ({', '.join(['%s'] * len(lote))})", lote
+            )
+            cursor.executemany(insertar, _documentos(filas))
+
+
+def quitar_productos(ids, using="default"):
+    ids = list(ids)
+    connection = connections[using]
+    if not ids or not motor_soportado(connection):
+        return
+    with connection.cursor() as cursor:
+        for inicio in range(0, len(ids), LOTE):
+            lote = ids[inicio:inicio + LOTE]
+            cursor.execute(
+                f"DELETE FROM {TABLA} WHERE rowid IN ({', '.join(['%s'] * len(lote))})", lote
+            )
+
+
+def reconstruir_indice(using="default", modelo=None):
+    """Vacía el índice y lo vuelve a llenar con todo el catálogo."""
+    connection = connections[using]
+    if not motor_soportado(connection):
+        return
+    Producto = modelo or _modelo_producto()
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLA}")
+    ids = Producto.objects.using(using).values_list("pk", flat=True)
+    indexar_productos(list(ids), using=using, modelo=Producto)
+
+
+def registrar_cambios(ids, using="default"):
+    """Indexa los productos al momento o los aparta si hay una indexación diferida activa."""
+    pendientes = getattr(_estado, "pendientes", None)
+    if pendientes is not None:
+        pendientes.update(ids)
+    else:
+        indexar_productos(ids, using=using)
+
+
+@contextmanager
+def indexacion_diferida(using="default"):
+    """
+    Junta los cambios de productos y los indexa de una sola vez al salir.
+    Lo usa la importación de Excel para no reescribir el índice fila por fila.
+    """
+    anteriores = getattr(_estado, "pendientes", None)
+    _estado.pendientes = set()
+    try:
+        yield _estado.pendientes
+    finally:
+        pendientes = _estado.pendientes
+        _estado.pendientes = anteriores
+        if anteriores is not None:
+            anteriores.update(pendientes)
+        else:
+            indexar_productos(pendientes, using=using)
+
+
+def _terminos(query):
+    return re.findall(r"\w+", normalizar_texto(query))
+
+
+def buscar_productos(query, queryset=None):
+    """
+    Filtra ``queryset`` (por defecto todo el catálogo) con el texto de ``query``.
+    Cada palabra se busca como prefijo y los resultados salen ordenados por relevancia.
+    """
+    if queryset is None:
+        queryset = _modelo_producto().objects.all()
+    query = (query or "").strip()
+    if not query:
+        return queryset
+
+    terminos = _terminos(query)
+    connection = connections[queryset.db]
+    if not terminos or not motor_soportado(connection):
+        condicion = Q()
+        for campo in ORIGEN:
+            condicion |= Q(**{f"{campo}__icontains": query})
+        return queryset.filter(condicion)
+
+    tabla_producto = connection.ops.quote_name(queryset.model._meta.db_table)
+    if connection.vendor == "sqlite":
+        expresion = " ".join(f'"{t}"*' for t in terminos)
+        coincide = f"{TABLA} MATCH %s"
+        puntaje = f"bm25({TABLA}, {', '.join(str(p) for p in PESOS)})"
+        parametros = (expresion,)
+    else:
+        expresion = " ".join(f"+{t}*" for t in terminos)
+        coincide = f"MATCH({', '.join(COLUMNAS)}) AGAINST (%s IN BOOLEAN MODE)"
+        # MySQL da más puntos a lo más relevante; se invierte para ordenar igual que bm25
+        puntaje = f"-{coincide}"
+        parametros = (expresion, expresion)
+
+    return queryset.filter(
+        pk__in=RawSQL(f"SELECT rowid FROM {TABLA} WHERE {coincide}", (expresion,))
+    ).annotate(
+        relevancia=RawSQL(
+            f"SELECT {puntaje} FROM {TABLA} WHERE {coincide} AND rowid = {tabla_producto}.id",
+            parametros,
+        )
+    ).order_by("relevancia", "nombre", "id")
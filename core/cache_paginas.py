@@ -0,0 +1,84 @@
+"""
+Caché de las páginas públicas del catálogo (inicio, productos, promociones).
+
+Para un visitante sin sesión iniciada estas páginas sólo cambian cuando se
+edita el catálogo, así que la respuesta completa se guarda en la caché de
+Django con la URL y la consulta como clave. Lo único del encabezado que varía
+entre visitantes anónimos es el número del carrito, que va en la clave. Los
+usuarios con sesión ven su nombre y enlaces propios y no pasan por aquí.
+
+Las claves llevan una versión que las señales de ``Producto``, ``Promocion``,
+``PromocionTicker`` y los catálogos renuevan: todas las páginas guardadas se
+descartan de una vez sin tener que saber cuáles eran. Eso sólo sirve si la
+caché es compartida: con una por proceso (LocMemCache) un cambio hecho en otro
+proceso no la alcanzaría, y entonces las páginas no se guardan.
+"""
+import hashlib
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+
+from .carrito import ResumenCarrito
+from .utils import cache_por_proceso
+
+CLAVE_VERSION = "paginas:version"
+
+
+def version():
+    valor = cache.get(CLAVE_VERSION)
+    if valor is None:
+        cache.add(CLAVE_VERSION, uuid.uuid4().hex, None)
+        valor = cache.get(CLAVE_VERSION)
+    return valor
+
+
+def invalidar():
+    cache.set(CLAVE_VERSION, uuid.uuid4().hex, None)
+
+
+def _carrito(request):
+    # Mismo objeto que usa carrito_context, así la sesión se lee una vez
+    resumen = getattr(request, "_resumen_carrito", None)
+    if resumen is None:
+        resumen = request._resumen_carrito = ResumenCarrito(request.session)
+    return resumen.cantidad
+
+
+def _clave(request):
+    ruta = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f"pagina:{version()}:{_carrito(request)}:{ruta}"
+
+
+def _se_puede_guardar(request):
+    return (
+        request.method in ("GET", "HEAD")
+        and not request.user.is_authenticated
+        and not cache_por_proceso()
+        # Los avisos pendientes se muestran una sola vez
+        and not len(get_messages(request))
+    )
+
+
+def cache_publica(vista):
+    """Sirve ``vista`` desde la caché a los visitantes anónimos."""
+    @wraps(vista)
+    def envoltura(request, *args, **kwargs):
+        if not _se_puede_guardar(request):
+            return vista(request, *args, **kwargs)
+        clave = _clave(request)
+        respuesta = cache.get(clave)
+        if respuesta is None:
+            respuesta = vista(request, *args, **kwargs)
+            if (
+                respuesta.status_code == 200
+                and not respuesta.streaming
+                and not respuesta.cookies
+                # Un token CSRF en la página sería el de otro visitante
+                and not request.META.get("CSRF_COOKIE_NEEDS_UPDATE")
+            ):
+                cache.set(clave, respuesta, settings.CACHE_PAGINAS_SEGUNDOS)
+        return respuesta
+    return envoltura
@@ -0,0 +1,328 @@
+"""
+Capa de canales de Django Channels guardada en un archivo SQLite.
+
+``InMemoryChannelLayer`` sólo entrega mensajes dentro del mismo proceso: con
+varios workers de Daphne el aviso de un pedido nuevo sólo llegaba a los admins
+conectados al proceso que guardó el pedido. Esta capa guarda mensajes y grupos
+en un archivo SQLite (modo WAL) que comparten todos los procesos de la máquina,
+sin servicios externos.
+
+- ``group_send`` lee los miembros del grupo e inserta un mensaje por canal en
+  una sola transacción, con el contenido serializado una vez. Los mensajes se
+  guardan como JSON, no con pickle: quien pudiera escribir en el archivo
+  ejecutaría código en todos los workers al leerlo.
+- Los canales de los consumers (``new_channel``) llevan el identificador del
+  proceso; un solo lector por proceso saca de golpe todos los mensajes de sus
+  canales y los reparte en memoria, en lugar de una consulta por socket.
+- Los mensajes vencen a los ``expiry`` segundos y cada canal admite hasta
+  ``capacity`` pendientes (``channel_capacity`` por patrón): ``send`` lanza
+  ``ChannelFull`` y ``group_send`` omite ese canal, como las capas de Channels.
+  Un canal con mensajes vencidos se saca de sus grupos (su consumer ya no existe).
+
+Sirve para varios procesos en un mismo servidor; para varias máquinas hay que
+usar ``channels_redis``.
+"""
+import asyncio
+import json
+import logging
+import random
+import sqlite3
+import string
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+logger = logging.getLogger(__name__)
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS mensajes (
+    id INTEGER PRIMARY KEY,
+    canal TEXT NOT NULL,
+    proceso TEXT,
+    contenido BLOB NOT NULL,
+    expira REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS mensajes_canal ON mensajes (canal, id);
+CREATE INDEX IF NOT EXISTS mensajes_proceso ON mensajes (proceso) WHERE proceso IS NOT NULL;
+CREATE INDEX IF NOT EXISTS mensajes_expira ON mensajes (expira);
+CREATE TABLE IF NOT EXISTS grupos (
+    grupo TEXT NOT NULL,
+    canal TEXT NOT NULL,
+    expira REAL NOT NULL,
+    PRIMARY KEY (grupo, canal)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS grupos_canal ON grupos (canal);
+"""
+
+
+def _proceso(canal):
+    """Identificador del proceso en ``prefijo.sqlite-<proceso>!<aleatorio>``; None en canales normales."""
+    antes, signo, _ = canal.partition("!")
+    if not signo:
+        return None
+    return antes.rsplit(".", 1)[-1]
+
+
+def _serializar(mensaje):
+    # Como en channels_redis (msgpack): sólo tipos de JSON; las tuplas llegan como listas
+    return json.dumps(mensaje, separators=(",", ":")).encode()
+
+
+def _cargar(contenido):
+    """El mensaje, o None si no es JSON válido (p. ej. filas de una versión anterior)."""
+    try:
+        return json.loads(contenido)
+    except ValueError:
+        logger.warning("Se descartó un mensaje ilegible de la capa de canales")
+        return None
+
+
+def _copiar(cola):
+    # Las colas de asyncio quedan atadas al primer event loop que las espera
+    nueva = asyncio.Queue()
+    for elemento in cola._queue:
+        nueva.put_nowait(elemento)
+    return nueva
+
+
+class CapaSQLite(BaseChannelLayer):
+    extensions = ["groups", "flush"]
+
+    def __init__(
+        self,
+        ruta,
+        expiry=60,
+        group_expiry=86400,
+        capacity=100,
+        channel_capacity=None,
+        espera_minima=0.005,
+        espera_maxima=0.05,
+        **kwargs,
+    ):
+        super().__init__(expiry=expiry, capacity=capacity, **kwargs)
+        self.channel_capacity = self.compile_capacities(channel_capacity or {})
+        self.ruta = str(ruta)
+        self.group_expiry = group_expiry
+        # Pausa del lector sin mensajes: crece de la mínima a la máxima mientras no llegue nada
+        self.espera_minima = espera_minima
+        self.espera_maxima = espera_maxima
+        self.proceso = "sqlite-" + "".join(random.choices(string.ascii_letters + string.digits, k=12))
+        self._local = threading.local()
+        self._hilos = ThreadPoolExecutor(2, thread_name_prefix="capa-canales")
+        self._buzones = {}
+        self._bucle = None
+        self._lector = None
+        self._ultima_limpieza = 0.0
+
+    # --- SQLite (corre en los hilos de self._hilos) ---
+
+    def _conexion(self):
+        conexion = getattr(self._local, "conexion", None)
+        if conexion is None:
+            conexion = sqlite3.connect(self.ruta, timeout=10, isolation_level=None)
+            conexion.execute("PRAGMA journal_mode=WAL")
+            conexion.execute("PRAGMA synchronous=NORMAL")
+            conexion.executescript(ESQUEMA)
+            self._local.conexion = conexion
+        return conexion
+
+    @contextmanager
+    def _transaccion(self):
+        conexion = self._conexion()
+        # IMMEDIATE: el bloqueo de escritura se pide al empezar, no a media transacción
+        conexion.execute("BEGIN IMMEDIATE")
+        try:
+            yield conexion
+        except BaseException:
+            conexion.execute("ROLLBACK")
+            raise
+        conexion.execute("COMMIT")
+
+    def _limpiar(self, conexion, ahora):
+        if ahora - self._ultima_limpieza < min(self.expiry, 10):
+            return
+        self._ultima_limpieza = ahora
+        conexion.execute("DELETE FROM grupos WHERE expira <= ?", (ahora,))
+        conexion.execute(
+            "DELETE FROM grupos WHERE canal IN (SELECT canal FROM mensajes WHERE expira <= ?)", (ahora,)
+        )
+        conexion.execute("DELETE FROM mensajes WHERE expira <= ?", (ahora,))
+
+    def _insertar(self, canal, contenido):
+        ahora = time.time()
+        with self._transaccion() as conexion:
+            (pendientes,) = conexion.execute(
+                "SELECT COUNT(*) FROM mensajes WHERE canal = ? AND expira > ?", (canal, ahora)
+            ).fetchone()
+            if pendientes >= self.get_capacity(canal):
+                raise ChannelFull(canal)
+            conexion.execute(
+                "INSERT INTO mensajes (canal, proceso, contenido, expira) VALUES (?, ?, ?, ?)",
+                (canal, _proceso(canal), contenido, ahora + self.expiry),
+            )
+
+    def _insertar_en_grupo(self, grupo, contenido):
+        ahora = time.time()
+        with self._transaccion() as conexion:
+            self._limpiar(conexion, ahora)
+            canales = [
+                canal for (canal,) in
+                conexion.execute("SELECT canal FROM grupos WHERE grupo = ? AND expira > ?", (grupo, ahora))
+            ]
+            if not canales:
+                return 0
+            pendientes = dict(conexion.execute(
+                "SELECT canal, COUNT(*) FROM mensajes WHERE expira > ? AND canal IN "
+                "(SELECT canal FROM grupos WHERE grupo = ?) GROUP BY canal",
+                (ahora, grupo),
+            ))
+            expira = ahora + self.expiry
+            filas = [
+                (canal, _proceso(canal), contenido, expira)
+                for canal in canales
+                if pendientes.get(canal, 0) < self.get_capacity(canal)
+            ]
+            conexion.executemany(
+                "INSERT INTO mensajes (canal, proceso, contenido, expira) VALUES (?, ?, ?, ?)", filas
+            )
+            return len(filas)
+
+    def _sacar_del_proceso(self):
+        conexion = self._conexion()
+        # Lectura sin bloqueo; la transacción de escritura sólo cuando hay algo
+        if conexion.execute("SELECT 1 FROM mensajes WHERE proceso = ? LIMIT 1", (self.proceso,)).fetchone() is None:
+            return []
+        ahora = time.time()
+        with self._transaccion() as conexion:
+            self._limpiar(conexion, ahora)
+            filas = conexion.execute(
+                "DELETE FROM mensajes WHERE proceso = ? RETURNING id, canal, contenido, expira", (self.proceso,)
+            ).fetchall()
+        # RETURNING no garantiza orden
+        return sorted(filas)
+
+    def _sacar_del_canal(self, canal):
+        with self._transaccion() as conexion:
+            fila = conexion.execute(
+                "DELETE FROM mensajes WHERE id = ("
+                " SELECT id FROM mensajes WHERE canal = ? AND expira > ? ORDER BY id LIMIT 1"
+                ") RETURNING contenido",
+                (canal, time.time()),
+            ).fetchone()
+        return fila[0] if fila else None
+
+    def _agregar_a_grupo(self, grupo, canal):
+        with self._transaccion() as conexion:
+            conexion.execute(
+                "INSERT OR REPLACE INTO grupos (grupo, canal, expira) VALUES (?, ?, ?)",
+                (grupo, canal, time.time() + self.group_expiry),
+            )
+
+    def _quitar_de_grupo(self, grupo, canal):
+        with self._transaccion() as conexion:
+            conexion.execute("DELETE FROM grupos WHERE grupo = ? AND canal = ?", (grupo, canal))
+
+    def _vaciar(self):
+        with self._transaccion() as conexion:
+            conexion.execute("DELETE FROM mensajes")
+            conexion.execute("DELETE FROM grupos")
+
+    async def _en_hilo(self, funcion, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._hilos, funcion, *args)
+
+    # --- API de la capa ---
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        assert "__asgi_channel__" not in message
+        await self._en_hilo(self._insertar, channel, _serializar(message))
+
+    async def receive(self, channel):
+        assert self.valid_channel_name(channel)
+        if _proceso(channel) == self.proceso:
+            return await self._recibir_del_proceso(channel)
+        # Canal compartido: cada receptor pide su mensaje
+        espera = self.espera_minima
+        while True:
+            contenido = await self._en_hilo(self._sacar_del_canal, channel)
+            if contenido is not None:
+                mensaje = _cargar(contenido)
+                if mensaje is not None:
+                    return mensaje
+                continue
+            await asyncio.sleep(espera)
+            espera = min(espera * 2, self.espera_maxima)
+
+    async def new_channel(self, prefix="specific."):
+        aleatorio = "".join(random.choices(string.ascii_letters, k=12))
+        return f"{prefix}.{self.proceso}!{aleatorio}"
+
+    async def flush(self):
+        self._buzones = {}
+        await self._en_hilo(self._vaciar)
+
+    async def close(self):
+        pass
+
+    async def group_add(self, group, channel):
+        assert self.valid_group_name(group), "Group name not valid"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        await self._en_hilo(self._agregar_a_grupo, group, channel)
+
+    async def group_discard(self, group, channel):
+        assert self.valid_channel_name(channel), "Invalid channel name"
+        assert self.valid_group_name(group), "Invalid group name"
+        await self._en_hilo(self._quitar_de_grupo, group, channel)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "Message is not a dict"
+        assert self.valid_group_name(group), "Invalid group name"
+        await self._en_hilo(self._insertar_en_grupo, group, _serializar(message))
+
+    # --- Reparto dentro del proceso ---
+
+    async def _recibir_del_proceso(self, canal):
+        bucle = asyncio.get_running_loop()
+        if self._bucle is not bucle:
+            self._bucle = bucle
+            self._buzones = {nombre: _copiar(cola) for nombre, cola in self._buzones.items()}
+        buzon = self._buzones.setdefault(canal, asyncio.Queue())
+        if self._lector is None or self._lector.done() or self._lector.get_loop() is not bucle:
+            self._lector = bucle.create_task(self._leer())
+        try:
+            while True:
+                expira, mensaje = await buzon.get()
+                if expira > time.time():
+                    return mensaje
+        finally:
+            if buzon.empty() and self._buzones.get(canal) is buzon:
+                del self._buzones[canal]
+
+    async def _leer(self):
+        espera = self.espera_minima
+        while self._buzones:
+            filas = await self._en_hilo(self._sacar_del_proceso)
+            for _, canal, contenido, expira in filas:
+                mensaje = _cargar(contenido)
+                if mensaje is not None:
+                    self._buzones.setdefault(canal, asyncio.Queue()).put_nowait((expira, mensaje))
+            if filas:
+                espera = self.espera_minima
+            else:
+                await asyncio.sleep(espera)
+                espera = min(espera * 2, self.espera_maxima)
+            self._descartar_vencidos()
+
+    def _descartar_vencidos(self):
+        # Buzones de consumers que ya se desconectaron: nadie los va a leer
+        ahora = time.time()
+        for canal, buzon in list(self._buzones.items()):
+            while not buzon.empty() and buzon._queue[0][0] <= ahora:
+                buzon.get_nowait()
+            if buzon.empty() and not buzon._getters:
+                del self._buzones[canal]
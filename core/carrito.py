@@ -0,0 +1,140 @@
+"""
+Carrito de cotización guardado en la sesión.
+
+Junto a ``cotizacion_items`` ({producto_id: cantidad}) se guarda un resumen con
+la cantidad, el total y el precio de cada línea. Las vistas lo mantienen al día
+al agregar o quitar productos, así el badge de ``base.html`` no consulta la base
+de datos. El resumen se descarta cuando cambia la versión de precios, que se
+renueva cada vez que se modifica ``Producto.precio``.
+
+La versión vive en la caché compartida, así un cambio hecho en run_worker o en
+otro proceso de Daphne alcanza a todos. Con una caché por proceso
+(LocMemCache) la versión dura VERSION_POR_PROCESO_SEGUNDOS: al vencer se crea
+otra y los resúmenes se recalculan, así los precios viejos no duran más que eso.
+"""
+import uuid
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.utils.functional import cached_property
+
+from .models import Producto
+from .utils import cache_por_proceso
+
+CLAVE_CARRITO = "cotizacion_items"
+CLAVE_RESUMEN = "cotizacion_resumen"
+CLAVE_VERSION = "carrito:version_precios"
+VERSION_POR_PROCESO_SEGUNDOS = 60
+
+
+def _duracion_version():
+    return VERSION_POR_PROCESO_SEGUNDOS if cache_por_proceso() else None
+
+
+def version_precios():
+    version = cache.get(CLAVE_VERSION)
+    if version is None:
+        # Si la caché se vació no sabemos qué cambió: una versión nueva invalida todo
+        cache.add(CLAVE_VERSION, uuid.uuid4().hex, _duracion_version())
+        version = cache.get(CLAVE_VERSION)
+    return version
+
+
+def invalidar_precios():
+    cache.set(CLAVE_VERSION, uuid.uuid4().hex, _duracion_version())
+
+
+def _guardar(session, carrito, precios):
+    total = Decimal("0.00")
+    for producto_id, cantidad in carrito.items():
+        if producto_id in precios:
+            total += Decimal(precios[producto_id]) * cantidad
+    session[CLAVE_CARRITO] = carrito
+    session[CLAVE_RESUMEN] = {
+        "version": version_precios(),
+        "cantidad": sum(carrito.values()),
+        "total": str(total),
+        "precios": precios,
+    }
+
+
+def _precios_vigentes(session):
+    resumen = session.get(CLAVE_RESUMEN)
+    if resumen and resumen.get("version") == version_precios():
+        return dict(resumen["precios"])
+    return None
+
+
+def reemplazar(session, lineas):
+    """Sustituye el carrito por ``lineas``: una lista de (producto, cantidad)."""
+    carrito = {}
+    precios = {}
+    for producto, cantidad in lineas:
+        clave = str(producto.id)
+        carrito[clave] = carrito.get(clave, 0) + cantidad
+        if producto.precio is not None:
+            precios[clave] = str(producto.precio)
+    _guardar(session, carrito, precios)
+
+
+def agregar(session, lineas):
+    """Suma las cantidades de ``lineas`` (producto, cantidad) al carrito."""
+    carrito = dict(session.get(CLAVE_CARRITO, {}))
+    precios = _precios_vigentes(session)
+    for producto, cantidad in lineas:
+        clave = str(producto.id)
+        carrito[clave] = carrito.get(clave, 0) + cantidad
+        if precios is not None and producto.precio is not None:
+            precios[clave] = str(producto.precio)
+    if precios is None:
+        session[CLAVE_CARRITO] = carrito
+        session.pop(CLAVE_RESUMEN, None)
+    else:
+        _guardar(session, carrito, precios)
+
+
+def quitar(session, producto_id):
+    """Quita una línea del carrito. Devuelve False si no estaba."""
+    carrito = dict(session.get(CLAVE_CARRITO, {}))
+    clave = str(producto_id)
+    if clave not in carrito:
+        return False
+    del carrito[clave]
+    precios = _precios_vigentes(session)
+    if precios is None:
+        session[CLAVE_CARRITO] = carrito
+        session.pop(CLAVE_RESUMEN, None)
+    else:
+        precios.pop(clave, None)
+        _guardar(session, carrito, precios)
+    return True
+
+
+def vaciar(session):
+    _guardar(session, {}, {})
+
+
+class ResumenCarrito:
+    """
+    Cantidad y total del carrito para el badge. Usa el resumen de la sesión y
+    sólo consulta precios (en una sola consulta) cuando el resumen ya no vale.
+    """
+    def __init__(self, session):
+        self.session = session
+
+    @cached_property
+    def cantidad(self):
+        return sum(self.session.get(CLAVE_CARRITO, {}).values())
+
+    @cached_property
+    def total(self):
+        resumen = self.session.get(CLAVE_RESUMEN)
+        if not resumen or resumen.get("version") != version_precios():
+            carrito = self.session.get(CLAVE_CARRITO, {})
+            precios = {}
+            if carrito:
+                filas = Producto.objects.filter(id__in=carrito.keys()).values_list("id", "precio")
+                precios = {str(pk): str(precio) for pk, precio in filas if precio is not None}
+            _guardar(self.session, carrito, precios)
+            resumen = self.session[CLAVE_RESUMEN]
+        return Decimal(resumen["total"])
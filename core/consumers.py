@@ -1,11 +1,47 @@
+import asyncio
 import json
+import logging
+import time
+from collections import deque
+from datetime import timedelta
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+from django.db.models import Max
+from django.utils import timezone
+
+from .events import GRUPO_ADMIN, grupo_productos, valores_productos
+from .models import Aviso
+
+logger = logging.getLogger(__name__)
 
 class NotificacionConsumer(AsyncWebsocketConsumer):
+    """
+    Avisos para el staff. Al conectar se repiten los avisos posteriores a
+    ``?desde=<secuencia>`` y luego llega {"secuencia": N} con la última; cada
+    aviso guardado trae su "secuencia" para pedir lo perdido al reconectar.
+
+    Cada LATIDO_SEGUNDOS el servidor manda {"latido": true} y el navegador
+    contesta: si en INACTIVO_SEGUNDOS no llega nada del navegador se cierra el
+    socket. Los mensajes salen por una cola de COLA_MAXIMA por conexión; si el
+    navegador no alcanza a leerlos se descartan los más viejos en lugar de
+    detener al consumer (y con él su canal en la capa).
+    """
+    LATIDO_SEGUNDOS = 20
+    INACTIVO_SEGUNDOS = 60
+    COLA_MAXIMA = 100
+
     async def connect(self):
         # Verificamos si el usuario es staff (admin o vendedor)
         if self.scope["user"].is_authenticated and self.scope["user"].is_staff:
-            self.room_group_name = "notificaciones_admin"
+            self.room_group_name = GRUPO_ADMIN
+            self.cola = deque(maxlen=self.COLA_MAXIMA)
+            self.hay_mensajes = asyncio.Event()
+            self.descartados = 0
+            self.repetidos = set()
+            self.ultima_actividad = time.monotonic()
 
             # Unirse al grupo de notificaciones
             await self.channel_layer.group_add(
@@ -13,11 +49,24 @@ class NotificacionConsumer(AsyncWebsocketConsumer):
                 self.channel_name
             )
             await self.accept()
+            self.tareas = [asyncio.create_task(self._escribir()), asyncio.create_task(self._latir())]
+
+            # Primero al grupo y luego la consulta: lo que se guarde en medio llega
+            # por los dos lados y el repetido se descarta (self.repetidos)
+            avisos, ultima = await self._avisos_desde(self._desde())
+            for aviso in avisos:
+                await self.dispatch(aviso)
+            self.repetidos = {aviso['secuencia'] for aviso in avisos}
+            self._encolar({'secuencia': ultima})
         else:
             # Si no es staff, rechazamos la conexión al socket
             await self.close()
 
     async def disconnect(self, close_code):
+        for tarea in getattr(self, 'tareas', ()):
+            tarea.cancel()
+        if getattr(self, 'descartados', 0):
+            logger.warning("Se descartaron %s avisos de %s (no los leía)", self.descartados, self.scope["user"])
         # Salir del grupo al desconectarse
         if hasattr(self, 'room_group_name'):
             await self.channel_layer.group_discard(
@@ -25,16 +74,136 @@ class NotificacionConsumer(AsyncWebsocketConsumer):
                 self.channel_name
             )
 
-    # Este método se activa cuando el Signal envía un mensaje de tipo "enviar_alerta"
-    async def enviar_alerta(self, event):
-        mensaje = event['mensaje']
-        total = event['total']
-        cliente = event['cliente']
+    async def receive(self, text_data=None, bytes_data=None):
+        # El navegador sólo contesta los latidos
+        self.ultima_actividad = time.monotonic()
+
+    def _desde(self):
+        try:
+            return int(parse_qs(self.scope.get("query_string", b"").decode())["desde"][0])
+        except (KeyError, ValueError):
+            return None
+
+    @database_sync_to_async
+    def _avisos_desde(self, desde):
+        avisos = Aviso.objects.filter(grupo=self.room_group_name)
+        ultima = avisos.aggregate(ultima=Max("pk"))["ultima"] or 0
+        if desde is None:
+            return [], ultima
+        limite = timezone.now() - timedelta(seconds=settings.AVISOS_HISTORIAL_SEGUNDOS)
+        # Los más recientes, si se perdieron más de los que caben en la cola
+        recientes = avisos.filter(pk__gt=desde, creado__gte=limite).order_by("-pk")[:self.COLA_MAXIMA]
+        return [{**aviso.contenido, 'secuencia': aviso.pk} for aviso in reversed(recientes)], ultima
+
+    def _encolar(self, datos, event=None):
+        secuencia = (event or {}).get('secuencia')
+        if secuencia is not None:
+            if secuencia in self.repetidos:
+                return
+            datos['secuencia'] = secuencia
+        if len(self.cola) == self.cola.maxlen:
+            self.descartados += 1
+        self.cola.append(json.dumps(datos))
+        self.hay_mensajes.set()
+
+    async def _escribir(self):
+        while True:
+            await self.hay_mensajes.wait()
+            self.hay_mensajes.clear()
+            while self.cola:
+                await self.send(text_data=self.cola.popleft())
+
+    async def _latir(self):
+        while True:
+            await asyncio.sleep(self.LATIDO_SEGUNDOS)
+            if time.monotonic() - self.ultima_actividad > self.INACTIVO_SEGUNDOS:
+                await self.close(code=4408)
+                return
+            self._encolar({'latido': True})
+
+    # Un método por evento de core.events (el "tipo" de cada clase)
 
-        # Enviar la información al frontend vía WebSocket
-        await self.send(text_data=json.dumps({
+    async def pedido_nuevo(self, event):
+        self._encolar({
             'titulo': '¡Nuevo Pedido!',
-            'mensaje': mensaje,
-            'total': total,
-            'cliente': cliente
-        }))
\ No newline at end of file
+            'mensaje': f"Pedido #{event['pedido_id']} recibido",
+            'total': event['total'],
+            'cliente': event['cliente'],
+        }, event)
+
+    async def cotizacion_convertida(self, event):
+        self._encolar({
+            'titulo': '¡Nuevo Pedido Confirmado! 📦',
+            'mensaje': f"La cotización #{event['cotizacion_id']} ha sido convertida",
+            'total': event['total'],
+            'cliente': event['cliente'],
+        }, event)
+
+    # Avance de los trabajos en segundo plano (core.trabajos)
+    async def progreso_trabajo(self, event):
+        self._encolar({
+            'titulo': event['titulo'],
+            'mensaje': event['mensaje'],
+            'trabajo': event['id'],
+            'estado': event['estado'],
+            'progreso': event['progreso'],
+            'resultado': event['resultado'],
+        }, event)
+
+
+class ProductosConsumer(AsyncWebsocketConsumer):
+    """
+    Precios y existencias en vivo para cualquier visitante. El navegador manda
+    {"productos": [ids en pantalla]} (cada mensaje reemplaza la lista) y recibe
+    {"productos": {id: [existencia, precio]}} con lo que cambió; null si se borró.
+    Al suscribirse recibe de inmediato los valores actuales de los ids nuevos: la
+    página pudo salir de la caché o algo pudo cambiar mientras se reconectaba.
+
+    El socket es público y cada lista nueva escribe en la capa (group_add y
+    group_discard): se toman a lo más MAXIMO_PRODUCTOS, se ignoran los mensajes
+    de más de MAXIMO_BYTES y quien mande más de SUSCRIPCIONES_POR_MINUTO listas
+    se desconecta (una página manda una sola, al conectar).
+    """
+    MAXIMO_PRODUCTOS = 200
+    MAXIMO_BYTES = 8192
+    SUSCRIPCIONES_POR_MINUTO = 10
+
+    async def connect(self):
+        self.productos = set()
+        self.grupos = set()
+        self.suscripciones = deque(maxlen=self.SUSCRIPCIONES_POR_MINUTO)
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        for grupo in getattr(self, 'grupos', ()):
+            await self.channel_layer.group_discard(grupo, self.channel_name)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        ahora = time.monotonic()
+        if len(self.suscripciones) == self.suscripciones.maxlen and ahora - self.suscripciones[0] < 60:
+            await self.close(code=4429)
+            return
+        self.suscripciones.append(ahora)
+        if text_data is None or len(text_data) > self.MAXIMO_BYTES:
+            return
+        try:
+            productos = {int(i) for i in json.loads(text_data)["productos"][:self.MAXIMO_PRODUCTOS]}
+        except (TypeError, ValueError, KeyError):
+            return
+        grupos = {grupo_productos(i) for i in productos}
+        for grupo in grupos - self.grupos:
+            await self.channel_layer.group_add(grupo, self.channel_name)
+        for grupo in self.grupos - grupos:
+            await self.channel_layer.group_discard(grupo, self.channel_name)
+        nuevos = productos - self.productos
+        self.productos, self.grupos = productos, grupos
+        # Después de unirse a los grupos: lo que cambie en medio llega dos veces, no ninguna
+        if nuevos:
+            valores = await database_sync_to_async(valores_productos)(nuevos)
+            await self.send(text_data=json.dumps({'productos': {str(pk): valores.get(pk) for pk in nuevos}}))
+
+    async def productos_cambiados(self, event):
+        # La cubeta trae también productos que este socket no muestra
+        cambios = {pid: valores for pid, valores in event['cambios'].items() if int(pid) in self.productos}
+        if cambios:
+            await self.send(text_data=json.dumps({'productos': cambios}))
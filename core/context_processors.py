@@ -1,22 +1,18 @@
-from .models import Producto
+from .carrito import ResumenCarrito
 
 def carrito_context(request):
     """
     Context processor que devuelve el número de productos en el carrito
     y el total acumulado.
     """
-    carrito = request.session.get("cotizacion_items", {})
-    total_items = sum(carrito.values())
-    total_precio = 0
-
-    for producto_id, cantidad in carrito.items():
-        try:
-            producto = Producto.objects.get(id=producto_id)
-            total_precio += producto.precio * cantidad
-        except Producto.DoesNotExist:
-            continue
+    resumen = getattr(request, "_resumen_carrito", None)
+    if resumen is None:
+        resumen = ResumenCarrito(request.session)
+        request._resumen_carrito = resumen
 
+    # Las plantillas llaman a los callables al usarlos, así que las páginas
+    # que no muestran el carrito no tocan la sesión ni la base de datos.
     return {
-        "carrito_count": total_items,
-        "carrito_total": total_precio,
+        "carrito_count": lambda: resumen.cantidad,
+        "carrito_total": lambda: resumen.total,
     }
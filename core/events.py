@@ -0,0 +1,260 @@
+"""
+Eventos que se avisan por WebSocket.
+
+Cada aviso es una clase con sus campos, el grupo al que va y el método del
+consumer que lo atiende (``tipo``). Señales, vistas y trabajos sólo llaman
+``publicar(evento)``: el evento sale cuando se confirma la transacción, por la
+bandeja de salida (``core.bandeja_salida``), sin bloquear la petición.
+
+Los eventos con ``intervalo`` se agrupan por ``clave()``: de los que llegan
+dentro del intervalo sólo se manda el último, al terminar el intervalo. Una
+importación que reporta cada lote manda a lo más un avance por segundo. Los
+eventos ``final`` (un trabajo terminado) salen de inmediato y descartan el
+avance que estuviera esperando. Un evento puede juntarse con el que esperaba
+(``combinar``) en lugar de reemplazarlo, como los cambios de productos.
+
+Los eventos con ``guardar`` (los avisos a los admins) salen con número de
+secuencia y se repiten a quien se reconecte después de perderlos.
+"""
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import ClassVar, Optional
+
+from django.db import transaction
+
+from . import bandeja_salida
+from .models import Cliente, Pedido, Producto
+
+GRUPO_ADMIN = "notificaciones_admin"
+# Los clientes que ven productos se reparten en estos grupos según el id:
+# cada socket sólo recibe los cambios de las cubetas de lo que tiene en pantalla.
+CUBETAS_PRODUCTOS = 32
+
+
+def grupo_productos(producto_id):
+    return f"productos.{producto_id % CUBETAS_PRODUCTOS}"
+
+
+@dataclass(frozen=True)
+class Evento:
+    grupo: ClassVar[str] = GRUPO_ADMIN
+    # Nombre del método de NotificacionConsumer que lo recibe
+    tipo: ClassVar[str]
+    intervalo: ClassVar[float] = 0
+
+    @property
+    def final(self):
+        return False
+
+    @property
+    def guardar(self):
+        """Si se guarda con secuencia para repetirlo a quien se reconecte; los avisos a los admins sí."""
+        return self.grupo == GRUPO_ADMIN
+
+    def clave(self):
+        return None
+
+    def combinar(self, pendiente):
+        """El evento que sale en lugar de ``pendiente`` (de la misma clave) y este; por omisión, el último."""
+        return self
+
+    def contenido(self):
+        """Mensaje para la capa de canales."""
+        return {"type": self.tipo, **asdict(self)}
+
+
+@dataclass(frozen=True)
+class PedidoNuevo(Evento):
+    """Total y cliente los completa ``completar_datos_pedido`` en lote, ya confirmada la transacción."""
+    tipo: ClassVar[str] = "pedido_nuevo"
+    pedido_id: int
+
+
+@dataclass(frozen=True)
+class CotizacionConvertida(Evento):
+    tipo: ClassVar[str] = "cotizacion_convertida"
+    cotizacion_id: int
+    pedido_id: int
+    total: str
+    cliente_id: int
+
+
+@dataclass(frozen=True)
+class ProgresoTrabajo(Evento):
+    tipo: ClassVar[str] = "progreso_trabajo"
+    intervalo: ClassVar[float] = 1.0
+    id: int
+    titulo: str
+    estado: str
+    progreso: int
+    mensaje: str = ""
+    resultado: Optional[str] = None
+
+    @property
+    def final(self):
+        return self.estado in ("terminado", "fallido")
+
+    @property
+    def guardar(self):
+        # Un avance viejo no sirve de nada al reconectar; el resultado sí
+        return self.final
+
+    def clave(self):
+        return self.id
+
+
+@dataclass(frozen=True)
+class ProductosCambiados(Evento):
+    """
+    Productos de una cubeta con precio o existencia nuevos. Sólo lleva los ids:
+    los valores se leen al enviar (``completar_productos``), ya confirmados.
+    """
+    tipo: ClassVar[str] = "productos_cambiados"
+    intervalo: ClassVar[float] = 0.5
+    cubeta: int
+    ids: frozenset
+
+    @classmethod
+    def de(cls, ids):
+        """Un evento por cubeta para ``ids``."""
+        por_cubeta = {}
+        for producto_id in ids:
+            por_cubeta.setdefault(producto_id % CUBETAS_PRODUCTOS, set()).add(producto_id)
+        return [cls(cubeta=cubeta, ids=frozenset(grupo)) for cubeta, grupo in por_cubeta.items()]
+
+    @property
+    def grupo(self):
+        return grupo_productos(self.cubeta)
+
+    def clave(self):
+        return self.cubeta
+
+    def combinar(self, pendiente):
+        return ProductosCambiados(cubeta=self.cubeta, ids=self.ids | pendiente.ids)
+
+
+# --- Datos que se completan en lote al enviar (una consulta por lote, fuera de la petición) ---
+
+@bandeja_salida.preparador(PedidoNuevo.tipo)
+def completar_datos_pedido(mensajes):
+    # Ya confirmada la transacción el total incluye todas las partidas
+    pedidos = {
+        pk: (total, usuario)
+        for pk, total, usuario in Pedido.objects.filter(pk__in={m["pedido_id"] for m in mensajes})
+        .values_list("pk", "total", "cliente__usuario__username")
+    }
+    for mensaje in mensajes:
+        total, usuario = pedidos.get(mensaje["pedido_id"], (0, ""))
+        mensaje["total"] = str(total)
+        mensaje["cliente"] = usuario or ""
+
+
+@bandeja_salida.preparador(CotizacionConvertida.tipo)
+def completar_nombre_cliente(mensajes):
+    clientes = {
+        pk: f"{nombre} {apellido}".strip() or usuario
+        for pk, nombre, apellido, usuario in Cliente.objects.filter(pk__in={m["cliente_id"] for m in mensajes})
+        .values_list("pk", "usuario__first_name", "usuario__last_name", "usuario__username")
+    }
+    for mensaje in mensajes:
+        mensaje["cliente"] = clientes.get(mensaje["cliente_id"]) or ""
+
+
+def valores_productos(ids):
+    """{id: [existencia, precio]} de los productos ``ids`` que existen, en una consulta."""
+    return {
+        pk: [existencia, str(precio) if precio is not None else None]
+        for pk, existencia, precio in Producto.objects.filter(pk__in=ids).values_list("pk", "existencia", "precio")
+    }
+
+
+@bandeja_salida.preparador(ProductosCambiados.tipo)
+def completar_productos(mensajes):
+    valores = valores_productos(set().union(*(m["ids"] for m in mensajes)))
+    for mensaje in mensajes:
+        # None: el producto se borró
+        mensaje["cambios"] = {str(pk): valores.get(pk) for pk in mensaje.pop("ids")}
+
+
+class _Agrupador:
+    """Deja pasar un evento por clave cada ``intervalo``; el último que llegó en medio sale al vencer."""
+
+    def __init__(self):
+        self._candado = threading.Lock()
+        self._ultimo_envio = {}
+        self._pendientes = {}
+
+    def publicar(self, evento):
+        clave = (type(evento), evento.clave())
+        with self._candado:
+            ahora = time.monotonic()
+            if evento.final:
+                self._pendientes.pop(clave, None)
+                self._ultimo_envio.pop(clave, None)
+                enviar = True
+            elif ahora - self._ultimo_envio.get(clave, float("-inf")) >= evento.intervalo:
+                self._ultimo_envio[clave] = ahora
+                enviar = True
+            else:
+                if clave in self._pendientes:
+                    evento = evento.combinar(self._pendientes[clave])
+                else:
+                    espera = self._ultimo_envio[clave] + evento.intervalo - ahora
+                    temporizador = threading.Timer(espera, self._vencer, (clave,))
+                    temporizador.daemon = True
+                    temporizador.start()
+                self._pendientes[clave] = evento
+                enviar = False
+        if enviar:
+            _enviar(evento)
+
+    def vaciar(self):
+        """Manda ya los eventos que esperaban su intervalo."""
+        with self._candado:
+            pendientes, self._pendientes = self._pendientes, {}
+            ahora = time.monotonic()
+            for clave in pendientes:
+                self._ultimo_envio[clave] = ahora
+        for evento in pendientes.values():
+            _enviar(evento)
+
+    def _vencer(self, clave):
+        with self._candado:
+            evento = self._pendientes.pop(clave, None)
+            if evento is not None:
+                self._ultimo_envio[clave] = time.monotonic()
+        if evento is not None:
+            _enviar(evento)
+
+
+_agrupador = _Agrupador()
+
+
+def _enviar(evento):
+    bandeja_salida.encolar(evento.grupo, evento.contenido(), evento.guardar)
+
+
+def publicar(*eventos, using=None):
+    """Manda los ``eventos`` a sus grupos cuando se confirme la transacción actual."""
+    if eventos:
+        transaction.on_commit(lambda: _publicar_ya(eventos), using=using, robust=True)
+
+
+def _publicar_ya(eventos):
+    for evento in eventos:
+        if evento.intervalo:
+            _agrupador.publicar(evento)
+        else:
+            _enviar(evento)
+
+
+def publicar_productos(ids, using=None):
+    """Avisa a quien tenga en pantalla alguno de ``ids`` que cambió su precio o existencia."""
+    publicar(*ProductosCambiados.de(ids), using=using)
+
+
+def esperar():
+    """Manda los eventos agrupados que esperaban y espera a que salgan todos (pruebas, cierre ordenado)."""
+    _agrupador.vaciar()
+    bandeja_salida.esperar()
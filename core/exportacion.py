@@ -0,0 +1,127 @@
+"""
+Exportaciones grandes sin cargar todo en memoria.
+
+Cada exportación es una lista de columnas (cabecera, ruta para ``values_list``):
+los nombres de categoría, marca, cliente, etc. salen del mismo SELECT con JOIN
+y las filas se leen con ``iterator()`` por bloques. El CSV se manda mientras se
+genera (``StreamingHttpResponse``); el XLSX se escribe con openpyxl en modo
+sólo escritura a un archivo temporal que después se envía desde disco.
+"""
+import csv
+import tempfile
+from datetime import datetime
+from decimal import Decimal
+
+from django.db.models import DecimalField, ExpressionWrapper, F
+from django.http import FileResponse, Http404, StreamingHttpResponse
+from django.utils import timezone
+from openpyxl import Workbook
+
+from .models import Cliente, Pedido, PedidoItem, Producto
+
+TAMANO_BLOQUE = 2000
+CENTAVOS = Decimal("0.01")
+
+# Mismas cabeceras que entiende ProductoResource, así el archivo se puede volver a importar
+COLUMNAS = {
+    "productos": [
+        ("Clave", "clave"), ("Descripcion", "nombre"), ("Categoria", "categoria__nombre"),
+        ("Marca", "marca__nombre"), ("Proveedor", "proveedor__nombre"), ("Departamento", "departamento"),
+        ("Precio", "precio"), ("Existencia", "existencia"),
+    ],
+    "clientes": [
+        ("Nombre", "nombre"), ("Correo", "correo"), ("Teléfono", "telefono"), ("RFC", "rfc"),
+        ("Dirección", "direccion"), ("Ciudad", "ciudad"), ("Estado", "estado"),
+        ("Código postal", "codigo_postal"), ("Registro", "fecha_registro"),
+    ],
+    "pedidos": [
+        ("Pedido", "id"), ("Fecha", "fecha"), ("Cliente", "cliente__nombre"), ("RFC", "cliente__rfc"),
+        ("Estado", "estado"), ("Total", "total"),
+    ],
+    "pedido_items": [
+        ("Pedido", "pedido_id"), ("Fecha", "pedido__fecha"), ("Cliente", "pedido__cliente__nombre"),
+        ("Estado", "pedido__estado"), ("Clave", "producto__clave"), ("Producto", "producto__nombre"),
+        ("Cantidad", "cantidad"), ("Precio unitario", "precio_unitario"), ("Subtotal", "subtotal"),
+    ],
+}
+
+
+def queryset_base(nombre):
+    if nombre == "productos":
+        return Producto.objects.order_by("id")
+    if nombre == "clientes":
+        return Cliente.objects.order_by("id")
+    if nombre == "pedidos":
+        return Pedido.objects.order_by("id")
+    if nombre == "pedido_items":
+        subtotal = ExpressionWrapper(F("cantidad") * F("precio_unitario"), output_field=DecimalField())
+        return PedidoItem.objects.annotate(subtotal=subtotal).order_by("pedido_id", "id")
+    raise Http404("Exportación desconocida")
+
+
+def filas(nombre, queryset=None):
+    """Cabecera y después una tupla por registro, leyendo la base por bloques."""
+    if queryset is None:
+        queryset = queryset_base(nombre)
+    columnas = COLUMNAS[nombre]
+    yield [cabecera for cabecera, _ in columnas]
+    yield from queryset.values_list(*(ruta for _, ruta in columnas)).iterator(chunk_size=TAMANO_BLOQUE)
+
+
+def _formatear(valor):
+    # Excel no admite fechas con zona horaria: se guardan en la hora local
+    if isinstance(valor, datetime) and timezone.is_aware(valor):
+        return timezone.make_naive(valor).replace(microsecond=0)
+    # Todos los importes del modelo llevan dos decimales; los calculados (subtotal) también
+    if isinstance(valor, Decimal):
+        return valor.quantize(CENTAVOS)
+    return valor
+
+
+class _Eco:
+    """csv.writer escribe aquí y la línea se devuelve tal cual al StreamingHttpResponse."""
+    def write(self, valor):
+        return valor
+
+
+def _con_bom(contenido):
+    yield "\ufeff"
+    yield from contenido
+
+
+def respuesta_csv(nombre, queryset=None):
+    escritor = csv.writer(_Eco())
+    contenido = (escritor.writerow([_formatear(valor) for valor in fila]) for fila in filas(nombre, queryset))
+    # El BOM hace que Excel abra bien los acentos
+    respuesta = StreamingHttpResponse(_con_bom(contenido), content_type="text/csv; charset=utf-8")
+    respuesta["Content-Disposition"] = f'attachment; filename="{nombre}.csv"'
+    return respuesta
+
+
+def escribir_xlsx(archivo, nombre, queryset=None, al_avanzar=None):
+    """Escribe el libro en ``archivo``; ``al_avanzar(filas)`` se llama cada TAMANO_BLOQUE filas."""
+    libro = Workbook(write_only=True)
+    hoja = libro.create_sheet(nombre)
+    for numero, fila in enumerate(filas(nombre, queryset)):
+        hoja.append([_formatear(valor) for valor in fila])
+        if al_avanzar is not None and numero and numero % TAMANO_BLOQUE == 0:
+            al_avanzar(numero)
+    libro.save(archivo)
+
+
+def respuesta_xlsx(nombre, queryset=None):
+    # TemporaryFile se borra solo cuando FileResponse lo cierra al terminar de enviarlo
+    archivo = tempfile.TemporaryFile(suffix=".xlsx")
+    escribir_xlsx(archivo, nombre, queryset)
+    archivo.seek(0)
+    return FileResponse(archivo, as_attachment=True, filename=f"{nombre}.xlsx")
+
+
+def respuesta(nombre, formato, queryset=None):
+    if nombre not in COLUMNAS:
+        raise Http404("Exportación desconocida")
+    if formato == "csv":
+        return respuesta_csv(nombre, queryset)
+    if formato == "xlsx":
+        return respuesta_xlsx(nombre, queryset)
+    raise Http404("Formato desconocido")
@@ -0,0 +1,63 @@
+"""
+Listas de categorías, marcas y proveedores (con su número de productos) para
+los filtros del catálogo. Sólo cambian al editar esos catálogos o al importar
+productos, así que se guardan en la caché de Django y las señales las invalidan.
+Las importaciones corren en run_worker o en importar_productos: para que la
+invalidación llegue a los procesos web la caché tiene que ser compartida. Si es
+una por proceso (LocMemCache) las facetas duran sólo DURACION_POR_PROCESO.
+"""
+import threading
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from django.db.models import Count
+
+from .models import Categoria, Marca, Proveedor
+from .utils import cache_por_proceso
+
+CLAVE = "catalogo:facetas"
+# Por si alguna invalidación se pierde (p. ej. cambios hechos con update())
+DURACION = 60 * 60
+DURACION_POR_PROCESO = 60
+
+_estado = threading.local()
+
+
+def obtener_facetas():
+    facetas = cache.get(CLAVE)
+    if facetas is None:
+        facetas = {
+            "categorias": list(
+                Categoria.objects.annotate(num_productos=Count("productos")).order_by("nombre")
+                .values("id", "nombre", "num_productos")
+            ),
+            "marcas": list(
+                Marca.objects.annotate(num_productos=Count("producto")).order_by("nombre")
+                .values("id", "nombre", "num_productos")
+            ),
+            "proveedores": list(
+                Proveedor.objects.annotate(num_productos=Count("producto")).order_by("nombre")
+                .values("id", "nombre", "num_productos")
+            ),
+        }
+        cache.set(CLAVE, facetas, DURACION_POR_PROCESO if cache_por_proceso() else DURACION)
+    return facetas
+
+
+def invalidar():
+    """Descarta las facetas, o lo deja para el final si hay una invalidación diferida activa."""
+    if not getattr(_estado, "diferida", False):
+        cache.delete(CLAVE)
+
+
+@contextmanager
+def invalidacion_diferida():
+    """Durante una importación las facetas se invalidan una sola vez, al terminar."""
+    anterior = getattr(_estado, "diferida", False)
+    _estado.diferida = True
+    try:
+        yield
+    finally:
+        _estado.diferida = anterior
+        if not anterior:
+            cache.delete(CLAVE)
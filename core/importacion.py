@@ -0,0 +1,305 @@
+"""
+Motor de importación masiva del catálogo.
+
+Hace lo mismo que ``ProductoResource`` (mismas cabeceras, mismos widgets de
+limpieza, misma regla para omitir filas vacías) pero por conjuntos: lee el
+libro en modo sólo lectura fila por fila, resuelve categorías, marcas y
+proveedores con diccionarios construidos una vez, compara contra los
+productos existentes (una consulta, por clave) y escribe cada lote con
+``bulk_create``/``bulk_update``.
+"""
+import csv
+import io
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+from itertools import count, islice
+
+import django
+from django.db import transaction
+from openpyxl import load_workbook
+
+from . import busqueda, cache_paginas, carrito, events, facetas
+from .models import Categoria, Marca, Producto, Proveedor
+from .resources import DineroWidget, ExistenciaWidget, mapear_cabeceras
+from .utils import ResolutorNombres, normalizar_texto
+
+TAMANO_LOTE = 1000
+# Columnas de Producto que controla la importación, en el orden de la comparación
+CAMPOS = ("nombre", "departamento", "precio", "existencia", "categoria_id", "marca_id", "proveedor_id")
+RELACIONES = (("categoria", Categoria), ("marca", Marca), ("proveedor", Proveedor))
+
+
+def leer_filas(archivo):
+    """
+    Genera las filas (tuplas) de un .xlsx o .csv, empezando por la cabecera.
+    ``archivo`` puede ser una ruta o un archivo abierto en modo binario.
+    """
+    if isinstance(archivo, (str, os.PathLike)):
+        with open(archivo, "rb") as manejador:
+            yield from leer_filas(manejador)
+        return
+
+    if str(getattr(archivo, "name", "")).lower().endswith(".csv"):
+        texto = io.TextIOWrapper(archivo, encoding="utf-8-sig", newline="")
+        try:
+            yield from map(tuple, csv.reader(texto))
+        finally:
+            texto.detach()
+        return
+
+    libro = load_workbook(archivo, read_only=True, data_only=True)
+    try:
+        yield from libro.active.iter_rows(values_only=True)
+    finally:
+        libro.close()
+
+
+def contar_filas(ruta):
+    """Filas de datos (sin la cabecera) de un .xlsx o .csv, para mostrar el avance. Puede ser aproximado."""
+    if str(ruta).lower().endswith(".csv"):
+        with open(ruta, "rb") as manejador:
+            return max(0, sum(1 for _ in manejador) - 1)
+    libro = load_workbook(ruta, read_only=True)
+    try:
+        return max(0, (libro.active.max_row or 1) - 1)
+    finally:
+        libro.close()
+
+
+def _vacio(valor):
+    return valor is None or str(valor).strip().lower() in ("", "none", "nan")
+
+
+_DINERO = DineroWidget()
+_EXISTENCIA = ExistenciaWidget()
+
+
+def limpiar_fila(cabecera, valores):
+    """
+    Convierte una fila del Excel en un dict con los valores ya limpios, o None
+    si se omite. Categoría, marca y proveedor quedan como (nombre, nombre normalizado).
+    """
+    fila = dict(zip(cabecera, valores))
+    clave, nombre = fila.get("clave"), fila.get("descripcion_1")
+    # Misma regla que ProductoResource.skip_row
+    if not clave or not nombre or str(nombre).strip() == "":
+        return None
+    departamento = fila.get("departamento")
+    datos = {
+        "clave": str(clave).strip(),
+        "nombre": str(nombre).strip(),
+        "departamento": None if _vacio(departamento) else str(departamento).strip(),
+        "precio": Decimal(str(_DINERO.clean(fila.get("precio")))).quantize(Decimal("0.01")),
+        "existencia": _EXISTENCIA.clean(fila.get("existencia")),
+    }
+    for campo, _ in RELACIONES:
+        valor = fila.get(campo)
+        datos[campo] = None if _vacio(valor) else (str(valor).strip(), normalizar_texto(valor))
+    return datos
+
+
+def limpiar_lote(cabecera, lote, primera_fila):
+    """
+    Limpia y valida un lote sin tocar la base de datos, así puede correr en
+    otro proceso. Devuelve ({clave: datos}, filas omitidas, [(fila, error)]).
+    """
+    limpias = {}
+    omitidos = 0
+    errores = []
+    for numero, valores in enumerate(lote, start=primera_fila):
+        try:
+            datos = limpiar_fila(cabecera, valores)
+        except Exception as e:
+            errores.append((numero, str(e)))
+            continue
+        if datos is None:
+            omitidos += 1
+        elif datos["categoria"] is None:
+            errores.append((numero, "Falta la categoría"))
+        else:
+            # Si una clave se repite en el archivo gana la última fila
+            limpias[datos["clave"]] = datos
+    return limpias, omitidos, errores
+
+
+class ResultadoImportacion:
+    def __init__(self):
+        self.nuevos = 0
+        self.actualizados = 0
+        self.sin_cambios = 0
+        self.omitidos = 0
+        self.errores = []  # (número de fila, mensaje)
+        self.cambios = []  # sólo en dry_run: (clave, None si es nuevo o {campo: (antes, después)})
+
+    @property
+    def filas(self):
+        return self.nuevos + self.actualizados + self.sin_cambios + self.omitidos + len(self.errores)
+
+    def __str__(self):
+        return (
+            f"{self.nuevos} nuevos, {self.actualizados} actualizados, {self.sin_cambios} sin cambios, "
+            f"{self.omitidos} omitidos, {len(self.errores)} con error"
+        )
+
+
+class ImportadorProductos:
+    """
+    Importa el Excel de un proveedor. Con ``dry_run`` sólo calcula qué pasaría:
+    no crea productos ni categorías, marcas o proveedores. Con ``procesos`` > 1
+    la limpieza de las filas se reparte entre varios procesos.
+    """
+    def __init__(self, dry_run=False, tamano_lote=TAMANO_LOTE, procesos=1):
+        self.dry_run = dry_run
+        self.tamano_lote = tamano_lote
+        self.procesos = procesos
+        self.resolutores = {campo: ResolutorNombres(modelo) for campo, modelo in RELACIONES}
+        self._existentes = None
+        self.precios_cambiaron = False
+
+    def existentes(self):
+        """{clave: (id, nombre, departamento, precio, ...)} de todo el catálogo, en una consulta."""
+        if self._existentes is None:
+            self._existentes = {
+                clave: (pk, *valores)
+                for clave, pk, *valores in Producto.objects.values_list("clave", "pk", *CAMPOS).iterator(chunk_size=5000)
+            }
+        return self._existentes
+
+    def importar_archivo(self, archivo):
+        return self.importar(leer_filas(archivo))
+
+    def importar(self, filas, lote_inicial=0, al_terminar_lote=None):
+        """
+        ``filas``: iterable de tuplas cuya primera fila es la cabecera. Los
+        lotes anteriores a ``lote_inicial`` se leen pero no se procesan (para
+        reanudar). ``al_terminar_lote(numero_lote, filas_del_lote, resultado)``
+        se llama después de confirmar cada lote.
+        """
+        filas = iter(filas)
+        cabecera = mapear_cabeceras(next(filas, ()))
+        resultado = ResultadoImportacion()
+        lotes = self._lotes(filas, lote_inicial)
+        if self.procesos > 1:
+            limpios = self._limpiar_en_paralelo(cabecera, lotes)
+        else:
+            limpios = ((n, len(lote), limpiar_lote(cabecera, lote, primera)) for n, primera, lote in lotes)
+
+        for numero_lote, filas_lote, limpio in limpios:
+            self.escribir_lote(limpio, resultado)
+            if al_terminar_lote is not None:
+                al_terminar_lote(numero_lote, filas_lote, resultado)
+        self.terminar()
+        return resultado
+
+    def _lotes(self, filas, lote_inicial):
+        """(número de lote, número de la primera fila, filas) a partir de ``lote_inicial``."""
+        primera_fila = 2  # la fila 1 es la cabecera
+        for numero_lote in count():
+            lote = list(islice(filas, self.tamano_lote))
+            if not lote:
+                return
+            if numero_lote >= lote_inicial:
+                yield numero_lote, primera_fila, lote
+            primera_fila += len(lote)
+
+    def _limpiar_en_paralelo(self, cabecera, lotes):
+        """
+        Reparte la limpieza de los lotes entre ``procesos`` procesos y devuelve
+        los resultados en el orden del archivo, para que las escrituras sigan
+        saliendo de un solo proceso (SQLite admite un escritor a la vez). Sólo
+        se adelantan unos cuantos lotes para no cargar el archivo entero en memoria.
+        """
+        # django.setup por si los procesos arrancan con spawn (Windows, macOS)
+        with ProcessPoolExecutor(self.procesos, initializer=django.setup) as pool:
+            pendientes = deque()
+            for numero_lote, primera_fila, lote in lotes:
+                futuro = pool.submit(limpiar_lote, cabecera, lote, primera_fila)
+                pendientes.append((numero_lote, len(lote), futuro))
+                if len(pendientes) >= 2 * self.procesos:
+                    numero_lote, filas_lote, futuro = pendientes.popleft()
+                    yield numero_lote, filas_lote, futuro.result()
+            while pendientes:
+                numero_lote, filas_lote, futuro = pendientes.popleft()
+                yield numero_lote, filas_lote, futuro.result()
+
+    def terminar(self):
+        if self.dry_run:
+            return
+        facetas.invalidar()
+        cache_paginas.invalidar()
+        if self.precios_cambiaron:
+            carrito.invalidar_precios()
+
+    def escribir_lote(self, limpio, resultado):
+        """Aplica el resultado de ``limpiar_lote``; siempre corre en el proceso principal."""
+        limpias, omitidos, errores = limpio
+        resultado.omitidos += omitidos
+        resultado.errores.extend(errores)
+        if self.dry_run:
+            self._aplicar(limpias, resultado)
+        else:
+            with transaction.atomic():
+                self._aplicar(limpias, resultado)
+
+    def _aplicar(self, limpias, resultado):
+        objetos = {}
+        for campo, _ in RELACIONES:
+            nombres = {datos[campo][0] for datos in limpias.values() if datos[campo]}
+            objetos[campo] = self.resolutores[campo].obtener_varios(nombres, crear=not self.dry_run)
+
+        existentes = self.existentes()
+        nuevos = []
+        cambiados = []
+        for clave, datos in limpias.items():
+            ids = {
+                f"{campo}_id": getattr(objetos[campo].get(datos[campo][1]), "pk", None)
+                for campo, _ in RELACIONES if datos[campo]
+            }
+            valores = {
+                "nombre": datos["nombre"],
+                "departamento": datos["departamento"],
+                "precio": datos["precio"],
+                "existencia": datos["existencia"],
+                "categoria_id": ids["categoria_id"],
+                "marca_id": ids.get("marca_id"),
+                "proveedor_id": ids.get("proveedor_id"),
+            }
+            actual = existentes.get(clave)
+            if actual is None:
+                nuevos.append(Producto(clave=clave, **valores))
+                if self.dry_run:
+                    resultado.cambios.append((clave, None))
+                continue
+            anteriores = dict(zip(CAMPOS, actual[1:]))
+            if anteriores == valores:
+                resultado.sin_cambios += 1
+                continue
+            if anteriores["precio"] != valores["precio"]:
+                self.precios_cambiaron = True
+            if self.dry_run:
+                resultado.cambios.append((clave, {
+                    campo: (anteriores[campo], valor)
+                    for campo, valor in valores.items() if anteriores[campo] != valor
+                }))
+            cambiados.append(Producto(pk=actual[0], clave=clave, **valores))
+
+        resultado.nuevos += len(nuevos)
+        resultado.actualizados += len(cambiados)
+        if self.dry_run:
+            return
+
+        Producto.objects.bulk_create(nuevos, batch_size=500)
+        Producto.objects.bulk_update(cambiados, CAMPOS, batch_size=500)
+
+        # Con bulk_* no hay señales: se actualizan el diccionario de existentes y el índice aquí
+        claves = [p.clave for p in nuevos] + [p.clave for p in cambiados]
+        filas = Producto.objects.filter(clave__in=claves).values_list("clave", "pk", *CAMPOS)
+        ids = []
+        for clave, pk, *valores in filas:
+            existentes[clave] = (pk, *valores)
+            ids.append(pk)
+        busqueda.indexar_productos(ids)
+        # Los nuevos no están en la pantalla de nadie
+        events.publicar_productos([p.pk for p in cambiados])
@@ -0,0 +1,104 @@
+"""
+Motor de existencias.
+
+Las existencias se apartan con un UPDATE condicional por lote
+(``existencia = existencia - n WHERE existencia >= n``), así dos pedidos que
+se confirman al mismo tiempo nunca pueden vender la misma pieza dos veces. Si
+alguna línea no alcanza no se descuenta nada y se informa qué faltó.
+"""
+from collections import namedtuple
+
+from django.db import connections, transaction
+from django.db.models import F, IntegerField
+from django.db.models.expressions import RawSQL
+
+from . import events
+from .models import Producto
+
+LOTE = 300
+
+Faltante = namedtuple("Faltante", "producto_id nombre solicitado disponible")
+
+
+class StockInsuficiente(Exception):
+    def __init__(self, faltantes):
+        self.faltantes = faltantes
+        super().__init__("; ".join(
+            f"{f.nombre}: se pidieron {f.solicitado}, hay {f.disponible}" for f in faltantes
+        ))
+
+
+class _LoteIncompleto(Exception):
+    pass
+
+
+def _agrupar(lineas):
+    cantidades = {}
+    for producto_id, cantidad in lineas:
+        if cantidad > 0:
+            cantidades[producto_id] = cantidades.get(producto_id, 0) + cantidad
+    return cantidades
+
+
+def _lotes(cantidades):
+    ids = list(cantidades)
+    for inicio in range(0, len(ids), LOTE):
+        yield {pid: cantidades[pid] for pid in ids[inicio:inicio + LOTE]}
+
+
+def _por_producto(lote, using):
+    """CASE id WHEN ... THEN cantidad END. Se arma a mano: compilar cientos de When() tarda más que el UPDATE."""
+    ops = connections[using].ops
+    columna = f"{ops.quote_name(Producto._meta.db_table)}.{ops.quote_name('id')}"
+    parametros = [valor for par in lote.items() for valor in par]
+    return RawSQL(
+        f"CASE {columna} {' '.join(['WHEN %s THEN %s'] * len(lote))} END",
+        parametros,
+        output_field=IntegerField(),
+    )
+
+
+def _faltantes(cantidades, using):
+    filas = Producto.objects.using(using).filter(id__in=cantidades).values_list("id", "nombre", "existencia")
+    encontrados = {pid: (nombre, existencia) for pid, nombre, existencia in filas}
+    faltantes = []
+    for pid, solicitado in cantidades.items():
+        nombre, existencia = encontrados.get(pid, (f"Producto #{pid}", 0))
+        if existencia < solicitado:
+            faltantes.append(Faltante(pid, nombre, solicitado, existencia))
+    return faltantes
+
+
+def reservar(lineas, using="default"):
+    """
+    Descuenta la existencia de todas las ``lineas`` (producto_id, cantidad) o de
+    ninguna. Lanza ``StockInsuficiente`` con el detalle por línea si algo no alcanza.
+    """
+    cantidades = _agrupar(lineas)
+    if not cantidades:
+        return
+    try:
+        with transaction.atomic(using=using):
+            for lote in _lotes(cantidades):
+                por_producto = _por_producto(lote, using)
+                actualizados = Producto.objects.using(using).filter(
+                    id__in=lote, existencia__gte=por_producto
+                ).update(existencia=F("existencia") - por_producto)
+                if actualizados != len(lote):
+                    raise _LoteIncompleto
+            # update() no manda señales; si se revierte, el aviso se descarta
+            events.publicar_productos(cantidades, using=using)
+    except _LoteIncompleto:
+        # El savepoint ya se revirtió: las existencias leídas aquí son las reales
+        raise StockInsuficiente(_faltantes(cantidades, using))
+
+
+def liberar(lineas, using="default"):
+    """Regresa al inventario las piezas apartadas por ``lineas`` (producto_id, cantidad)."""
+    cantidades = _agrupar(lineas)
+    with transaction.atomic(using=using):
+        for lote in _lotes(cantidades):
+            Producto.objects.using(using).filter(id__in=lote).update(
+                existencia=F("existencia") + _por_producto(lote, using)
+            )
+        events.publicar_productos(cantidades, using=using)
@@ -0,0 +1,138 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import queue
+import statistics
+import tempfile
+import time
+
+import django
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+def _configuracion(ruta):
+    return {"default": {"BACKEND": "core.capa_canales.CapaSQLite", "CONFIG": {"ruta": ruta}}}
+
+
+def _worker(ruta, base, sockets, mensajes, listos, resultados):
+    """Un proceso con ``sockets`` NotificacionConsumer conectados, como un worker de Daphne."""
+    django.setup()
+    # La misma base que el proceso que mide (en las pruebas, la de pruebas)
+    settings.DATABASES["default"]["NAME"] = base
+    from channels.testing import WebsocketCommunicator
+    from django.contrib.auth.models import User
+    from django.test.utils import override_settings
+
+    from core.consumers import NotificacionConsumer
+
+    async def medir():
+        usuario = User(username="carga", is_staff=True)
+        aplicacion = NotificacionConsumer.as_asgi()
+        comunicadores = []
+        for _ in range(sockets):
+            comunicador = WebsocketCommunicator(aplicacion, "/ws/notifications/")
+            comunicador.scope["user"] = usuario
+            comunicadores.append(comunicador)
+        for comunicador in comunicadores:
+            conectado, _ = await comunicador.connect(timeout=30)
+            assert conectado
+        listos.put(os.getpid())
+
+        latencias = []
+
+        async def escuchar(comunicador):
+            recibidos = 0
+            while recibidos < mensajes:
+                datos = json.loads(await comunicador.receive_from(timeout=60))
+                if datos.get("latido"):
+                    await comunicador.send_to(text_data="latido")
+                if "trabajo" not in datos:
+                    # {"secuencia": N} al conectar y los latidos
+                    continue
+                latencias.append(time.time() - float(datos["mensaje"]))
+                recibidos += 1
+
+        await asyncio.gather(*(escuchar(c) for c in comunicadores))
+        for comunicador in comunicadores:
+            await comunicador.disconnect()
+        return latencias
+
+    with override_settings(CHANNEL_LAYERS=_configuracion(ruta)):
+        resultados.put(async_to_sync(medir)())
+
+
+def _sacar(cola, workers, segundos=120):
+    """``cola.get`` que falla en cuanto muere un worker, en vez de esperar todo el plazo."""
+    limite = time.monotonic() + segundos
+    while time.monotonic() < limite:
+        try:
+            return cola.get(timeout=1)
+        except queue.Empty:
+            if any(worker.exitcode for worker in workers):
+                raise CommandError("Un worker terminó con error (ver arriba)")
+    raise CommandError("Los workers no respondieron a tiempo")
+
+
+def _percentil(valores, p):
+    return valores[min(len(valores) - 1, int(len(valores) * p / 100))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide cuánto tarda un group_send en llegar a muchos NotificacionConsumer repartidos "
+        "en varios procesos usando la capa de canales SQLite."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--procesos", type=int, default=4)
+        parser.add_argument("--sockets", type=int, default=500, help="Total, repartidos entre los procesos.")
+        parser.add_argument("--mensajes", type=int, default=20)
+        parser.add_argument("--intervalo", type=float, default=0.25, help="Segundos entre avisos.")
+
+    def handle(self, *args, **options):
+        from core.capa_canales import CapaSQLite
+        from core.events import ProgresoTrabajo
+
+        procesos, mensajes = options["procesos"], options["mensajes"]
+        por_proceso = [options["sockets"] // procesos + (i < options["sockets"] % procesos) for i in range(procesos)]
+        self.stdout.write(f"CPUs disponibles: {os.cpu_count()}")
+
+        with tempfile.TemporaryDirectory() as directorio:
+            ruta = os.path.join(directorio, "canales.sqlite3")
+            base = str(settings.DATABASES["default"]["NAME"])
+            contexto = multiprocessing.get_context("spawn")
+            listos, resultados = contexto.Queue(), contexto.Queue()
+            workers = [
+                contexto.Process(target=_worker, args=(ruta, base, sockets, mensajes, listos, resultados))
+                for sockets in por_proceso
+            ]
+            for worker in workers:
+                worker.start()
+            for _ in workers:
+                _sacar(listos, workers)
+
+            capa = CapaSQLite(ruta)
+            envios = []
+            for _ in range(mensajes):
+                inicio = time.time()
+                # El consumer reenvía "mensaje" tal cual: lleva la hora de envío
+                evento = ProgresoTrabajo(id=0, titulo="carga", estado="en_proceso", progreso=0, mensaje=repr(inicio))
+                async_to_sync(capa.group_send)(evento.grupo, evento.contenido())
+                envios.append(time.time() - inicio)
+                time.sleep(options["intervalo"])
+
+            latencias = sorted(l for _ in workers for l in _sacar(resultados, workers))
+            for worker in workers:
+                worker.join()
+
+        ms = [l * 1000 for l in latencias]
+        self.stdout.write(
+            f"  {sum(por_proceso)} sockets en {procesos} procesos, {mensajes} avisos, {len(ms)} entregas\n"
+            f"  group_send:  {statistics.mean(envios) * 1000:7.1f} ms promedio\n"
+            f"  entrega p50: {_percentil(ms, 50):7.1f} ms\n"
+            f"  entrega p99: {_percentil(ms, 99):7.1f} ms\n"
+            f"  entrega máx: {ms[-1]:7.1f} ms"
+        )
@@ -0,0 +1,87 @@
+import time
+from decimal import Decimal
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from core.models import Categoria, Cliente, Cotizacion, CotizacionItem, Pedido, PedidoItem, Producto
+from core.services import PedidoService
+
+
+def conversion_anterior(cotizacion, cliente):
+    """Copia de la conversión original: un INSERT y un SELECT por línea y el aviso dentro de la transacción."""
+    with transaction.atomic():
+        pedido = Pedido.objects.create(cliente=cliente, total=cotizacion.total, estado="procesado")
+        for item in cotizacion.items.all():
+            PedidoItem.objects.create(
+                pedido=pedido,
+                producto=item.producto,
+                cantidad=item.cantidad,
+                precio_unitario=item.producto.precio,
+            )
+        cotizacion.convertida_en_pedido = True
+        cotizacion.save()
+        async_to_sync(get_channel_layer().group_send)("notifications", {
+            "type": "send_notification",
+            "mensaje": f"La cotización #{cotizacion.id} ha sido convertida",
+            "total": str(cotizacion.total),
+            "cliente": cliente.usuario.get_full_name() or cliente.usuario.username,
+        })
+    return pedido
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide cuánto tiempo se mantiene abierta la transacción (y con ella el candado "
+        "de escritura de SQLite) al convertir una cotización en pedido. Todo se revierte al final."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lineas", type=int, default=200)
+        parser.add_argument("--repeticiones", type=int, default=5)
+
+    def handle(self, *args, **options):
+        lineas = options["lineas"]
+        repeticiones = options["repeticiones"]
+
+        with transaction.atomic():
+            cliente, cotizaciones = self._preparar(lineas, repeticiones * 2)
+            resultados = {}
+            for nombre, convertir in (("antes", conversion_anterior), ("despues", PedidoService.crear_desde_cotizacion)):
+                tiempos = []
+                consultas = 0
+                for _ in range(repeticiones):
+                    cotizacion = cotizaciones.pop()
+                    inicio_consultas = len(connection.queries)
+                    inicio = time.perf_counter()
+                    convertir(cotizacion, cliente)
+                    tiempos.append(time.perf_counter() - inicio)
+                    consultas = len(connection.queries) - inicio_consultas
+                resultados[nombre] = (sorted(tiempos)[len(tiempos) // 2], consultas)
+            transaction.set_rollback(True)
+
+        self.stdout.write(f"Cotización de {lineas} líneas, mediana de {repeticiones} corridas")
+        for nombre, (mediana, consultas) in resultados.items():
+            self.stdout.write(f"  {nombre:<8} {mediana * 1000:8.2f} ms en transacción  {consultas:5d} consultas")
+
+    def _preparar(self, lineas, cantidad):
+        # connection.queries sólo se llena con DEBUG; lo forzamos para contar consultas
+        connection.force_debug_cursor = True
+        categoria = Categoria.objects.create(nombre="__benchmark__")
+        productos = Producto.objects.bulk_create([
+            Producto(nombre=f"Producto {i}", clave=f"__BENCH-{i}", precio=Decimal("10.00"), existencia=cantidad, categoria=categoria)
+            for i in range(lineas)
+        ])
+        usuario = User.objects.create_user(username="__benchmark__")
+        cliente = Cliente.objects.create(usuario=usuario, nombre="Benchmark", correo="bench@example.com", rfc="BENCH000000XX")
+        cotizaciones = []
+        for _ in range(cantidad):
+            cotizacion = Cotizacion.objects.create(cliente=cliente, total=Decimal("10.00") * lineas)
+            CotizacionItem.objects.bulk_create([
+                CotizacionItem(cotizacion=cotizacion, producto=p, cantidad=1, subtotal=p.precio) for p in productos
+            ])
+            cotizaciones.append(cotizacion)
+        return cliente, cotizaciones
@@ -0,0 +1,54 @@
+import os
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from openpyxl import Workbook
+
+from core.importacion import ImportadorProductos, leer_filas
+
+
+def generar_libro(ruta, filas):
+    """Lista de precios sintética con el formato de los proveedores (precios con $ y comas, acentos)."""
+    libro = Workbook(write_only=True)
+    hoja = libro.create_sheet()
+    hoja.append(["Clave", "Descripción", "Categoria", "Marca", "Proveedor", "Departamento", "Precio", "Existencia"])
+    for i in range(filas):
+        hoja.append([
+            f"BENCH-{i}", f"Tornillo cabeza hexagonal {i} mm", f"Categoría {i % 40}", f"Marca Ñ {i % 300}",
+            f"Proveedor {i % 12}", "Ferretería", f"${i % 5000:,}.50", f"{i % 90}.0",
+        ])
+    libro.save(ruta)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara la importación en serie contra la limpieza de filas repartida entre varios "
+        "procesos sobre un libro sintético. Todo se revierte al final."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--filas", type=int, default=100_000)
+        parser.add_argument("--procesos", type=int, nargs="+", default=[2, 4])
+
+    def handle(self, *args, **options):
+        filas = options["filas"]
+        self.stdout.write(f"CPUs disponibles: {os.cpu_count()}")
+        with tempfile.TemporaryDirectory() as directorio:
+            ruta = os.path.join(directorio, "lista.xlsx")
+            generar_libro(ruta, filas)
+
+            inicio = time.perf_counter()
+            for _ in leer_filas(ruta):
+                pass
+            self.stdout.write(f"  {'sólo lectura':<14} {filas / (time.perf_counter() - inicio):10.0f} filas/s")
+
+            for procesos in [1, *options["procesos"]]:
+                with transaction.atomic():
+                    inicio = time.perf_counter()
+                    resultado = ImportadorProductos(procesos=procesos).importar_archivo(ruta)
+                    segundos = time.perf_counter() - inicio
+                    transaction.set_rollback(True)
+                nombre = "serie" if procesos == 1 else f"{procesos} procesos"
+                self.stdout.write(f"  {nombre:<14} {filas / segundos:10.0f} filas/s  ({segundos:.1f} s, {resultado.nuevos} nuevos)")
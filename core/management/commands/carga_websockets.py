@@ -0,0 +1,242 @@
+import asyncio
+import base64
+import json
+import os
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from importlib import import_module
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from core.events import ProgresoTrabajo
+
+USUARIO = "carga_websockets"
+
+
+def _memoria(pid):
+    """RSS del proceso en bytes (Linux); None si no se puede leer."""
+    try:
+        with open(f"/proc/{pid}/status") as estado:
+            for linea in estado:
+                if linea.startswith("VmRSS:"):
+                    return int(linea.split()[1]) * 1024
+    except OSError:
+        return None
+
+
+def _percentil(valores, p):
+    return valores[min(len(valores) - 1, int(len(valores) * p / 100))]
+
+
+def _esperar_puerto(puerto, segundos=30):
+    limite = time.monotonic() + segundos
+    while time.monotonic() < limite:
+        try:
+            socket.create_connection(("127.0.0.1", puerto), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise CommandError(f"Daphne no abrió el puerto {puerto}")
+
+
+# Cliente WebSocket mínimo: el de autobahn no sirve aquí porque Daphne ya fijó txaio en Twisted
+
+async def _conectar(puerto, cookie):
+    lector, escritor = await asyncio.open_connection("127.0.0.1", puerto)
+    clave = base64.b64encode(os.urandom(16)).decode()
+    escritor.write(
+        f"GET /ws/notifications/ HTTP/1.1\r\nHost: 127.0.0.1:{puerto}\r\nUpgrade: websocket\r\n"
+        f"Connection: Upgrade\r\nSec-WebSocket-Key: {clave}\r\nSec-WebSocket-Version: 13\r\n"
+        f"Cookie: {cookie}\r\n\r\n".encode()
+    )
+    respuesta = await lector.readuntil(b"\r\n\r\n")
+    if not respuesta.startswith(b"HTTP/1.1 101"):
+        raise CommandError(f"Daphne rechazó el WebSocket: {respuesta.splitlines()[0].decode()}")
+    return lector, escritor
+
+
+def _marco(opcode, datos):
+    # Los marcos del cliente van enmascarados; aquí siempre son cortos
+    mascara = os.urandom(4)
+    return bytes([0x80 | opcode, 0x80 | len(datos)]) + mascara + bytes(b ^ mascara[i % 4] for i, b in enumerate(datos))
+
+
+async def _leer_marco(lector):
+    cabecera = await lector.readexactly(2)
+    largo = cabecera[1] & 0x7F
+    if largo == 126:
+        largo = int.from_bytes(await lector.readexactly(2), "big")
+    elif largo == 127:
+        largo = int.from_bytes(await lector.readexactly(8), "big")
+    return cabecera[0] & 0x0F, await lector.readexactly(largo)
+
+
+async def _escuchar(lector, escritor, medicion):
+    """Un navegador del staff: contesta latidos y pings y anota cuánto tardó cada aviso."""
+    while True:
+        try:
+            opcode, datos = await _leer_marco(lector)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            opcode = 0x8
+        if opcode == 0x8:
+            medicion.cerrados += 1
+            return
+        if opcode == 0x9:
+            escritor.write(_marco(0xA, datos))
+            continue
+        mensaje = json.loads(datos)
+        if mensaje.get("latido"):
+            escritor.write(_marco(0x1, b"latido"))
+        elif "trabajo" in mensaje:
+            # El "mensaje" del aviso lleva la hora de envío
+            medicion.latencias.append(time.time() - float(mensaje["mensaje"]))
+        elif not medicion.listos.done():
+            # {"secuencia": N}: ya está en el grupo
+            medicion.en_grupo += 1
+            if medicion.en_grupo == medicion.conexiones:
+                medicion.listos.set_result(None)
+
+
+class Medicion:
+    def __init__(self, conexiones):
+        self.conexiones = conexiones
+        self.en_grupo = self.cerrados = 0
+        self.latencias = []
+        self.listos = asyncio.get_running_loop().create_future()
+
+
+class Command(BaseCommand):
+    help = (
+        "Abre miles de WebSockets de staff contra Daphne en esta máquina, manda avisos al grupo "
+        "y reporta la latencia de entrega (p50/p99) y la memoria del servidor por conexión."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--conexiones", type=int, default=2000)
+        parser.add_argument("--servidores", type=int, default=1, help="Procesos de Daphne, uno por puerto.")
+        parser.add_argument("--puerto", type=int, default=8765, help="Primer puerto.")
+        parser.add_argument("--mensajes", type=int, default=20)
+        parser.add_argument("--intervalo", type=float, default=0.5, help="Segundos entre avisos.")
+        parser.add_argument("--lote", type=int, default=100, help="Conexiones que se abren a la vez.")
+
+    def handle(self, *args, **options):
+        conexiones = options["conexiones"]
+        _, maximo = resource.getrlimit(resource.RLIMIT_NOFILE)
+        # Cada conexión ocupa un descriptor aquí y otro en Daphne (que hereda el límite)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (maximo, maximo))
+        if maximo != resource.RLIM_INFINITY and maximo < conexiones + 100:
+            raise CommandError(f"El límite de archivos abiertos ({maximo}) no alcanza para {conexiones} conexiones")
+
+        usuario, creado = User.objects.get_or_create(username=USUARIO, defaults={"is_staff": True})
+        sesion = import_module(settings.SESSION_ENGINE).SessionStore()
+        sesion[SESSION_KEY] = str(usuario.pk)
+        sesion[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        sesion[HASH_SESSION_KEY] = usuario.get_session_auth_hash()
+        sesion.create()
+
+        puertos = [options["puerto"] + i for i in range(options["servidores"])]
+        servidores = [
+            subprocess.Popen(
+                [sys.executable, "-m", "daphne", "-b", "127.0.0.1", "-p", str(puerto), "-v", "0",
+                 "ferreteria.asgi:application"],
+                env=os.environ,
+            )
+            for puerto in puertos
+        ]
+        try:
+            for puerto in puertos:
+                _esperar_puerto(puerto)
+            resultado = asyncio.run(self._medir(puertos, servidores, f"{settings.SESSION_COOKIE_NAME}={sesion.session_key}", options))
+        finally:
+            for servidor in servidores:
+                servidor.terminate()
+                servidor.wait()
+            sesion.delete()
+            if creado:
+                usuario.delete()
+        self._reportar(resultado, options)
+
+    async def _medir(self, puertos, servidores, cookie, options):
+        conexiones = options["conexiones"]
+        medicion = Medicion(conexiones)
+        escritores, tareas = [], []
+        lote = asyncio.Semaphore(options["lote"])
+
+        async def abrir(i):
+            async with lote:
+                lector, escritor = await _conectar(puertos[i % len(puertos)], cookie)
+            escritores.append(escritor)
+            tareas.append(asyncio.create_task(_escuchar(lector, escritor, medicion)))
+
+        # Las primeras conexiones cargan código y conexiones a la base: no cuentan para la memoria
+        calentamiento = min(options["lote"], conexiones)
+        await asyncio.gather(*(abrir(i) for i in range(calentamiento)))
+        memoria_antes = [_memoria(s.pid) for s in servidores]
+        inicio = time.monotonic()
+        await asyncio.gather(*(abrir(i) for i in range(calentamiento, conexiones)))
+        await asyncio.wait_for(medicion.listos, 120)
+        apertura = time.monotonic() - inicio
+        memoria_despues = [_memoria(s.pid) for s in servidores]
+
+        capa = get_channel_layer()
+        envios = []
+        for _ in range(options["mensajes"]):
+            enviado = time.time()
+            evento = ProgresoTrabajo(id=0, titulo="carga", estado="en_proceso", progreso=0, mensaje=repr(enviado))
+            await capa.group_send(evento.grupo, evento.contenido())
+            envios.append(time.time() - enviado)
+            await asyncio.sleep(options["intervalo"])
+
+        esperadas = conexiones * options["mensajes"]
+        limite = time.monotonic() + 30
+        while len(medicion.latencias) < esperadas and time.monotonic() < limite:
+            await asyncio.sleep(0.1)
+        for escritor in escritores:
+            escritor.close()
+        for tarea in tareas:
+            tarea.cancel()
+
+        memoria = None
+        if None not in memoria_antes + memoria_despues and conexiones > calentamiento:
+            memoria = (sum(memoria_despues) - sum(memoria_antes)) / (conexiones - calentamiento)
+        return {
+            "abiertas": len(escritores),
+            "cerradas": medicion.cerrados,
+            "apertura": apertura,
+            "nuevas": conexiones - calentamiento,
+            "envios": envios,
+            "latencias": sorted(medicion.latencias),
+            "esperadas": esperadas,
+            "memoria": memoria,
+            "memoria_total": sum(memoria_despues) if None not in memoria_despues else None,
+        }
+
+    def _reportar(self, r, options):
+        ms = [l * 1000 for l in r["latencias"]]
+        self.stdout.write(f"CPUs disponibles: {os.cpu_count()}")
+        self.stdout.write(
+            f"  {r['abiertas']} conexiones en {options['servidores']} Daphne "
+            f"({r['cerradas']} cerradas por el servidor antes de terminar)\n"
+            f"  apertura:    {r['nuevas'] / r['apertura']:7.0f} conexiones/s (sesión, usuario y grupo)\n"
+            f"  group_send:  {statistics.mean(r['envios']) * 1000:7.1f} ms promedio\n"
+            f"  entregas:    {len(ms)} de {r['esperadas']}"
+        )
+        if ms:
+            self.stdout.write(
+                f"  entrega p50: {_percentil(ms, 50):7.1f} ms\n"
+                f"  entrega p99: {_percentil(ms, 99):7.1f} ms\n"
+                f"  entrega máx: {ms[-1]:7.1f} ms"
+            )
+        if r["memoria"] is not None:
+            self.stdout.write(
+                f"  memoria:     {r['memoria'] / 1024:7.1f} KiB por conexión "
+                f"({r['memoria_total'] / 2 ** 20:.0f} MiB en total)"
+            )
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from tqdm import tqdm
+
+from core import miniaturas
+from core.models import Producto, Promocion
+
+
+class Command(BaseCommand):
+    help = "Genera las miniaturas WebP que falten de las imágenes de productos y promociones."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--forzar", action="store_true", help="Vuelve a generarlas aunque ya existan.")
+
+    def handle(self, *args, **options):
+        generadas = fallidas = 0
+        for modelo in (Producto, Promocion):
+            instancias = modelo.objects.exclude(imagen="").exclude(imagen__isnull=True).only("pk", "imagen")
+            for instancia in tqdm(instancias.iterator(), total=instancias.count(), desc=modelo._meta.verbose_name_plural, disable=None):
+                try:
+                    miniaturas.generar(instancia.imagen, forzar=options["forzar"])
+                except (OSError, ValueError) as e:
+                    fallidas += 1
+                    self.stderr.write(f"{modelo.__name__} #{instancia.pk} ({instancia.imagen.name}): {e}")
+                else:
+                    generadas += 1
+        self.stdout.write(self.style.SUCCESS(f"Miniaturas listas para {generadas} imágenes, {fallidas} con error."))
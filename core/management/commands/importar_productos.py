@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from tqdm import tqdm
+
+from core import events
+from core.importacion import TAMANO_LOTE, ImportadorProductos, contar_filas, leer_filas
+
+
+def huella(ruta):
+    """sha1 del contenido: el avance guardado sólo vale para el mismo archivo."""
+    digest = hashlib.sha1()
+    with open(ruta, "rb") as manejador:
+        for bloque in iter(lambda: manejador.read(1 << 20), b""):
+            digest.update(bloque)
+    return digest.hexdigest()
+
+
+class Command(BaseCommand):
+    help = (
+        "Importa la lista de precios de un proveedor (.xlsx o .csv) sin pasar por el admin. "
+        "Cada lote se confirma por separado y el avance se guarda junto al archivo, así una "
+        "corrida interrumpida continúa desde el último lote confirmado."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("archivo")
+        parser.add_argument("--lote", type=int, default=TAMANO_LOTE, help="Filas por transacción.")
+        parser.add_argument(
+            "--procesos", type=int, default=1,
+            help="Procesos para limpiar las filas en paralelo; la escritura siempre la hace un solo proceso.",
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Muestra qué cambiaría sin escribir nada.")
+        parser.add_argument("--desde-cero", action="store_true", help="Ignora el avance guardado de una corrida anterior.")
+
+    def handle(self, *args, **options):
+        ruta = options["archivo"]
+        if not os.path.isfile(ruta):
+            raise CommandError(f"No existe el archivo {ruta}")
+        if options["lote"] < 1 or options["procesos"] < 1:
+            raise CommandError("--lote y --procesos deben ser mayores que cero")
+
+        dry_run = options["dry_run"]
+        importador = ImportadorProductos(dry_run=dry_run, tamano_lote=options["lote"], procesos=options["procesos"])
+        ruta_avance = f"{ruta}.avance.json"
+        avance = {"huella": huella(ruta), "lote": options["lote"], "siguiente": 0, "precios_cambiaron": False}
+
+        anterior = None if options["desde_cero"] or dry_run else self._leer_avance(ruta_avance)
+        if anterior and anterior.get("huella") == avance["huella"] and anterior.get("lote") == avance["lote"]:
+            avance = anterior
+            importador.precios_cambiaron = avance["precios_cambiaron"]
+            self.stdout.write(f"Reanudando desde el lote {avance['siguiente'] + 1}.")
+        elif anterior:
+            self.stdout.write(self.style.WARNING("El avance guardado es de otro archivo o tamaño de lote; se empieza de cero."))
+
+        total = contar_filas(ruta)
+        barra = tqdm(
+            total=total,
+            initial=min(avance["siguiente"] * avance["lote"], total),
+            unit="filas",
+            desc="Revisando" if dry_run else "Importando",
+            disable=None,  # sin barra si la salida no es una terminal (cron, logs)
+        )
+        inicio = time.monotonic()
+        procesadas = 0
+
+        def al_terminar_lote(numero_lote, filas, resultado):
+            nonlocal procesadas
+            procesadas += filas
+            barra.update(filas)
+            barra.set_postfix(nuevos=resultado.nuevos, actualizados=resultado.actualizados, errores=len(resultado.errores))
+            if not dry_run:
+                # El lote ya se confirmó; si el proceso muere aquí se repite un lote, lo que no cambia nada
+                avance["siguiente"] = numero_lote + 1
+                avance["precios_cambiaron"] = importador.precios_cambiaron
+                self._guardar_avance(ruta_avance, avance)
+
+        try:
+            resultado = importador.importar(leer_filas(ruta), avance["siguiente"], al_terminar_lote)
+        finally:
+            barra.close()
+            # Los avisos de productos cambiados salen por hilos daemon: esperarlos antes de salir
+            events.esperar()
+        segundos = time.monotonic() - inicio
+
+        for numero, mensaje in resultado.errores:
+            self.stderr.write(f"Fila {numero}: {mensaje}")
+        for clave, diferencias in resultado.cambios:
+            if diferencias is None:
+                self.stdout.write(f"+ {clave}")
+            else:
+                detalle = ", ".join(f"{campo}: {antes} -> {despues}" for campo, (antes, despues) in diferencias.items())
+                self.stdout.write(f"~ {clave}: {detalle}")
+
+        if os.path.exists(ruta_avance) and not dry_run:
+            os.remove(ruta_avance)
+        velocidad = procesadas / segundos if segundos else 0
+        prefijo = "Sin escribir nada: " if dry_run else ""
+        self.stdout.write(self.style.SUCCESS(f"{prefijo}{resultado} ({velocidad:.0f} filas/s)."))
+
+    def _leer_avance(self, ruta):
+        try:
+            with open(ruta, encoding="utf-8") as manejador:
+                return json.load(manejador)
+        except (OSError, ValueError):
+            return None
+
+    def _guardar_avance(self, ruta, avance):
+        temporal = f"{ruta}.tmp"
+        with open(temporal, "w", encoding="utf-8") as manejador:
+            json.dump(avance, manejador)
+        os.replace(temporal, ruta)
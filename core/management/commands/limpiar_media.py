@@ -0,0 +1,88 @@
+import posixpath
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import miniaturas
+from core.almacenamiento import es_nombre_por_contenido
+from core.models import Producto, Promocion
+
+MODELOS = (Producto, Promocion)
+
+
+def recorrer(storage, carpeta):
+    """Nombres de todos los archivos bajo ``carpeta`` (recursivo)."""
+    if not storage.exists(carpeta):
+        return
+    carpetas, archivos = storage.listdir(carpeta)
+    for archivo in archivos:
+        yield posixpath.join(carpeta, archivo)
+    for subcarpeta in carpetas:
+        yield from recorrer(storage, posixpath.join(carpeta, subcarpeta))
+
+
+class Command(BaseCommand):
+    help = (
+        "Busca en media/ las imágenes (y miniaturas) que ya no usa ningún producto ni "
+        "promoción. Sin --borrar sólo las lista."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--borrar", action="store_true", help="Borra los archivos sin referencia.")
+        parser.add_argument(
+            "--minutos", type=int, default=60,
+            help="No toca archivos más nuevos que esto (una subida puede no estar guardada aún en la base).",
+        )
+        parser.add_argument(
+            "--convertir", action="store_true",
+            help="Antes de limpiar, renombra por contenido las imágenes con nombre viejo; las copias repetidas quedan sin referencia.",
+        )
+
+    def handle(self, *args, **options):
+        storage = Producto._meta.get_field("imagen").storage
+        if options["convertir"]:
+            self._convertir()
+
+        usados = set()
+        for modelo in MODELOS:
+            for nombre in modelo.objects.exclude(imagen="").exclude(imagen__isnull=True).values_list("imagen", flat=True).distinct():
+                usados.add(nombre)
+                usados.update(self._miniaturas(storage, nombre))
+
+        limite = time.time() - options["minutos"] * 60
+        huerfanos = []
+        for modelo in MODELOS:
+            carpeta = modelo._meta.get_field("imagen").upload_to.rstrip("/")
+            for nombre in recorrer(storage, carpeta):
+                if nombre not in usados and storage.get_modified_time(nombre).timestamp() < limite:
+                    huerfanos.append(nombre)
+
+        liberados = 0
+        for nombre in huerfanos:
+            liberados += storage.size(nombre)
+            self.stdout.write(nombre)
+            if options["borrar"]:
+                storage.delete(nombre)
+        accion = "Borrados" if options["borrar"] else "Sin referencia"
+        self.stdout.write(self.style.SUCCESS(f"{accion}: {len(huerfanos)} archivos, {liberados / 1024:.0f} KB."))
+
+    def _miniaturas(self, storage, nombre):
+        if not storage.exists(nombre):
+            return []
+        with storage.open(nombre, "rb") as archivo:
+            contenido = archivo.read()
+        return [miniaturas.nombre_miniatura(nombre, contenido, tamano) for tamano in miniaturas.TAMANOS]
+
+    def _convertir(self):
+        convertidos = 0
+        for modelo in MODELOS:
+            storage = modelo._meta.get_field("imagen").storage
+            for pk, nombre in modelo.objects.exclude(imagen="").exclude(imagen__isnull=True).values_list("pk", "imagen"):
+                if es_nombre_por_contenido(nombre) or not storage.exists(nombre):
+                    continue
+                with storage.open(nombre, "rb") as archivo:
+                    nuevo = storage.save(nombre, archivo)
+                # update(): sin señales, la imagen no cambió de contenido
+                modelo.objects.filter(pk=pk).update(imagen=nuevo)
+                convertidos += 1
+        self.stdout.write(f"{convertidos} imágenes renombradas por contenido.")
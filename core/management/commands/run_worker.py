@@ -0,0 +1,61 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection
+
+from core import events, trabajos
+
+
+class Command(BaseCommand):
+    help = (
+        "Ejecuta los trabajos en segundo plano (importaciones, exportaciones, imágenes) "
+        "que encolan el admin y las vistas. Se deja corriendo junto al servidor web."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--hilos", type=int, default=1,
+            help="Trabajos a la vez. Con SQLite conviene 1 o 2: sólo hay un escritor a la vez.",
+        )
+        parser.add_argument("--espera", type=float, default=2.0, help="Segundos entre revisiones cuando no hay trabajo.")
+        parser.add_argument("--una-vez", action="store_true", help="Termina cuando ya no hay pendientes (para cron o pruebas).")
+
+    def handle(self, *args, **options):
+        if options["hilos"] < 1:
+            raise CommandError("--hilos debe ser mayor que cero")
+        abandonados = trabajos.recuperar_abandonados()
+        if abandonados:
+            self.stdout.write(f"{abandonados} trabajos abandonados marcados como fallidos")
+        detener = threading.Event()
+        with ThreadPoolExecutor(options["hilos"], thread_name_prefix="trabajador") as pool:
+            hilos = [
+                pool.submit(self._trabajar, detener, options["espera"], options["una_vez"])
+                for _ in range(options["hilos"])
+            ]
+            try:
+                for hilo in hilos:
+                    hilo.result()
+            except KeyboardInterrupt:
+                self.stdout.write("Terminando los trabajos en curso...")
+                detener.set()
+        # La bandeja y los avisos agrupados corren en hilos daemon: sin esto el
+        # aviso final de cada trabajo se perdería al salir (--una-vez, Ctrl-C)
+        events.esperar()
+
+    def _trabajar(self, detener, espera, una_vez):
+        try:
+            while not detener.is_set():
+                close_old_connections()
+                trabajo = trabajos.tomar_siguiente()
+                if trabajo is None:
+                    if una_vez:
+                        return
+                    detener.wait(espera)
+                    continue
+                self.stdout.write(f"Iniciando {trabajo}")
+                trabajos.ejecutar(trabajo)
+                self.stdout.write(f"{trabajo}: {trabajo.mensaje.splitlines()[0] if trabajo.mensaje else ''}")
+        finally:
+            # Cada hilo tiene su propia conexión
+            connection.close()
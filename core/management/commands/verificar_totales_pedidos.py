@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from core.models import Pedido
+from core.services import PedidoService
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara el total guardado de cada pedido con la suma de sus líneas "
+        "(calculada en la base de datos) y opcionalmente lo corrige."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--corregir", action="store_true", help="Guarda el total calculado en los pedidos descuadrados.")
+
+    def handle(self, *args, **options):
+        descuadrados = list(PedidoService.con_total_descuadrado().values_list("id", "total", "total_calculado"))
+        for pedido_id, total, calculado in descuadrados:
+            self.stdout.write(f"Pedido #{pedido_id}: guardado {total}, calculado {calculado}")
+
+        if options["corregir"] and descuadrados:
+            for pedido_id, _, calculado in descuadrados:
+                Pedido.objects.filter(pk=pedido_id).update(total=calculado)
+            self.stdout.write(self.style.SUCCESS(f"{len(descuadrados)} pedidos corregidos."))
+        elif not descuadrados:
+            self.stdout.write(self.style.SUCCESS("Todos los totales coinciden."))
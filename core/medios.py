@@ -0,0 +1,227 @@
+"""
+Servidor de /media/ y /static/ para producción.
+
+``django.conf.urls.static`` sólo funciona con DEBUG y no manda caché, ETag ni
+rangos. Estas vistas responden con ``FileResponse`` (el servidor WSGI puede
+usar sendfile), contestan 304 a ``If-None-Match``/``If-Modified-Since``,
+aceptan ``Range`` (videos, descargas reanudadas) y marcan "immutable" los
+archivos cuyo nombre sale de su contenido: imágenes de ``AlmacenamientoPorContenido``,
+miniaturas y estáticos con hash de ``collectstatic``. De los estáticos se sirve
+la versión .br o .gz ya comprimida si el navegador la acepta.
+
+Se activan con ``SERVIR_MEDIA`` / ``SERVIR_ESTATICOS`` (ver ``urls()``). De
+/media/ sólo se sirven las carpetas de imágenes del catálogo
+(``CARPETAS_MEDIA_PUBLICAS``); cualquier otra ruta da 404.
+"""
+import mimetypes
+import os
+import posixpath
+import re
+import stat
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.urls import re_path
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+from core.almacenamiento import es_nombre_por_contenido
+
+CACHE_INMUTABLE = "public, max-age=31536000, immutable"
+# ManifestStaticFilesStorage: nombre.<12 hex de md5>.ext
+_HASH_ESTATICO = re.compile(r"\.[0-9a-f]{12}\.[^./]+$")
+_RANGO = re.compile(r"^bytes=(\d*)-(\d*)$")
+# upload_to de las imágenes de Producto y Promocion (con sus miniaturas)
+CARPETAS_MEDIA_PUBLICAS = ("productos", "promociones")
+# Codificaciones precomprimidas, en orden de preferencia
+VARIANTES = (("br", ".br"), ("gzip", ".gz"))
+
+
+def es_inmutable_media(ruta):
+    return es_nombre_por_contenido(ruta) or "miniaturas" in posixpath.dirname(ruta).split("/")
+
+
+def es_inmutable_estatico(ruta):
+    return bool(_HASH_ESTATICO.search(posixpath.basename(ruta)))
+
+
+def _acepta(request, codificacion):
+    for parte in request.headers.get("Accept-Encoding", "").split(","):
+        nombre, _, parametros = parte.strip().partition(";")
+        if nombre.strip().lower() == codificacion:
+            q = parametros.strip().replace(" ", "")
+            return q not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
+
+
+def _rango(valor, tamano):
+    """
+    (inicio, fin) inclusive del encabezado Range, ``None`` si no se puede
+    atender (varios rangos, sintaxis rara: se manda el archivo completo) o
+    ``False`` si el rango queda fuera del archivo (416).
+    """
+    coincide = _RANGO.match(valor.strip())
+    if not coincide or coincide.groups() == ("", ""):
+        return None
+    inicio, fin = coincide.groups()
+    if inicio == "":
+        # bytes=-N: los últimos N
+        largo = int(fin)
+        if largo == 0:
+            return False
+        return max(tamano - largo, 0), tamano - 1
+    inicio = int(inicio)
+    fin = min(int(fin), tamano - 1) if fin else tamano - 1
+    if inicio >= tamano or fin < inicio:
+        return False
+    return inicio, fin
+
+
+class _Tramo:
+    """Lector que entrega sólo ``largo`` bytes de un archivo ya posicionado."""
+
+    def __init__(self, archivo, largo):
+        self.archivo = archivo
+        self.restante = largo
+        self.name = archivo.name
+
+    def read(self, n=-1):
+        if self.restante <= 0:
+            return b""
+        n = self.restante if n is None or n < 0 else min(n, self.restante)
+        datos = self.archivo.read(n)
+        self.restante -= len(datos)
+        return datos
+
+    def close(self):
+        self.archivo.close()
+
+
+def servir_archivo(request, ruta_absoluta, cache_control, variantes=False):
+    """
+    Responde con el archivo ``ruta_absoluta`` atendiendo encabezados
+    condicionales y Range. Con ``variantes`` busca ``<archivo>.br`` / ``.gz``.
+    """
+    try:
+        info = os.stat(ruta_absoluta)
+    except OSError:
+        raise Http404("No existe el archivo")
+    if not stat.S_ISREG(info.st_mode):
+        raise Http404("No existe el archivo")
+
+    tipo, codificacion = mimetypes.guess_type(ruta_absoluta)
+    tipo = tipo or "application/octet-stream"
+    if codificacion:
+        # .gz, .br subidos tal cual: se mandan como binarios, sin Content-Encoding
+        tipo = "application/octet-stream"
+
+    a_servir, content_encoding, hay_variantes = ruta_absoluta, None, False
+    if variantes and "Range" not in request.headers:
+        for nombre, extension in VARIANTES:
+            try:
+                info_variante = os.stat(ruta_absoluta + extension)
+            except OSError:
+                continue
+            hay_variantes = True
+            if content_encoding is None and _acepta(request, nombre):
+                a_servir, content_encoding, info = ruta_absoluta + extension, nombre, info_variante
+
+    etag = f'"{info.st_size:x}-{info.st_mtime_ns:x}{"-" + content_encoding if content_encoding else ""}"'
+    modificado = int(info.st_mtime)
+
+    def encabezados(respuesta):
+        respuesta["ETag"] = etag
+        respuesta["Last-Modified"] = http_date(modificado)
+        respuesta["Cache-Control"] = cache_control
+        respuesta["Accept-Ranges"] = "none" if content_encoding else "bytes"
+        if hay_variantes:
+            respuesta["Vary"] = "Accept-Encoding"
+        return respuesta
+
+    condicional = get_conditional_response(request, etag=etag, last_modified=modificado)
+    if condicional is not None:
+        return encabezados(condicional)
+
+    rango = None
+    if "Range" in request.headers and not content_encoding:
+        if_range = request.headers.get("If-Range", "").strip()
+        vigente = (
+            not if_range
+            or if_range == etag
+            or parse_http_date_safe(if_range) == modificado
+        )
+        if vigente:
+            rango = _rango(request.headers["Range"], info.st_size)
+        if rango is False:
+            respuesta = HttpResponse(status=416)
+            respuesta["Content-Range"] = f"bytes */{info.st_size}"
+            return encabezados(respuesta)
+
+    archivo = open(a_servir, "rb")
+    if rango:
+        inicio, fin = rango
+        archivo.seek(inicio)
+        largo = fin - inicio + 1
+        # Hasta el final se entrega el archivo tal cual (sendfile desde la posición actual)
+        cuerpo = archivo if fin == info.st_size - 1 else _Tramo(archivo, largo)
+        respuesta = FileResponse(cuerpo, status=206, content_type=tipo)
+        respuesta["Content-Length"] = str(largo)
+        respuesta["Content-Range"] = f"bytes {inicio}-{fin}/{info.st_size}"
+    else:
+        respuesta = FileResponse(archivo, content_type=tipo)
+    if content_encoding:
+        respuesta["Content-Encoding"] = content_encoding
+    return encabezados(respuesta)
+
+
+def _resolver(raiz, ruta):
+    try:
+        return safe_join(raiz, ruta)
+    except (SuspiciousFileOperation, ValueError):
+        raise Http404("Ruta inválida")
+
+
+@require_safe
+def servir_media(request, ruta):
+    if posixpath.normpath(ruta).lstrip("/").split("/")[0] not in CARPETAS_MEDIA_PUBLICAS:
+        raise Http404("Archivo no público")
+    cache_control = (
+        CACHE_INMUTABLE if es_inmutable_media(ruta)
+        else f"public, max-age={settings.MEDIA_CACHE_SEGUNDOS}"
+    )
+    return servir_archivo(request, _resolver(settings.MEDIA_ROOT, ruta), cache_control)
+
+
+@require_safe
+def servir_estatico(request, ruta):
+    ruta_absoluta = _resolver(settings.STATIC_ROOT, ruta)
+    if settings.DEBUG and not os.path.exists(ruta_absoluta):
+        # Sin collectstatic: se busca en las carpetas static/ de las apps
+        ruta_absoluta = finders.find(posixpath.normpath(ruta).lstrip("/")) or ruta_absoluta
+    cache_control = (
+        CACHE_INMUTABLE if es_inmutable_estatico(ruta)
+        else f"public, max-age={settings.MEDIA_CACHE_SEGUNDOS}"
+    )
+    return servir_archivo(request, ruta_absoluta, cache_control, variantes=True)
+
+
+def _patron(prefijo, vista):
+    # Prefijos con dominio (un CDN) no se sirven desde aquí
+    if not prefijo or urlsplit(prefijo).netloc:
+        return []
+    return [re_path(r"^%s(?P<ruta>.*)$" % re.escape(prefijo.lstrip("/")), vista)]
+
+
+def urls():
+    """Patrones para ``urlpatterns`` según ``SERVIR_MEDIA`` y ``SERVIR_ESTATICOS``."""
+    patrones = []
+    if settings.SERVIR_MEDIA:
+        patrones += _patron(settings.MEDIA_URL, servir_media)
+    if settings.SERVIR_ESTATICOS:
+        patrones += _patron(settings.STATIC_URL, servir_estatico)
+    return patrones
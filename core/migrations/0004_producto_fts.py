@@ -0,0 +1,26 @@
+from django.db import migrations
+
+from core import busqueda
+
+
+def crear_indice(apps, schema_editor):
+    busqueda.crear_indice(schema_editor)
+    busqueda.reconstruir_indice(
+        using=schema_editor.connection.alias,
+        modelo=apps.get_model("core", "Producto"),
+    )
+
+
+def eliminar_indice(apps, schema_editor):
+    busqueda.eliminar_indice(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_promocionticker'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indice, eliminar_indice),
+    ]
@@ -0,0 +1,54 @@
+from django.db import migrations, models
+
+from core.utils import normalizar_texto
+
+# (modelo, campo de Producto que apunta a él)
+MODELOS = (("Categoria", "categoria"), ("Marca", "marca"), ("Proveedor", "proveedor"))
+
+
+def llenar_nombre_normalizado(apps, schema_editor):
+    """
+    Llena la columna y une los registros que sólo difieren en acentos o
+    mayúsculas ("Truper" y "TRUPER"): sus productos pasan al más antiguo y los
+    demás se borran, si no el índice único no se podría crear.
+    """
+    alias = schema_editor.connection.alias
+    Producto = apps.get_model("core", "Producto")
+    for nombre_modelo, campo in MODELOS:
+        modelo = apps.get_model("core", nombre_modelo)
+        conservados = {}
+        for obj in modelo.objects.using(alias).order_by("id"):
+            normalizado = normalizar_texto(obj.nombre)
+            original = conservados.setdefault(normalizado, obj.id)
+            if original != obj.id:
+                Producto.objects.using(alias).filter(**{f"{campo}_id": obj.id}).update(**{f"{campo}_id": original})
+                obj.delete()
+            else:
+                modelo.objects.using(alias).filter(id=obj.id).update(nombre_normalizado=normalizado)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_producto_indices_paginacion'),
+    ]
+
+    operations = [
+        *[
+            migrations.AddField(
+                model_name=nombre_modelo.lower(),
+                name='nombre_normalizado',
+                field=models.CharField(editable=False, max_length=150, null=True),
+            )
+            for nombre_modelo, _ in MODELOS
+        ],
+        migrations.RunPython(llenar_nombre_normalizado, migrations.RunPython.noop),
+        *[
+            migrations.AlterField(
+                model_name=nombre_modelo.lower(),
+                name='nombre_normalizado',
+                field=models.CharField(editable=False, max_length=150, unique=True),
+            )
+            for nombre_modelo, _ in MODELOS
+        ],
+    ]
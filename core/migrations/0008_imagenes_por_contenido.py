@@ -0,0 +1,24 @@
+# Generated by Django 5.0.2 on 2026-10-18 11:40
+
+import core.almacenamiento
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_trabajo'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='producto',
+            name='imagen',
+            field=models.ImageField(blank=True, null=True, storage=core.almacenamiento.almacenamiento_imagenes, upload_to='productos/'),
+        ),
+        migrations.AlterField(
+            model_name='promocion',
+            name='imagen',
+            field=models.ImageField(blank=True, null=True, storage=core.almacenamiento.almacenamiento_imagenes, upload_to='promociones/'),
+        ),
+    ]
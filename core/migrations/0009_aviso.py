@@ -0,0 +1,25 @@
+# Generated by Django 5.0.2 on 2026-10-18 10:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_imagenes_por_contenido'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Aviso',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('grupo', models.CharField(max_length=100)),
+                ('contenido', models.JSONField()),
+                ('creado', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['grupo', 'id'], name='aviso_grupo_id_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.0.2 on 2026-10-18 11:26
+
+import core.almacenamiento
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_aviso'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='trabajo',
+            name='archivo',
+            field=models.FileField(blank=True, help_text='Archivo de entrada', storage=core.almacenamiento.almacenamiento_privado, upload_to='trabajos/'),
+        ),
+        migrations.AlterField(
+            model_name='trabajo',
+            name='resultado',
+            field=models.FileField(blank=True, help_text='Archivo generado', storage=core.almacenamiento.almacenamiento_privado, upload_to='trabajos/'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-18 11:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_trabajos_privados'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pedido',
+            name='existencias_apartadas',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
@@ -0,0 +1,100 @@
+"""
+Miniaturas WebP de las imágenes de productos y promociones.
+
+Las listas muestran las fotos a 60-200 px pero servían el archivo original.
+Cada imagen tiene versiones de tamaño fijo (``TAMANOS``) en una carpeta
+``miniaturas/`` junto al original, con el hash del contenido en el nombre: la
+misma foto subida dos veces comparte miniaturas y el nombre nunca cambia de
+contenido. Se generan al subir la imagen (trabajo en segundo plano) o, para
+archivos viejos, la primera vez que una plantilla pide la URL.
+"""
+import hashlib
+import io
+import logging
+import posixpath
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Cajas máximas (ancho, alto) al doble del tamaño en pantalla, para pantallas retina
+TAMANOS = {
+    "thumb": (120, 120),    # inventario, cotizador (60 px)
+    "card": (480, 480),     # tarjetas del catálogo y de promociones
+    "detalle": (1200, 1200),
+}
+CALIDAD = 80
+
+
+def _clave_cache(imagen, tamano):
+    return f"miniatura:{imagen.name}:{tamano}"
+
+
+def nombre_miniatura(nombre_original, contenido, tamano):
+    digest = hashlib.sha256(contenido).hexdigest()[:20]
+    return posixpath.join(posixpath.dirname(nombre_original), "miniaturas", f"{digest}-{tamano}.webp")
+
+
+def _webp(contenido, caja):
+    with Image.open(io.BytesIO(contenido)) as original:
+        imagen = ImageOps.exif_transpose(original)
+        if imagen.mode not in ("RGB", "RGBA"):
+            imagen = imagen.convert("RGBA" if "transparency" in imagen.info or imagen.mode in ("LA", "P") else "RGB")
+        imagen.thumbnail(caja, Image.LANCZOS)
+        salida = io.BytesIO()
+        imagen.save(salida, "WEBP", quality=CALIDAD, method=4)
+    return salida.getvalue()
+
+
+def generar(imagen, tamanos=None, forzar=False):
+    """
+    Crea las miniaturas que falten de ``imagen`` (un FieldFile) y devuelve
+    {tamaño: nombre en el storage}. Lee el original una sola vez.
+    """
+    storage = imagen.storage
+    with imagen.open("rb") as archivo:
+        contenido = archivo.read()
+    nombres = {}
+    for tamano in tamanos or TAMANOS:
+        nombre = nombre_miniatura(imagen.name, contenido, tamano)
+        if forzar and storage.exists(nombre):
+            storage.delete(nombre)
+        if not storage.exists(nombre):
+            nombre = storage.save(nombre, ContentFile(_webp(contenido, TAMANOS[tamano])))
+        nombres[tamano] = nombre
+        cache.set(_clave_cache(imagen, tamano), storage.url(nombre), None)
+    return nombres
+
+
+def url_miniatura(imagen, tamano):
+    """URL de la miniatura; si no existe se genera aquí. Si la imagen no se puede leer, la original."""
+    if not imagen:
+        return ""
+    url = cache.get(_clave_cache(imagen, tamano))
+    if url is None:
+        try:
+            url = imagen.storage.url(generar(imagen, [tamano])[tamano])
+        except (OSError, ValueError, Image.DecompressionBombError):
+            # Archivo faltante, que Pillow no reconoce o demasiado grande para
+            # abrirlo: se usa el original y se reintenta más tarde
+            logger.warning("No se pudo generar la miniatura %s de %s", tamano, imagen.name, exc_info=True)
+            url = imagen.url
+            cache.set(_clave_cache(imagen, tamano), url, 60 * 60)
+    return url
+
+
+class ConMiniaturas:
+    """Agrega ``imagen_thumb_url``, ``imagen_card_url`` e ``imagen_detalle_url`` a modelos con ``imagen``."""
+    @property
+    def imagen_thumb_url(self):
+        return url_miniatura(self.imagen, "thumb")
+
+    @property
+    def imagen_card_url(self):
+        return url_miniatura(self.imagen, "card")
+
+    @property
+    def imagen_detalle_url(self):
+        return url_miniatura(self.imagen, "detalle")
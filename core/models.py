@@ -1,7 +1,49 @@
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.contrib.auth.models import User
+from .utils import normalizar_texto
+from .miniaturas import ConMiniaturas
+from .almacenamiento import almacenamiento_imagenes, almacenamiento_privado
+
+class ConNombreNormalizado(models.Model):
+    """
+    Guarda el nombre sin acentos ni mayúsculas en una columna única e indexada,
+    así "Ferretería" y "FERRETERIA" son el mismo registro y se buscan con una
+    sola consulta. Ojo: bulk_create y update() no pasan por save().
+    """
+    nombre_normalizado = models.CharField(max_length=150, unique=True, editable=False)
 
-class Categoria(models.Model):
+    class Meta:
+        abstract = True
+
+    def validate_unique(self, exclude=None):
+        # nombre_normalizado no es editable y los formularios no lo revisan: sin
+        # esto "TRUPER" junto a "Truper" llegaba a la base como IntegrityError
+        errores = {}
+        try:
+            super().validate_unique(exclude)
+        except ValidationError as e:
+            errores = e.update_error_dict(errores)
+        if "nombre" not in (exclude or ()) and "nombre" not in errores:
+            igual = (
+                type(self)._default_manager.filter(nombre_normalizado=normalizar_texto(self.nombre or ""))
+                .exclude(pk=self.pk).first()
+            )
+            if igual is not None:
+                errores["nombre"] = [ValidationError(
+                    f"Ya existe «{igual.nombre}»: sin acentos ni mayúsculas es el mismo nombre.", code="unique",
+                )]
+        if errores:
+            raise ValidationError(errores)
+
+    def save(self, *args, **kwargs):
+        self.nombre_normalizado = normalizar_texto(self.nombre)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "nombre" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "nombre_normalizado"}
+        super().save(*args, **kwargs)
+
+class Categoria(ConNombreNormalizado):
     nombre = models.CharField(max_length=100, unique=True)
     descripcion = models.TextField(blank=True, null=True)
     class Meta:
@@ -10,16 +52,16 @@ class Categoria(models.Model):
         ordering = ["nombre"]
     def __str__(self): return self.nombre
 
-class Marca(models.Model):
+class Marca(ConNombreNormalizado):
     nombre = models.CharField(max_length=100, unique=True)
     def __str__(self): return self.nombre
 
-class Proveedor(models.Model):
+class Proveedor(ConNombreNormalizado):
     nombre = models.CharField(max_length=150, unique=True)
     contacto = models.CharField(max_length=150, blank=True, null=True)
     def __str__(self): return self.nombre
 
-class Producto(models.Model):
+class Producto(ConMiniaturas, models.Model):
     nombre = models.CharField(max_length=100)
     clave = models.CharField(max_length=50, unique=True)
     descripcion = models.TextField(blank=True, null=True)
@@ -33,17 +75,31 @@ class Producto(models.Model):
     
     color = models.CharField(max_length=50, blank=True, null=True)
     departamento = models.CharField(max_length=100, blank=True, null=True)
-    imagen = models.ImageField(upload_to="productos/", blank=True, null=True)
+    imagen = models.ImageField(upload_to="productos/", storage=almacenamiento_imagenes, blank=True, null=True)
     creado = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # Respaldan la paginación por cursor del catálogo (orden nombre, id)
+        indexes = [
+            models.Index(fields=["nombre", "id"], name="producto_nombre_id_idx"),
+            models.Index(fields=["categoria", "nombre", "id"], name="producto_cat_nombre_id_idx"),
+        ]
+
     def __str__(self):
         return f"{self.nombre} ({self.categoria})"
 
-class Promocion(models.Model):
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        # Precio tal como se leyó, para saber en post_save si cambió
+        instancia._precio_guardado = instancia.__dict__.get("precio")
+        return instancia
+
+class Promocion(ConMiniaturas, models.Model):
     titulo = models.CharField(max_length=150)
     descripcion = models.TextField(blank=True)
     descuento = models.DecimalField(max_digits=5, decimal_places=2, help_text="Porcentaje de descuento")
-    imagen = models.ImageField(upload_to='promociones/', blank=True, null=True)
+    imagen = models.ImageField(upload_to='promociones/', storage=almacenamiento_imagenes, blank=True, null=True)
     vigente_hasta = models.DateField()
 
     def __str__(self):
@@ -100,6 +156,8 @@ class Pedido(models.Model):
         ("entregado", "Entregado"),
     ], default="pendiente")
     total = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # Lo marca PedidoService al apartar; los pedidos de antes de apartar existencias quedan en False
+    existencias_apartadas = models.BooleanField(default=False, editable=False)
 
     def __str__(self):
         return f"Pedido #{self.id} - {self.cliente.nombre}"
@@ -126,7 +184,56 @@ class PromocionTicker(models.Model):
         return self.texto
 
 
+class Trabajo(models.Model):
+    """
+    Tarea pesada (importación, exportación, imágenes) que corre fuera de la
+    petición. La encola core.trabajos y la ejecuta ``manage.py run_worker``.
+    """
+    ESTADOS = [
+        ("pendiente", "Pendiente"),
+        ("en_proceso", "En proceso"),
+        ("terminado", "Terminado"),
+        ("fallido", "Fallido"),
+    ]
+    tipo = models.CharField(max_length=50)
+    parametros = models.JSONField(default=dict, blank=True)
+    estado = models.CharField(max_length=20, choices=ESTADOS, default="pendiente")
+    progreso = models.PositiveSmallIntegerField(default=0, help_text="Porcentaje")
+    mensaje = models.TextField(blank=True)
+    # Fuera de MEDIA_ROOT: el resultado se baja con admin:core_trabajo_resultado
+    archivo = models.FileField(upload_to="trabajos/", storage=almacenamiento_privado, blank=True, help_text="Archivo de entrada")
+    resultado = models.FileField(upload_to="trabajos/", storage=almacenamiento_privado, blank=True, help_text="Archivo generado")
+    usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    creado = models.DateTimeField(auto_now_add=True)
+    iniciado = models.DateTimeField(null=True, blank=True)
+    terminado = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-id"]
+        # El trabajador busca "el pendiente más antiguo"
+        indexes = [models.Index(fields=["estado", "id"], name="trabajo_estado_id_idx")]
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} #{self.id} ({self.get_estado_display()})"
+
+    def get_tipo_display(self):
+        return self.tipo.replace("_", " ").capitalize()
 
 
 
+class Aviso(models.Model):
+    """
+    Aviso ya enviado a un grupo de WebSocket. El id es el número de secuencia:
+    quien se reconecta pide los avisos posteriores al último que recibió.
+    Lo guarda core.bandeja_salida y se borra pasado AVISOS_HISTORIAL_SEGUNDOS.
+    """
+    grupo = models.CharField(max_length=100)
+    contenido = models.JSONField()
+    creado = models.DateTimeField(auto_now_add=True, db_index=True)
 
+    class Meta:
+        # Repetición al reconectar: "los del grupo después de la secuencia N"
+        indexes = [models.Index(fields=["grupo", "id"], name="aviso_grupo_id_idx")]
+
+    def __str__(self):
+        return f"{self.grupo} #{self.id}"
@@ -0,0 +1,154 @@
+"""
+Paginación por cursor (keyset) para el catálogo.
+
+En vez de ``OFFSET`` cada página pide "los siguientes N después de este
+producto", lo que cuesta lo mismo en la página 1 que en la 200. El cursor viaja
+en la URL como un token opaco. ``PaginaCursor`` imita la interfaz de
+``django.core.paginator.Page`` que usan las plantillas; ``next_page_number`` y
+``previous_page_number`` devuelven el token en lugar de un número.
+"""
+import base64
+import hashlib
+import json
+import math
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+DURACION_CONTEO = 5 * 60
+
+
+def codificar_cursor(numero, direccion, valores):
+    datos = json.dumps([numero, direccion, valores], separators=(",", ":"))
+    return base64.urlsafe_b64encode(datos.encode()).decode().rstrip("=")
+
+
+def decodificar_cursor(token):
+    """Devuelve (numero, direccion, valores) o None si el token no es válido."""
+    try:
+        relleno = "=" * (-len(token) % 4)
+        numero, direccion, valores = json.loads(base64.urlsafe_b64decode(token + relleno))
+    except (ValueError, TypeError):
+        return None
+    if direccion not in ("s", "a") or not isinstance(valores, list) or not isinstance(numero, int):
+        return None
+    # Sólo escalares: None, listas u objetos no se pueden comparar con una columna
+    if not all(isinstance(v, (str, int, float)) and not isinstance(v, bool) for v in valores):
+        return None
+    return numero, direccion, valores
+
+
+class PaginaCursor:
+    def __init__(self, objetos, numero, paginador, anterior=None, siguiente=None):
+        self.object_list = objetos
+        self.number = numero
+        self.paginator = paginador
+        self._anterior = anterior
+        self._siguiente = siguiente
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, indice):
+        return self.object_list[indice]
+
+    def has_previous(self):
+        return self._anterior is not None
+
+    def has_next(self):
+        return self._siguiente is not None
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+    def previous_page_number(self):
+        return self._anterior
+
+    def next_page_number(self):
+        return self._siguiente
+
+
+class PaginadorCursor:
+    """
+    Pagina ``queryset`` ordenado por los campos de ``orden`` (todos ascendentes;
+    el último debe ser único, p. ej. ``id``). Con ``conteo_estimado`` el total
+    de páginas sale de un conteo guardado unos minutos en caché en lugar de un
+    ``COUNT(*)`` en cada petición.
+    """
+    def __init__(self, queryset, por_pagina, orden=("nombre", "id"), conteo_estimado=True):
+        self.orden = tuple(orden)
+        self.queryset = queryset.order_by(*self.orden)
+        self.per_page = por_pagina
+        self.conteo_estimado = conteo_estimado
+
+    @cached_property
+    def count(self):
+        if not self.conteo_estimado:
+            return self.queryset.count()
+        clave = "catalogo:conteo:" + hashlib.md5(str(self.queryset.query).encode()).hexdigest()
+        conteo = cache.get(clave)
+        if conteo is None:
+            conteo = self.queryset.count()
+            cache.set(clave, conteo, DURACION_CONTEO)
+        return conteo
+
+    @cached_property
+    def num_pages(self):
+        return max(1, math.ceil(self.count / self.per_page))
+
+    def _valores(self, objeto):
+        return [getattr(objeto, campo) for campo in self.orden]
+
+    def _despues_de(self, valores, sentido):
+        """(campo1, campo2, ...) > valores, o < si sentido es "lt"."""
+        condicion = Q()
+        for i, campo in enumerate(self.orden):
+            iguales = dict(zip(self.orden[:i], valores[:i]))
+            condicion |= Q(**iguales, **{f"{campo}__{sentido}": valores[i]})
+        return condicion
+
+    def _cursor(self, token):
+        """(numero, direccion, queryset filtrado) del token, o None para ir a la primera página."""
+        cursor = decodificar_cursor(token) if token else None
+        if cursor is None or len(cursor[2]) != len(self.orden):
+            return None
+        numero, direccion, valores = cursor
+        try:
+            # Un token alterado puede traer "x" donde va un id
+            filtrado = self.queryset.filter(self._despues_de(valores, "gt" if direccion == "s" else "lt"))
+        except (ValueError, TypeError, ValidationError):
+            return None
+        return numero, direccion, filtrado
+
+    def get_page(self, token=None):
+        cursor = self._cursor(token)
+        if cursor is None:
+            numero, direccion, filtrado = 1, "s", None
+        else:
+            numero, direccion, filtrado = cursor
+
+        if direccion == "s":
+            queryset = self.queryset if filtrado is None else filtrado
+            objetos = list(queryset[:self.per_page + 1])
+            hay_mas_adelante = len(objetos) > self.per_page
+            objetos = objetos[:self.per_page]
+            hay_mas_atras = filtrado is not None
+        else:
+            objetos = list(filtrado.reverse()[:self.per_page + 1])
+            hay_mas_atras = len(objetos) > self.per_page
+            objetos = objetos[:self.per_page][::-1]
+            hay_mas_adelante = True
+
+        if not hay_mas_atras:
+            numero = 1
+        anterior = siguiente = None
+        if objetos and hay_mas_atras:
+            anterior = codificar_cursor(numero - 1, "a", self._valores(objetos[0]))
+        if objetos and hay_mas_adelante:
+            siguiente = codificar_cursor(numero + 1, "s", self._valores(objetos[-1]))
+        return PaginaCursor(objetos, numero, self, anterior, siguiente)
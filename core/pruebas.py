@@ -0,0 +1,30 @@
+"""
+Ejecutor de pruebas del proyecto.
+
+La caché por omisión es una carpeta compartida por todos los procesos del
+sitio (``settings.CACHES``): las pruebas no deben leer ni vaciar la del sitio
+en marcha, así que usan una carpeta temporal que se borra al terminar.
+"""
+import tempfile
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class EjecutorPruebas(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._carpeta = tempfile.TemporaryDirectory()
+        caches = {}
+        for alias, ajustes in settings.CACHES.items():
+            if ajustes["BACKEND"].endswith("FileBasedCache"):
+                ajustes = {**ajustes, "LOCATION": f"{self._carpeta.name}/{alias}"}
+            caches[alias] = ajustes
+        self._ajustes = override_settings(CACHES=caches)
+        self._ajustes.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._ajustes.disable()
+        self._carpeta.cleanup()
+        super().teardown_test_environment(**kwargs)
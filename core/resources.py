@@ -1,30 +1,41 @@
-import unicodedata
 from import_export import resources, fields
 from import_export.widgets import ForeignKeyWidget, DecimalWidget, IntegerWidget
 from .models import Producto, Categoria, Marca, Proveedor
+from .utils import ResolutorNombres
+from . import busqueda, facetas
 
-def normalizar_texto(texto):
-    if not texto or str(texto).strip().lower() == 'none':
-        return ""
-    texto_normalizado = unicodedata.normalize('NFD', str(texto))
-    texto_sin_acentos = "".join([c for c in texto_normalizado if unicodedata.category(c) != 'Mn'])
-    return texto_sin_acentos.strip().lower()
+def mapear_cabeceras(headers):
+    """Traduce las cabeceras del Excel del proveedor a los nombres de columna del recurso."""
+    headers = [str(h).lower().strip() if h else "" for h in headers]
+    new_headers = []
+    desc_count = 0
+    
+    for h in headers:
+        if 'descrip' in h:
+            desc_count += 1
+            new_headers.append(f"descripcion_{desc_count}")
+        elif 'clav' in h:
+            new_headers.append("clave")
+        elif 'prov' in h:
+            new_headers.append("proveedor")
+        elif 'marc' in h:
+            new_headers.append("marca")
+        elif 'depa' in h:
+            new_headers.append("departamento")
+        else:
+            new_headers.append(h)
+    return new_headers
 
 class SmartFKWidget(ForeignKeyWidget):
     """Widget para Categoria, Marca y Proveedor que busca ignorando acentos o crea si no existe."""
+    def __init__(self, model, field="pk", **kwargs):
+        super().__init__(model, field, **kwargs)
+        # Los nombres normalizados se cargan una vez por importación, no una vez por fila
+        self.resolutor = ResolutorNombres(model, field)
+
     def clean(self, value, row=None, **kwargs):
         if value and str(value).strip().lower() not in ['none', 'nan', '']:
-            nombre_excel = str(value).strip()
-            nombre_busqueda = normalizar_texto(nombre_excel)
-            
-            # Buscar en la base de datos comparando versiones normalizadas
-            qs = self.model.objects.all()
-            for obj in qs:
-                if normalizar_texto(getattr(obj, self.field)) == nombre_busqueda:
-                    return obj
-            
-            # Si no se encuentra, crear uno nuevo
-            return self.model.objects.create(**{self.field: nombre_excel})
+            return self.resolutor.obtener(str(value).strip())
         return None
 
 class DineroWidget(DecimalWidget):
@@ -79,31 +90,22 @@ class ProductoResource(resources.ModelResource):
         skip_unchanged = True
         report_skipped = True
 
+    def import_data(self, dataset, *args, **kwargs):
+        # El índice de búsqueda y las facetas se actualizan una sola vez al terminar la importación
+        with busqueda.indexacion_diferida(), facetas.invalidacion_diferida():
+            return super().import_data(dataset, *args, **kwargs)
+
     def get_import_id_fields(self):
         return ['clave']
 
     def before_import(self, dataset, **kwargs):
         """Pre-procesamiento de cabeceras de Excel."""
-        headers = [str(h).lower().strip() if h else "" for h in dataset.headers]
-        new_headers = []
-        desc_count = 0
-        
-        for h in headers:
-            if 'descrip' in h:
-                desc_count += 1
-                new_headers.append(f"descripcion_{desc_count}")
-            elif 'clav' in h:
-                new_headers.append("clave")
-            elif 'prov' in h:
-                new_headers.append("proveedor")
-            elif 'marc' in h:
-                new_headers.append("marca")
-            elif 'depa' in h:
-                new_headers.append("departamento")
-            else:
-                new_headers.append(h)
-        
-        dataset.headers = new_headers
+        dataset.headers = mapear_cabeceras(dataset.headers)
+        for resolutor in self._resolutores():
+            resolutor.reiniciar()
+
+    def _resolutores(self):
+        return [self.fields[campo].widget.resolutor for campo in ("categoria", "marca", "proveedor")]
 
     def skip_row(self, instance, original, row, import_validation_errors=None):
         """Evita la creación de filas vacías (los famosos cuadros verdes sin texto)."""
@@ -3,4 +3,5 @@ from . import consumers
 
 websocket_urlpatterns = [
     re_path(r'ws/notifications/$', consumers.NotificacionConsumer.as_asgi()),
+    re_path(r'ws/productos/$', consumers.ProductosConsumer.as_asgi()),
 ]
\ No newline at end of file
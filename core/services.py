@@ -0,0 +1,175 @@
+"""
+Servicios de cotizaciones y pedidos.
+
+Agrupan las operaciones que escriben muchas filas a la vez para hacerlas con
+pocas consultas y dentro de una sola transacción.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import DecimalField, F, Q, Sum, Value
+from django.db.models.functions import Coalesce
+
+from . import events, inventario
+from .models import Producto, Cotizacion, CotizacionItem, Pedido, PedidoItem
+
+
+class CotizacionService:
+    @staticmethod
+    def _lineas(carrito):
+        """Convierte el carrito de la sesión en {producto_id: (producto, cantidad, subtotal)}."""
+        productos = Producto.objects.in_bulk([int(p_id) for p_id in carrito])
+        lineas = {}
+        for p_id, cantidad in carrito.items():
+            producto = productos.get(int(p_id))
+            if producto is None or producto.precio is None:
+                continue
+            lineas[producto.id] = (producto, cantidad, producto.precio * cantidad)
+        return lineas
+
+    @classmethod
+    def crear_desde_carrito(cls, carrito, cliente=None):
+        """Crea una cotización con todas las líneas del carrito en una sola transacción."""
+        with transaction.atomic():
+            lineas = cls._lineas(carrito)
+            total = sum((subtotal for _, _, subtotal in lineas.values()), Decimal("0.00"))
+            cotizacion = Cotizacion.objects.create(cliente=cliente, total=total)
+            CotizacionItem.objects.bulk_create([
+                CotizacionItem(cotizacion=cotizacion, producto=producto, cantidad=cantidad, subtotal=subtotal)
+                for producto, cantidad, subtotal in lineas.values()
+            ])
+        return cotizacion
+
+    @classmethod
+    def reemplazar_desde_carrito(cls, cotizacion_id, carrito, cliente=None):
+        """
+        Actualiza en su lugar la cotización que se estaba editando: cambia las
+        líneas que siguen en el carrito, agrega las nuevas y borra las que se
+        quitaron. Si la cotización ya no existe se crea una nueva.
+        """
+        with transaction.atomic():
+            cotizacion = Cotizacion.objects.select_for_update().filter(id=cotizacion_id).first()
+            if cotizacion is None:
+                return cls.crear_desde_carrito(carrito, cliente)
+
+            lineas = cls._lineas(carrito)
+            total = sum((subtotal for _, _, subtotal in lineas.values()), Decimal("0.00"))
+            cambiados = []
+            borrar = []
+            for item in cotizacion.items.all():
+                linea = lineas.pop(item.producto_id, None)
+                if linea is None:
+                    borrar.append(item.id)
+                    continue
+                _, cantidad, subtotal = linea
+                if item.cantidad != cantidad or item.subtotal != subtotal:
+                    item.cantidad = cantidad
+                    item.subtotal = subtotal
+                    cambiados.append(item)
+
+            if borrar:
+                CotizacionItem.objects.filter(id__in=borrar).delete()
+            CotizacionItem.objects.bulk_update(cambiados, ["cantidad", "subtotal"])
+            CotizacionItem.objects.bulk_create([
+                CotizacionItem(cotizacion=cotizacion, producto=producto, cantidad=cantidad, subtotal=subtotal)
+                for producto, cantidad, subtotal in lineas.values()
+            ])
+
+            cotizacion.cliente = cliente
+            cotizacion.total = total
+            cotizacion.save(update_fields=["cliente", "total"])
+        return cotizacion
+
+
+class PedidoService:
+    @staticmethod
+    def agregar_producto(cliente, producto):
+        """
+        Suma una pieza de ``producto`` al pedido pendiente del cliente. El total
+        se actualiza con un UPDATE total = total + precio, sin releer las líneas.
+        """
+        with transaction.atomic():
+            pedido, _ = Pedido.objects.get_or_create(cliente=cliente, estado="pendiente", defaults={"total": 0})
+            detalle, creado = PedidoItem.objects.get_or_create(
+                pedido=pedido, producto=producto,
+                defaults={"cantidad": 1, "precio_unitario": producto.precio}
+            )
+            if not creado:
+                PedidoItem.objects.filter(pk=detalle.pk).update(cantidad=F("cantidad") + 1)
+            Pedido.objects.filter(pk=pedido.pk).update(total=F("total") + detalle.precio_unitario)
+        return pedido
+
+    @staticmethod
+    def con_total_descuadrado(pedidos=None):
+        """Pedidos cuyo total guardado no coincide con la suma de sus líneas, calculada en la base."""
+        if pedidos is None:
+            pedidos = Pedido.objects.all()
+        return pedidos.annotate(
+            total_calculado=Coalesce(
+                Sum(F("items__cantidad") * F("items__precio_unitario")),
+                Value(0),
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            )
+        ).filter(~Q(total=F("total_calculado")))
+
+    @staticmethod
+    def crear_desde_cotizacion(cotizacion, cliente):
+        """
+        Convierte una cotización en pedido. Las líneas se leen antes de la
+        primera escritura y se copian con un solo bulk_create, así el candado
+        de escritura de SQLite dura lo mínimo. Aparta las existencias de todas
+        las líneas o lanza ``inventario.StockInsuficiente`` sin crear nada. El
+        aviso a los administradores se manda hasta que la transacción se confirma.
+        """
+        with transaction.atomic():
+            items = list(cotizacion.items.select_related("producto"))
+
+            inventario.reservar((item.producto_id, item.cantidad) for item in items)
+            pedido = Pedido(cliente=cliente, total=cotizacion.total, estado="procesado", existencias_apartadas=True)
+            # Avisa CotizacionConvertida (abajo); sin esto el staff recibiría dos avisos del mismo pedido
+            pedido.aviso_propio = True
+            pedido.save(force_insert=True)
+            PedidoItem.objects.bulk_create([
+                PedidoItem(
+                    pedido=pedido,
+                    producto=item.producto,
+                    cantidad=item.cantidad,
+                    precio_unitario=item.producto.precio,
+                )
+                for item in items
+            ])
+
+            # Marcar cotización como convertida (la oculta de la lista)
+            cotizacion.convertida_en_pedido = True
+            cotizacion.save(update_fields=["convertida_en_pedido"])
+
+            events.publicar(events.CotizacionConvertida(
+                cotizacion_id=cotizacion.id, pedido_id=pedido.id, total=str(cotizacion.total), cliente_id=cliente.id,
+            ))
+        return pedido
+
+    @staticmethod
+    def confirmar(pedido):
+        """
+        Pasa un pedido pendiente a procesado apartando sus existencias. Devuelve
+        False si el pedido ya no estaba pendiente (p. ej. doble clic).
+        """
+        with transaction.atomic():
+            if not Pedido.objects.filter(id=pedido.id, estado="pendiente").update(estado="procesado", existencias_apartadas=True):
+                return False
+            inventario.reservar(pedido.items.values_list("producto_id", "cantidad"))
+        pedido.estado = "procesado"
+        pedido.existencias_apartadas = True
+        return True
+
+    @staticmethod
+    def eliminar(pedido):
+        """
+        Borra el pedido; si estaba procesado (apartado pero no entregado) regresa
+        sus existencias. Sólo si las apartó este servicio: los pedidos procesados
+        antes de apartar existencias nunca las descontaron.
+        """
+        with transaction.atomic():
+            if pedido.estado == "procesado" and pedido.existencias_apartadas:
+                inventario.liberar(pedido.items.values_list("producto_id", "cantidad"))
+            pedido.delete()
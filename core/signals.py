@@ -1,26 +1,95 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_save
 from django.dispatch import receiver
 from .models import Pedido  # Asegúrate de que el nombre de tu modelo sea Pedido
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
+from .models import Producto, Categoria, Marca, Proveedor, Promocion, PromocionTicker
+from . import busqueda, cache_paginas, carrito, events, facetas, trabajos
 
 @receiver(post_save, sender=Pedido)
-def notificar_admin_nuevo_pedido(sender, instance, created, **kwargs):
-    if created:
-        channel_layer = get_channel_layer()
-        
-        # Obtenemos el nombre del cliente correctamente
-        # Si 'cliente' tiene una relación con User llamada 'usuario':
-        nombre_cliente = instance.cliente.usuario.username 
-        # Si prefieres el nombre real y existe el campo:
-        # nombre_cliente = instance.cliente.nombre 
-
-        async_to_sync(channel_layer.group_send)(
-            "notificaciones_admin",
-            {
-                "type": "enviar_alerta",
-                "mensaje": f"Pedido #{instance.id} recibido",
-                "total": str(instance.total),
-                "cliente": nombre_cliente # Corregido aquí
-            }
-        )
\ No newline at end of file
+def notificar_admin_nuevo_pedido(sender, instance, created, using, **kwargs):
+    # Los pedidos que salen de una cotización ya avisan con CotizacionConvertida
+    if created and not getattr(instance, "aviso_propio", False):
+        events.publicar(events.PedidoNuevo(pedido_id=instance.id), using=using)
+
+# --- PRECIOS Y EXISTENCIAS EN VIVO (ws/productos/) ---
+@receiver(post_save, sender=Producto)
+@receiver(post_delete, sender=Producto)
+def avisar_cambio_de_producto(sender, instance, using, **kwargs):
+    events.publicar_productos([instance.pk], using=using)
+
+# --- ÍNDICE DE BÚSQUEDA DE PRODUCTOS ---
+@receiver(post_save, sender=Producto)
+def indexar_producto(sender, instance, using, **kwargs):
+    busqueda.registrar_cambios([instance.pk], using=using)
+
+@receiver(post_delete, sender=Producto)
+def quitar_producto_del_indice(sender, instance, using, **kwargs):
+    busqueda.quitar_productos([instance.pk], using=using)
+
+@receiver(post_save, sender=Marca)
+@receiver(post_save, sender=Proveedor)
+def reindexar_productos_relacionados(sender, instance, created, using, **kwargs):
+    # Si cambia el nombre de una marca o proveedor, sus productos deben reflejarlo
+    if not created:
+        campo = "marca" if sender is Marca else "proveedor"
+        ids = Producto.objects.using(using).filter(**{campo: instance}).values_list("pk", flat=True)
+        busqueda.registrar_cambios(list(ids), using=using)
+
+# --- RESUMEN DEL CARRITO EN SESIÓN ---
+_PRECIO_DESCONOCIDO = object()
+
+@receiver(post_save, sender=Producto)
+def invalidar_carritos_si_cambia_precio(sender, instance, created, **kwargs):
+    # Si la instancia no se leyó de la base no sabemos el precio anterior
+    if not created and getattr(instance, "_precio_guardado", _PRECIO_DESCONOCIDO) != instance.precio:
+        carrito.invalidar_precios()
+    instance._precio_guardado = instance.precio
+
+@receiver(post_delete, sender=Producto)
+def invalidar_carritos_si_se_borra(sender, instance, **kwargs):
+    carrito.invalidar_precios()
+
+# --- FACETAS DEL CATÁLOGO ---
+@receiver(post_save, sender=Categoria)
+@receiver(post_delete, sender=Categoria)
+@receiver(post_save, sender=Marca)
+@receiver(post_delete, sender=Marca)
+@receiver(post_save, sender=Proveedor)
+@receiver(post_delete, sender=Proveedor)
+@receiver(post_save, sender=Producto)
+@receiver(post_delete, sender=Producto)
+def invalidar_facetas(sender, **kwargs):
+    facetas.invalidar()
+
+# --- PÁGINAS PÚBLICAS EN CACHÉ ---
+@receiver(post_save, sender=Producto)
+@receiver(post_delete, sender=Producto)
+@receiver(post_save, sender=Promocion)
+@receiver(post_delete, sender=Promocion)
+@receiver(post_save, sender=PromocionTicker)
+@receiver(post_delete, sender=PromocionTicker)
+@receiver(post_save, sender=Categoria)
+@receiver(post_delete, sender=Categoria)
+@receiver(post_save, sender=Marca)
+@receiver(post_delete, sender=Marca)
+@receiver(post_save, sender=Proveedor)
+@receiver(post_delete, sender=Proveedor)
+def invalidar_paginas(sender, **kwargs):
+    cache_paginas.invalidar()
+
+# --- MINIATURAS DE IMÁGENES ---
+@receiver(pre_save, sender=Producto)
+@receiver(pre_save, sender=Promocion)
+def detectar_imagen_nueva(sender, instance, **kwargs):
+    # _committed es False sólo mientras el archivo recién subido no se ha guardado en el storage
+    instance._imagen_nueva = bool(instance.imagen) and not instance.imagen._committed
+
+@receiver(post_save, sender=Producto)
+@receiver(post_save, sender=Promocion)
+def encolar_miniaturas(sender, instance, **kwargs):
+    if getattr(instance, "_imagen_nueva", False):
+        instance._imagen_nueva = False
+        transaction.on_commit(lambda: trabajos.encolar(
+            "generar_miniaturas", modelo=sender._meta.model_name, pk=instance.pk
+        ), robust=True)
+
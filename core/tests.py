@@ -1,3 +1,1558 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.exceptions import ChannelFull
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, Permission, User
+from django.core.cache import cache, caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from openpyxl import load_workbook
+from PIL import Image
+from tablib import Dataset
+
+from . import bandeja_salida, carrito, events, facetas, inventario, trabajos
+from .busqueda import buscar_productos
+from .capa_canales import CapaSQLite
+from .consumers import NotificacionConsumer, ProductosConsumer
+from .carrito import ResumenCarrito
+from .context_processors import carrito_context
+from .facetas import obtener_facetas
+from .importacion import ImportadorProductos
+from .management.commands.importar_productos import huella
+from .models import Aviso, Categoria, Cliente, Cotizacion, Marca, Pedido, PedidoItem, Producto, PromocionTicker, Proveedor, Trabajo
+from .paginacion import codificar_cursor
+from .resources import ProductoResource
+from .services import CotizacionService, PedidoService
+from .utils import ResolutorNombres, cache_por_proceso
+
+
+class CapaTemporal:
+    """
+    Para las pruebas que mandan avisos: la capa de canales en un archivo
+    temporal, no en canales.sqlite3 (ahí llegarían a los sockets del staff).
+    """
+    @classmethod
+    def setUpClass(cls):
+        directorio = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(directorio.cleanup)
+        ajustes = override_settings(CHANNEL_LAYERS={
+            "default": {
+                "BACKEND": "core.capa_canales.CapaSQLite",
+                "CONFIG": {"ruta": os.path.join(directorio.name, "canales.sqlite3")},
+            },
+        })
+        ajustes.enable()
+        cls.addClassCleanup(ajustes.disable)
+        # Las limpiezas corren al revés: primero se vacía la bandeja
+        cls.addClassCleanup(events.esperar)
+        super().setUpClass()
+
+
+class CarpetasTemporales:
+    """
+    Un directorio temporal por clase para cada ajuste de ``carpetas`` (p. ej.
+    MEDIA_ROOT), que se borra al terminar la clase.
+    """
+    carpetas = ("MEDIA_ROOT",)
+
+    @classmethod
+    def setUpClass(cls):
+        directorios = {}
+        for ajuste in cls.carpetas:
+            directorio = tempfile.TemporaryDirectory()
+            cls.addClassCleanup(directorio.cleanup)
+            directorios[ajuste] = directorio.name
+        ajustes = override_settings(**directorios)
+        ajustes.enable()
+        cls.addClassCleanup(ajustes.disable)
+        super().setUpClass()
+
+
+class BusquedaProductosTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.categoria = Categoria.objects.create(nombre="Construcción")
+        cls.marca = Marca.objects.create(nombre="Truper")
+        cls.martillo = Producto.objects.create(
+            nombre="Martillo de uña", clave="MAR-16", precio=150,
+            categoria=cls.categoria, marca=cls.marca,
+        )
+        cls.cemento = Producto.objects.create(
+            nombre="Cemento gris", clave="CEM-50", descripcion="Saco de 50 kg para construcción",
+            precio=230, categoria=cls.categoria,
+        )
+
+    def test_ignora_acentos_y_mayusculas(self):
+        self.assertEqual(list(buscar_productos("UNA")), [self.martillo])
+        self.assertEqual(list(buscar_productos("construccion")), [self.cemento])
+
+    def test_busqueda_por_prefijo_y_marca(self):
+        self.assertEqual(list(buscar_productos("mart")), [self.martillo])
+        self.assertEqual(list(buscar_productos("trup")), [self.martillo])
+        self.assertEqual(list(buscar_productos("cem-50")), [self.cemento])
+
+    def test_nombre_pesa_mas_que_descripcion(self):
+        saco = Producto.objects.create(
+            nombre="Saco de arena", clave="ARE-01", precio=40, categoria=self.categoria,
+        )
+        self.assertEqual(list(buscar_productos("saco")), [saco, self.cemento])
+
+    def test_indice_sigue_a_los_cambios(self):
+        self.martillo.nombre = "Mazo de goma"
+        self.martillo.save()
+        self.assertEqual(list(buscar_productos("martillo")), [])
+        self.assertEqual(list(buscar_productos("goma")), [self.martillo])
+
+        self.marca.nombre = "Pretul"
+        self.marca.save()
+        self.assertEqual(list(buscar_productos("pretul")), [self.martillo])
+
+        self.martillo.delete()
+        self.assertEqual(list(buscar_productos("goma")), [])
+
+    def test_importacion_indexa_productos(self):
+        dataset = Dataset(headers=["Clave", "Descripción", "Categoria", "Precio", "Existencia"])
+        dataset.append(["TAL-01", "Taladro percutor", "Herramientas", "$1,299.00", "5"])
+        resultado = ProductoResource().import_data(dataset, raise_errors=True)
+        self.assertFalse(resultado.has_errors())
+        self.assertEqual([p.clave for p in buscar_productos("percutor")], ["TAL-01"])
+
+    def test_vistas_usan_el_servicio(self):
+        respuesta = self.client.get(reverse("productos"), {"q": "martíllo"})
+        self.assertEqual(list(respuesta.context["page_obj"]), [self.martillo])
+        respuesta = self.client.get(reverse("cotizador"), {"q": "cemen"})
+        self.assertEqual(list(respuesta.context["productos"]), [self.cemento])
+
+
+class CarritoContextTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        categoria = Categoria.objects.create(nombre="Plomería")
+        cls.productos = [
+            Producto.objects.create(nombre=f"Codo {i}", clave=f"COD-{i}", precio=10 + i, categoria=categoria)
+            for i in range(30)
+        ]
+
+    def _request(self, carrito):
+        request = RequestFactory().get("/")
+        request.session = {"cotizacion_items": carrito}
+        return request
+
+    def test_consultas_constantes_sin_importar_el_tamano(self):
+        for productos in (self.productos[:1], self.productos):
+            carrito = {str(p.id): 2 for p in productos}
+            contexto = carrito_context(self._request(carrito))
+            with self.assertNumQueries(1):
+                total = contexto["carrito_total"]()
+                contexto["carrito_total"]()
+            self.assertEqual(total, sum(p.precio * 2 for p in productos))
+            self.assertEqual(contexto["carrito_count"](), 2 * len(productos))
+
+    def test_sin_consultas_si_no_se_usa_el_total(self):
+        carrito = {str(p.id): 1 for p in self.productos}
+        with self.assertNumQueries(0):
+            contexto = carrito_context(self._request(carrito))
+            self.assertEqual(contexto["carrito_count"](), 30)
+
+    def test_ignora_productos_eliminados(self):
+        carrito = {str(self.productos[0].id): 3, "999999": 1}
+        contexto = carrito_context(self._request(carrito))
+        self.assertEqual(contexto["carrito_total"](), self.productos[0].precio * 3)
+
+
+class ResumenCarritoSesionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        categoria = Categoria.objects.create(nombre="Pinturas")
+        cls.vinilica = Producto.objects.create(nombre="Pintura vinílica", clave="PIN-01", precio=Decimal("350.00"), categoria=categoria)
+        cls.brocha = Producto.objects.create(nombre="Brocha de 4 pulgadas", clave="BRO-04", precio=Decimal("45.50"), categoria=categoria)
+
+    def _agregar(self, producto, cantidad):
+        self.client.post(
+            f"{reverse('cotizador')}?q={producto.clave}",
+            {f"cantidad_{producto.id}": cantidad, "agregar": "1"},
+        )
+
+    def test_badge_sin_consultas_con_resumen_vigente(self):
+        self._agregar(self.vinilica, 2)
+        self._agregar(self.brocha, 1)
+        sesion = dict(self.client.session)
+        self.assertEqual(sesion["cotizacion_resumen"]["cantidad"], 3)
+        resumen = ResumenCarrito(sesion)
+        with self.assertNumQueries(0):
+            self.assertEqual(resumen.total, Decimal("745.50"))
+            self.assertEqual(resumen.cantidad, 3)
+
+    def test_eliminar_actualiza_el_resumen(self):
+        self._agregar(self.vinilica, 2)
+        self._agregar(self.brocha, 2)
+        self.client.post(reverse("eliminar_del_carrito", args=[self.vinilica.id]))
+        resumen = self.client.session["cotizacion_resumen"]
+        self.assertEqual(Decimal(resumen["total"]), Decimal("91.00"))
+        self.assertEqual(resumen["cantidad"], 2)
+
+    def test_cambio_de_precio_invalida_el_resumen(self):
+        self._agregar(self.brocha, 2)
+        sesion = dict(self.client.session)
+        producto = Producto.objects.get(pk=self.brocha.pk)
+        producto.existencia = 10
+        producto.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(ResumenCarrito(sesion).total, Decimal("91.00"))
+
+        producto.precio = Decimal("50.00")
+        producto.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(ResumenCarrito(sesion).total, Decimal("100.00"))
+
+    def test_cambio_de_precio_en_otro_proceso(self):
+        self._agregar(self.brocha, 2)
+        sesion = dict(self.client.session)
+        # run_worker u otro Daphne renuevan la versión en su propia instancia de la caché
+        caches.create_connection("default").set(carrito.CLAVE_VERSION, "otra", None)
+        Producto.objects.filter(pk=self.brocha.pk).update(precio=Decimal("50.00"))
+        self.assertEqual(ResumenCarrito(sesion).total, Decimal("100.00"))
+
+    def test_con_cache_por_proceso_la_version_vence(self):
+        with override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}):
+            carrito.invalidar_precios()
+            vence = cache._expire_info[cache.make_key(carrito.CLAVE_VERSION)]
+        self.assertLessEqual(vence - time.time(), carrito.VERSION_POR_PROCESO_SEGUNDOS)
+
+
+class CotizacionServiceTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        categoria = Categoria.objects.create(nombre="Eléctrico")
+        cls.productos = [
+            Producto.objects.create(nombre=f"Cable {i}", clave=f"CAB-{i}", precio=Decimal("12.50"), categoria=categoria)
+            for i in range(120)
+        ]
+
+    def test_crear_con_consultas_constantes(self):
+        carrito = {str(p.id): 2 for p in self.productos}
+        with self.assertNumQueries(5):  # savepoint, productos, cotización, items, release
+            cotizacion = CotizacionService.crear_desde_carrito(carrito)
+        self.assertEqual(cotizacion.items.count(), 120)
+        self.assertEqual(Cotizacion.objects.get(pk=cotizacion.pk).total, Decimal("3000.00"))
+
+    def test_reemplazar_actualiza_en_su_lugar(self):
+        original = CotizacionService.crear_desde_carrito({str(p.id): 1 for p in self.productos[:3]})
+        conservado = original.items.get(producto=self.productos[0])
+        carrito = {str(self.productos[0].id): 4, str(self.productos[5].id): 1}
+
+        cotizacion = CotizacionService.reemplazar_desde_carrito(original.id, carrito)
+
+        self.assertEqual(cotizacion.id, original.id)
+        self.assertEqual(Cotizacion.objects.count(), 1)
+        items = {item.producto_id: item for item in cotizacion.items.all()}
+        self.assertEqual(set(items), {self.productos[0].id, self.productos[5].id})
+        self.assertEqual(items[self.productos[0].id].id, conservado.id)
+        self.assertEqual(items[self.productos[0].id].cantidad, 4)
+        self.assertEqual(Cotizacion.objects.get(pk=original.pk).total, Decimal("62.50"))
+
+
+class ConversionPedidoTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        categoria = Categoria.objects.create(nombre="Herrería")
+        productos = [
+            Producto.objects.create(nombre=f"Ángulo {i}", clave=f"ANG-{i}", precio=Decimal("80.00"), existencia=10, categoria=categoria)
+            for i in range(50)
+        ]
+        cls.usuario = User.objects.create_user(username="contratista", password="secreto123")
+        cls.cliente = Cliente.objects.create(usuario=cls.usuario, nombre="Contratista", correo="c@example.com", rfc="CON000000XX1")
+        cls.cotizacion = CotizacionService.crear_desde_carrito({str(p.id): 2 for p in productos}, cls.cliente)
+
+    def test_convierte_con_consultas_constantes_y_avisa_al_confirmar(self):
+        with self.assertNumQueries(9), self.captureOnCommitCallbacks() as avisos:
+            pedido = PedidoService.crear_desde_cotizacion(self.cotizacion, self.cliente)
+        # Existencias apartadas y conversión; el pedido nuevo no se avisa aparte
+        self.assertEqual(len(avisos), 2)
+        self.assertEqual(pedido.items.count(), 50)
+        self.assertTrue(Cotizacion.objects.get(pk=self.cotizacion.pk).convertida_en_pedido)
+
+    def test_vista_convertir(self):
+        self.client.force_login(self.usuario)
+        respuesta = self.client.post(reverse("convertir_a_pedido", args=[self.cotizacion.id]))
+        self.assertRedirects(respuesta, reverse("pedidos"), fetch_redirect_response=False)
+        self.assertEqual(Pedido.objects.get(cliente=self.cliente).items.count(), 50)
+
+
+class InventarioTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        categoria = Categoria.objects.create(nombre="Tornillería")
+        cls.taquete = Producto.objects.create(nombre="Taquete", clave="TAQ-1", precio=1, existencia=100, categoria=categoria)
+        cls.pija = Producto.objects.create(nombre="Pija", clave="PIJ-1", precio=1, existencia=3, categoria=categoria)
+
+    def test_todo_o_nada_con_detalle_por_linea(self):
+        with self.assertRaises(inventario.StockInsuficiente) as error:
+            inventario.reservar([(self.taquete.id, 10), (self.pija.id, 2), (self.pija.id, 2)])
+        self.assertEqual(error.exception.faltantes, [inventario.Faltante(self.pija.id, "Pija", 4, 3)])
+        self.taquete.refresh_from_db()
+        self.assertEqual(self.taquete.existencia, 100)
+
+    def test_confirmar_pedido_aparta_una_sola_vez(self):
+        usuario = User.objects.create_user(username="cliente", password="secreto123")
+        cliente = Cliente.objects.create(usuario=usuario, nombre="Cliente", correo="cl@example.com", rfc="CLI000000XX1")
+        pedido = Pedido.objects.create(cliente=cliente, total=0)
+        pedido.items.create(producto=self.taquete, cantidad=30, precio_unitario=1)
+        self.client.force_login(usuario)
+        for _ in range(2):
+            self.client.get(reverse("confirmar_pedido", args=[pedido.id]))
+        self.taquete.refresh_from_db()
+        self.assertEqual(self.taquete.existencia, 70)
+
+        self.client.post(reverse("eliminar_pedido", args=[pedido.id]))
+        self.taquete.refresh_from_db()
+        self.assertEqual(self.taquete.existencia, 100)
+
+    def test_eliminar_pedido_anterior_no_regresa_existencias(self):
+        # Procesado antes de que se apartaran existencias: nunca se descontaron
+        cliente = Cliente.objects.create(nombre="Antiguo", correo="an@example.com", rfc="ANT000000XX1")
+        pedido = Pedido.objects.create(cliente=cliente, total=0, estado="procesado")
+        pedido.items.create(producto=self.taquete, cantidad=30, precio_unitario=1)
+        PedidoService.eliminar(pedido)
+        self.taquete.refresh_from_db()
+        self.assertEqual(self.taquete.existencia, 100)
+
+
+class ReservaConcurrenteTests(CapaTemporal, TransactionTestCase):
+    def test_confirmaciones_simultaneas_no_venden_de_mas(self):
+        categoria = Categoria.objects.create(nombre="Cementos")
+        cemento = Producto.objects.create(nombre="Cemento", clave="CEM-1", precio=1, existencia=25, categoria=categoria)
+        calidra = Producto.objects.create(nombre="Calidra", clave="CAL-1", precio=1, existencia=100, categoria=categoria)
+        resultados = []
+
+        def comprar():
+            try:
+                inventario.reservar([(cemento.id, 1), (calidra.id, 2)])
+                resultados.append(True)
+            except inventario.StockInsuficiente:
+                resultados.append(False)
+            finally:
+                connection.close()
+
+        hilos = [threading.Thread(target=comprar) for _ in range(40)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        self.assertEqual(resultados.count(True), 25)
+        cemento.refresh_from_db()
+        calidra.refresh_from_db()
+        self.assertEqual(cemento.existencia, 0)
+        self.assertEqual(calidra.existencia, 50)
+
+
+class TotalPedidoIncrementalTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        categoria = Categoria.objects.create(nombre="Jardín")
+        cls.productos = [
+            Producto.objects.create(nombre=f"Manguera {i}", clave=f"MAN-{i}", precio=Decimal("99.90"), categoria=categoria)
+            for i in range(20)
+        ]
+        usuario = User.objects.create_user(username="jardinero")
+        cls.cliente = Cliente.objects.create(usuario=usuario, nombre="Jardinero", correo="j@example.com", rfc="JAR000000XX1")
+
+    def test_agregar_no_depende_del_numero_de_lineas(self):
+        for producto in self.productos[:-1]:
+            PedidoService.agregar_producto(self.cliente, producto)
+        with self.assertNumQueries(8):  # pedido, línea (select + insert con savepoint), total, savepoints
+            pedido = PedidoService.agregar_producto(self.cliente, self.productos[-1])
+        PedidoService.agregar_producto(self.cliente, self.productos[-1])
+
+        pedido.refresh_from_db()
+        self.assertEqual(pedido.total, Decimal("99.90") * 21)
+        self.assertEqual(pedido.items.get(producto=self.productos[-1]).cantidad, 2)
+        self.assertFalse(PedidoService.con_total_descuadrado().exists())
+
+    def test_detecta_totales_descuadrados(self):
+        pedido = PedidoService.agregar_producto(self.cliente, self.productos[0])
+        Pedido.objects.filter(pk=pedido.pk).update(total=1)
+        self.assertEqual(
+            list(PedidoService.con_total_descuadrado().values_list("id", "total_calculado")),
+            [(pedido.id, Decimal("99.90"))],
+        )
+
+
+class ConsultasPorPaginaTests(TestCase):
+    """Las páginas de pedidos y cotizaciones no deben hacer una consulta por fila."""
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = Categoria.objects.create(nombre="Acabados")
+        cls.productos = [
+            Producto.objects.create(nombre=f"Azulejo {i}", clave=f"AZU-{i}", precio=Decimal("20.00"), categoria=categoria)
+            for i in range(10)
+        ]
+        cls.usuario = User.objects.create_user(username="cliente_acabados")
+        cls.cliente = Cliente.objects.create(usuario=cls.usuario, nombre="Acabados", correo="a@example.com", rfc="ACA000000XX1")
+        cls.staff = User.objects.create_user(username="admin_acabados", is_staff=True)
+
+    def _crear_pedido(self, lineas):
+        pedido = Pedido.objects.create(cliente=self.cliente, total=0, estado="procesado")
+        for producto in self.productos[:lineas]:
+            pedido.items.create(producto=producto, cantidad=1, precio_unitario=producto.precio)
+        return pedido
+
+    def _crear_cotizacion(self, lineas):
+        return CotizacionService.crear_desde_carrito(
+            {str(p.id): 1 for p in self.productos[:lineas]}, self.cliente
+        )
+
+    def _consultas(self, url):
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get(url)
+        self.assertEqual(respuesta.status_code, 200)
+        return len(consultas)
+
+    def assertConsultasConstantes(self, url, crear_mas):
+        antes = self._consultas(url)
+        crear_mas()
+        self.assertEqual(self._consultas(url), antes)
+
+    def test_lista_de_pedidos_staff(self):
+        self._crear_pedido(1)
+        self.client.force_login(self.staff)
+        self.assertConsultasConstantes(reverse("pedidos"), lambda: [self._crear_pedido(3) for _ in range(5)])
+
+    def test_lista_de_pedidos_staff_paginada(self):
+        for _ in range(30):
+            self._crear_pedido(1)
+        self.client.force_login(self.staff)
+        respuesta = self.client.get(reverse("pedidos"), {"page": 2})
+        self.assertEqual(len(respuesta.context["pedidos"]), 5)
+
+    def test_lista_de_pedidos_cliente(self):
+        self._crear_pedido(1)
+        self.client.force_login(self.usuario)
+        self.assertConsultasConstantes(reverse("pedidos"), lambda: [self._crear_pedido(3) for _ in range(5)])
+
+    def test_detalle_pedido(self):
+        pedido = self._crear_pedido(1)
+        self.client.force_login(self.staff)
+        url = reverse("detalle_pedido", args=[pedido.id])
+        antes = self._consultas(url)
+        for producto in self.productos[1:]:
+            pedido.items.create(producto=producto, cantidad=2, precio_unitario=producto.precio)
+        self.assertEqual(self._consultas(url), antes)
+
+    def test_detalle_cotizacion(self):
+        pocas = self._crear_cotizacion(1)
+        muchas = self._crear_cotizacion(10)
+        self.assertEqual(
+            self._consultas(reverse("detalle_cotizacion", args=[pocas.id])),
+            self._consultas(reverse("detalle_cotizacion", args=[muchas.id])),
+        )
+
+    def test_cotizaciones_cliente(self):
+        self._crear_cotizacion(1)
+        self.client.force_login(self.usuario)
+        self.assertConsultasConstantes(
+            reverse("cotizaciones_cliente"), lambda: [self._crear_cotizacion(4) for _ in range(5)]
+        )
+
+
+class FacetasTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.categoria = Categoria.objects.create(nombre="Gas")
+        cls.marca = Marca.objects.create(nombre="Rotoplas")
+        Producto.objects.create(nombre="Regulador", clave="REG-1", precio=1, categoria=cls.categoria, marca=cls.marca)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_se_guardan_en_cache_con_conteos(self):
+        facetas = obtener_facetas()
+        self.assertEqual(facetas["marcas"], [{"id": self.marca.id, "nombre": "Rotoplas", "num_productos": 1}])
+        with self.assertNumQueries(0):
+            obtener_facetas()
+
+    def test_senales_invalidan(self):
+        obtener_facetas()
+        Marca.objects.create(nombre="Tuboplus")
+        self.assertEqual([m["nombre"] for m in obtener_facetas()["marcas"]], ["Rotoplas", "Tuboplus"])
+        self.categoria.delete()
+        self.assertEqual(obtener_facetas()["categorias"], [])
+
+    def test_importacion_invalida_al_terminar(self):
+        obtener_facetas()
+        dataset = Dataset(headers=["Clave", "Descripción", "Categoria", "Marca"])
+        dataset.append(["TAN-1", "Tanque estacionario", "Gas", "Tatsa"])
+        ProductoResource().import_data(dataset, raise_errors=True)
+        marcas = {m["nombre"]: m["num_productos"] for m in obtener_facetas()["marcas"]}
+        self.assertEqual(marcas, {"Rotoplas": 1, "Tatsa": 1})
+
+    def test_importacion_en_otro_proceso_invalida(self):
+        obtener_facetas()
+        # Otra instancia de la caché, como la de run_worker: comparte los archivos
+        otro_proceso = caches.create_connection("default")
+        otro_proceso.delete(facetas.CLAVE)
+        self.assertIsNone(cache.get(facetas.CLAVE))
+
+    def test_con_cache_por_proceso_duran_poco(self):
+        with override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}):
+            obtener_facetas()
+            vence = cache._expire_info[cache.make_key(facetas.CLAVE)]
+        self.assertLessEqual(vence - time.time(), facetas.DURACION_POR_PROCESO)
+
+
+class PaginacionCursorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        categoria = Categoria.objects.create(nombre="Cerrajería")
+        # Nombres repetidos para que el id tenga que desempatar
+        cls.productos = [
+            Producto.objects.create(nombre=f"Candado {i // 2:02d}", clave=f"CAN-{i}", precio=1, categoria=categoria)
+            for i in range(30)
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def _pagina(self, **params):
+        return self.client.get(reverse("productos"), params).context["page_obj"]
+
+    def test_recorre_todo_hacia_adelante_y_atras(self):
+        esperado = sorted(self.productos, key=lambda p: (p.nombre, p.id))
+        paginas = [self._pagina()]
+        while paginas[-1].has_next():
+            paginas.append(self._pagina(page=paginas[-1].next_page_number()))
+        self.assertEqual([p.number for p in paginas], [1, 2, 3])
+        self.assertEqual([p.paginator.num_pages for p in paginas], [3, 3, 3])
+        self.assertEqual([prod for pagina in paginas for prod in pagina], esperado)
+
+        atras = self._pagina(page=paginas[-1].previous_page_number())
+        self.assertEqual(list(atras), list(paginas[1]))
+        self.assertEqual(atras.number, 2)
+        primera = self._pagina(page=atras.previous_page_number())
+        self.assertEqual(list(primera), list(paginas[0]))
+        self.assertFalse(primera.has_previous())
+
+    def test_no_usa_offset(self):
+        segunda = self._pagina().next_page_number()
+        with CaptureQueriesContext(connection) as consultas:
+            self._pagina(page=segunda)
+        self.assertFalse(any("OFFSET" in c["sql"] for c in consultas.captured_queries))
+
+    def test_numero_de_pagina_y_token_invalido(self):
+        self.assertEqual(self._pagina(page="2").number, 2)
+        self.assertEqual(self._pagina(page="basura").number, 1)
+
+    def test_token_alterado_da_la_primera_pagina(self):
+        primera = list(self._pagina())
+        for valores in (["a", "x"], ["a", None], [None, None], [[1], {"a": 1}], ["Candado 03", True]):
+            for direccion in ("s", "a"):
+                with self.subTest(valores=valores, direccion=direccion):
+                    pagina = self._pagina(page=codificar_cursor(5, direccion, valores))
+                    self.assertEqual((pagina.number, list(pagina)), (1, primera))
+
+    def test_busqueda_conserva_relevancia(self):
+        destacado = Producto.objects.create(
+            nombre="Chapa", clave="CHA-1", descripcion="Candado", precio=1, categoria=self.productos[0].categoria
+        )
+        pagina = self._pagina(q="candado")
+        self.assertNotIn(destacado, list(pagina))
+        paginas = [pagina]
+        while paginas[-1].has_next():
+            paginas.append(self._pagina(q="candado", page=paginas[-1].next_page_number()))
+        self.assertEqual([prod for p in paginas for prod in p][-1], destacado)
+
+
+class ImportacionMasivaTests(TestCase):
+    CABECERA = ("Clave", "Descripcion", "Categoria", "Marca", "Proveedor", "Departamento", "Precio", "Existencia")
+
+    def setUp(self):
+        self.ferreteria = Categoria.objects.create(nombre="Ferretería")
+        self.existente = Producto.objects.create(
+            nombre="Martillo", clave="MAR-1", precio=Decimal("100.00"), existencia=5, categoria=self.ferreteria
+        )
+        Producto.objects.create(nombre="Pinzas", clave="PIN-1", precio=Decimal("50.00"), existencia=3, categoria=self.ferreteria)
+
+    def _filas(self, n, inicio=0):
+        return [
+            (f"NUE-{i}", f"Tornillo {i}", "FERRETERIA", "Truper", "Surtidora", "", f"${i},00.5", "10.0")
+            for i in range(inicio, inicio + n)
+        ]
+
+    def test_crea_actualiza_y_omite_sin_cambios(self):
+        filas = [
+            self.CABECERA,
+            ("MAR-1", "Martillo", "Ferretería", "", "", "", "120", "5"),
+            ("PIN-1", "Pinzas", "Ferreteria", "", "", "", "50", "3"),
+            ("", "", "", "", "", "", "", ""),
+            ("SIN-CAT", "Sin categoría", "", "", "", "", "1", "1"),
+            *self._filas(2),
+        ]
+        resultado = ImportadorProductos().importar(filas)
+
+        self.assertEqual(
+            (resultado.nuevos, resultado.actualizados, resultado.sin_cambios, resultado.omitidos),
+            (2, 1, 1, 1),
+        )
+        self.assertEqual(resultado.errores, [(5, "Falta la categoría")])
+        self.existente.refresh_from_db()
+        self.assertEqual(self.existente.precio, Decimal("120.00"))
+        # "FERRETERIA" y "Ferreteria" se resuelven a la categoría existente sin duplicarla
+        self.assertEqual(Categoria.objects.count(), 1)
+        self.assertEqual(Marca.objects.get().nombre, "Truper")
+        self.assertEqual(Proveedor.objects.get().nombre, "Surtidora")
+        nuevo = Producto.objects.get(clave="NUE-1")
+        self.assertEqual((nuevo.precio, nuevo.existencia, nuevo.categoria), (Decimal("100.50"), 10, self.ferreteria))
+        self.assertEqual(list(buscar_productos("tornillo")), list(Producto.objects.filter(clave__startswith="NUE").order_by("nombre")))
+
+    def test_consultas_no_crecen_con_las_filas(self):
+        def consultas(n, inicio):
+            with CaptureQueriesContext(connection) as capturadas:
+                ImportadorProductos().importar([self.CABECERA, *self._filas(n, inicio)])
+            return len(capturadas)
+
+        consultas(1, 0)  # crea la marca y el proveedor
+        # 50 filas caben en un solo INSERT aun con el límite de parámetros de SQLite
+        self.assertEqual(consultas(10, 100), consultas(50, 1000))
+
+    def test_procesos_en_paralelo_dan_el_mismo_resultado(self):
+        filas = [self.CABECERA, *self._filas(30), ("MAR-1", "Martillo", "Ferretería", "", "", "", "", "5"), ("X", "", "", "", "", "", "", "")]
+        resultado = ImportadorProductos(tamano_lote=7, procesos=2).importar(filas)
+        self.assertEqual((resultado.nuevos, resultado.actualizados, resultado.omitidos), (30, 1, 1))
+        self.assertEqual(Producto.objects.get(clave="MAR-1").precio, Decimal("0.00"))
+        self.assertEqual(Producto.objects.filter(clave__startswith="NUE", marca__nombre="Truper").count(), 30)
+
+    def test_dry_run_no_escribe(self):
+        resultado = ImportadorProductos(dry_run=True).importar([self.CABECERA, *self._filas(3)])
+        self.assertEqual(resultado.nuevos, 3)
+        self.assertFalse(Producto.objects.filter(clave__startswith="NUE").exists())
+        self.assertFalse(Marca.objects.exists())
+
+
+class ImportarProductosCommandTests(TestCase):
+    def setUp(self):
+        Categoria.objects.create(nombre="Ferretería")
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        self.ruta = os.path.join(directorio.name, "lista.csv")
+        with open(self.ruta, "w", encoding="utf-8") as archivo:
+            archivo.write("Clave,Descripcion,Categoria,Precio,Existencia\n")
+            for i in range(5):
+                archivo.write(f"C-{i},Clavo {i},Ferreteria,{i + 1},10\n")
+
+    def _ejecutar(self, *args):
+        salida = StringIO()
+        call_command("importar_productos", self.ruta, "--lote", "2", *args, stdout=salida, stderr=StringIO())
+        return salida.getvalue()
+
+    def test_importa_y_borra_el_avance(self):
+        salida = self._ejecutar()
+        self.assertIn("5 nuevos", salida)
+        self.assertEqual(Producto.objects.count(), 5)
+        self.assertFalse(os.path.exists(self.ruta + ".avance.json"))
+
+    def test_reanuda_desde_el_ultimo_lote_confirmado(self):
+        with open(self.ruta + ".avance.json", "w") as avance:
+            json.dump({"huella": huella(self.ruta), "lote": 2, "siguiente": 1, "precios_cambiaron": False}, avance)
+
+        salida = self._ejecutar()
+        self.assertIn("Reanudando desde el lote 2", salida)
+        # El primer lote (C-0, C-1) se da por importado en la corrida anterior
+        self.assertEqual(sorted(Producto.objects.values_list("clave", flat=True)), ["C-2", "C-3", "C-4"])
+
+    def test_dry_run_muestra_diferencias_sin_escribir(self):
+        Producto.objects.create(nombre="Clavo 0", clave="C-0", precio=Decimal("9.00"), existencia=10, categoria=Categoria.objects.get())
+        salida = self._ejecutar("--dry-run")
+        self.assertIn("~ C-0: precio: 9.00 -> 1.00", salida)
+        self.assertIn("+ C-4", salida)
+        self.assertEqual(Producto.objects.count(), 1)
+        self.assertFalse(os.path.exists(self.ruta + ".avance.json"))
+
+
+class NombreNormalizadoTests(TestCase):
+    def test_se_guarda_y_actualiza_al_guardar(self):
+        marca = Marca.objects.create(nombre="  Ñandú Ácido ")
+        self.assertEqual(marca.nombre_normalizado, "nandu acido")
+        marca.nombre = "Pretul"
+        marca.save(update_fields=["nombre"])
+        self.assertEqual(Marca.objects.get().nombre_normalizado, "pretul")
+
+    def test_no_admite_duplicados_por_acentos(self):
+        Marca.objects.create(nombre="Truper")
+        with self.assertRaises(IntegrityError):
+            Marca.objects.create(nombre="TRUPÉR")
+
+    def test_admin_muestra_el_duplicado_como_error_del_formulario(self):
+        Marca.objects.create(nombre="Truper")
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "x"))
+        respuesta = self.client.post(reverse("admin:core_marca_add"), {"nombre": "TRUPER"})
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertFormError(
+            respuesta.context["adminform"].form, "nombre",
+            "Ya existe «Truper»: sin acentos ni mayúsculas es el mismo nombre.",
+        )
+        self.assertEqual(Marca.objects.count(), 1)
+
+        # Guardar el mismo registro no choca consigo mismo
+        marca = Marca.objects.get()
+        respuesta = self.client.post(reverse("admin:core_marca_change", args=[marca.pk]), {"nombre": "TRUPER"})
+        self.assertEqual(respuesta.status_code, 302)
+
+    def test_resolutor_usa_una_consulta_indexada(self):
+        for i in range(50):
+            Marca.objects.create(nombre=f"Marca {i}")
+        resolutor = ResolutorNombres(Marca)
+        with CaptureQueriesContext(connection) as consultas:
+            encontradas = resolutor.obtener_varios(["MARCA 3", "marca 4"])
+            self.assertEqual(resolutor.obtener("Marca 3").nombre, "Marca 3")
+        self.assertEqual(len(consultas), 1)
+        self.assertIn("nombre_normalizado", consultas[0]["sql"])
+        self.assertEqual(sorted(encontradas), ["marca 3", "marca 4"])
+
+    def test_filtro_del_catalogo_ignora_acentos(self):
+        ferreteria = Categoria.objects.create(nombre="Ferretería")
+        Producto.objects.create(nombre="Martillo", clave="M-1", precio=1, categoria=ferreteria)
+        respuesta = self.client.get(reverse("productos"), {"categoria": "FERRETERIA"})
+        self.assertEqual([p.clave for p in respuesta.context["page_obj"]], ["M-1"])
+
+
+class ExportacionTests(CarpetasTemporales, TestCase):
+    carpetas = ("MEDIA_ROOT", "ARCHIVOS_PRIVADOS_ROOT")
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser("admin", "admin@example.com", "x")
+        self.client.force_login(self.admin)
+        ferreteria = Categoria.objects.create(nombre="Ferretería")
+        plomeria = Categoria.objects.create(nombre="Plomería")
+        truper = Marca.objects.create(nombre="Truper")
+        self.productos = [
+            Producto.objects.create(
+                nombre=f"Llave {i}", clave=f"L-{i}", precio=Decimal("10.50"), existencia=i,
+                categoria=ferreteria if i % 2 else plomeria, marca=truper,
+            )
+            for i in range(6)
+        ]
+        cliente = Cliente.objects.create(
+            usuario=User.objects.create_user("ana"), nombre="Ana", correo="ana@example.com", rfc="ANA000000XX0"
+        )
+        self.pedido = Pedido.objects.create(cliente=cliente, estado="procesado", total=Decimal("31.50"))
+        PedidoItem.objects.create(pedido=self.pedido, producto=self.productos[1], cantidad=3, precio_unitario=Decimal("10.50"))
+        borrador = Pedido.objects.create(cliente=cliente, estado="pendiente")
+        PedidoItem.objects.create(pedido=borrador, producto=self.productos[2], cantidad=1, precio_unitario=Decimal("10.50"))
+
+    def _csv(self, respuesta):
+        self.assertTrue(respuesta.streaming)
+        return b"".join(respuesta.streaming_content).decode("utf-8-sig").splitlines()
+
+    def test_csv_de_productos_respeta_filtros_del_admin(self):
+        url = reverse("admin:core_producto_exportar_rapido", args=["csv"])
+        lineas = self._csv(self.client.get(url, {"categoria__id__exact": self.productos[1].categoria_id}))
+        self.assertEqual(lineas[0], "Clave,Descripcion,Categoria,Marca,Proveedor,Departamento,Precio,Existencia")
+        self.assertEqual(lineas[1:], [f"L-{i},Llave {i},Ferretería,Truper,,,10.50,{i}" for i in (5, 3, 1)])
+
+    def test_consultas_no_dependen_del_numero_de_filas(self):
+        url = reverse("admin:core_producto_exportar_rapido", args=["csv"])
+        with CaptureQueriesContext(connection) as pocas:
+            self._csv(self.client.get(url))
+        Producto.objects.bulk_create([
+            Producto(nombre=f"Extra {i}", clave=f"E-{i}", precio=1, categoria=self.productos[0].categoria) for i in range(50)
+        ])
+        with CaptureQueriesContext(connection) as muchas:
+            self._csv(self.client.get(url))
+        self.assertEqual(len(pocas), len(muchas))
+
+    def test_lista_del_admin_muestra_los_enlaces(self):
+        respuesta = self.client.get(reverse("admin:core_producto_changelist"))
+        self.assertContains(respuesta, reverse("admin:core_producto_exportar_rapido", args=["xlsx"]))
+        self.assertContains(respuesta, reverse("admin:core_producto_importacion_masiva"))
+        self.assertContains(respuesta, reverse("admin:core_producto_import"))
+
+    def test_xlsx_de_clientes_en_segundo_plano(self):
+        Cliente.objects.create(usuario=User.objects.create_user("beto"), nombre="Beto", correo="beto@example.com")
+        respuesta = self.client.get(reverse("admin:core_cliente_exportar_rapido", args=["xlsx"]), {"q": "ana"})
+        trabajo = Trabajo.objects.get()
+        self.assertRedirects(respuesta, reverse("admin:core_trabajo_change", args=[trabajo.pk]))
+        # Se guardan los filtros de la lista, no la consulta serializada
+        self.assertEqual(trabajo.parametros, {"nombre": "clientes", "filtros": "q=ana"})
+
+        trabajos.ejecutar(trabajos.tomar_siguiente())
+        trabajo.refresh_from_db()
+        self.assertEqual((trabajo.estado, trabajo.progreso), ("terminado", 100))
+        with trabajo.resultado.open("rb") as archivo:
+            hoja = load_workbook(BytesIO(archivo.read()), read_only=True).active
+        filas = list(hoja.iter_rows(values_only=True))
+        self.assertEqual(filas[0][:4], ("Nombre", "Correo", "Teléfono", "RFC"))
+        self.assertEqual(filas[1][:4], ("Ana", "ana@example.com", None, "ANA000000XX0"))
+        self.assertEqual(len(filas), 2)
+
+    def test_resultado_solo_para_quien_lo_pidio(self):
+        self.client.get(reverse("admin:core_cliente_exportar_rapido", args=["xlsx"]))
+        trabajos.ejecutar(trabajos.tomar_siguiente())
+        trabajo = Trabajo.objects.get()
+        # Nombre con una parte al azar, fuera de MEDIA_ROOT
+        self.assertRegex(trabajo.resultado.name, r"^trabajos/clientes-\d+-[\w-]{16}\.xlsx$")
+        self.assertFalse(os.path.exists(os.path.join(settings.MEDIA_ROOT, trabajo.resultado.name)))
+
+        url = reverse("admin:core_trabajo_resultado", args=[trabajo.pk])
+        respuesta = self.client.get(url)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertIn("no-store", respuesta["Cache-Control"])
+        self.assertIn("attachment", respuesta["Content-Disposition"])
+
+        otro = User.objects.create_user("vendedor", is_staff=True)
+        otro.user_permissions.add(*Permission.objects.filter(codename="view_trabajo"))
+        self.client.force_login(otro)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.logout()
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+    def test_lineas_de_pedidos_sin_borradores(self):
+        lineas = self._csv(self.client.get(reverse("exportar_pedidos", args=["pedido_items", "csv"])))
+        self.assertEqual(len(lineas), 2)
+        self.assertTrue(lineas[1].startswith(f"{self.pedido.id},"))
+        self.assertTrue(lineas[1].endswith(",Ana,procesado,L-1,Llave 1,3,10.50,31.50"))
+
+    def test_pedidos_solo_para_staff(self):
+        cliente = User.objects.create_user("cliente", password="x")
+        self.client.force_login(cliente)
+        respuesta = self.client.get(reverse("exportar_pedidos", args=["pedidos", "csv"]))
+        self.assertEqual(respuesta.status_code, 302)
+
+
+class TrabajosTests(CarpetasTemporales, CapaTemporal, TransactionTestCase):
+    carpetas = ("MEDIA_ROOT", "ARCHIVOS_PRIVADOS_ROOT")
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser("admin", "admin@example.com", "x")
+        Categoria.objects.create(nombre="Ferretería")
+
+    def _escuchar(self):
+        """Une un canal al grupo del staff; devuelve una función que lee lo que haya llegado."""
+        capa = get_channel_layer()
+        canal = async_to_sync(capa.new_channel)()
+        async_to_sync(capa.group_add)(events.GRUPO_ADMIN, canal)
+        self.addCleanup(async_to_sync(capa.group_discard), events.GRUPO_ADMIN, canal)
+
+        async def leer():
+            avisos = []
+            while True:
+                try:
+                    avisos.append(await asyncio.wait_for(capa.receive(canal), 0.1))
+                except asyncio.TimeoutError:
+                    return avisos
+        return async_to_sync(leer)
+
+    def test_un_trabajo_solo_se_toma_una_vez(self):
+        trabajo = trabajos.encolar("exportar", nombre="productos")
+        tomado = trabajos.tomar_siguiente()
+        self.assertEqual((tomado.pk, tomado.estado), (trabajo.pk, "en_proceso"))
+        self.assertIsNone(trabajos.tomar_siguiente())
+
+    def test_run_worker_marca_los_abandonados(self):
+        hace_mucho = timezone.now() - timedelta(seconds=settings.TRABAJOS_ABANDONADOS_SEGUNDOS + 60)
+        abandonado = Trabajo.objects.create(tipo="exportar", estado="en_proceso", iniciado=hace_mucho)
+        en_curso = Trabajo.objects.create(tipo="exportar", estado="en_proceso", iniciado=timezone.now())
+        salida = StringIO()
+        call_command("run_worker", "--una-vez", stdout=salida)
+        self.assertIn("1 trabajos abandonados", salida.getvalue())
+        abandonado.refresh_from_db()
+        en_curso.refresh_from_db()
+        self.assertEqual((abandonado.estado, en_curso.estado), ("fallido", "en_proceso"))
+        self.assertIsNotNone(abandonado.terminado)
+
+    def test_el_error_queda_en_el_trabajo(self):
+        trabajos.encolar("exportar", nombre="no_existe")
+        trabajo = trabajos.tomar_siguiente()
+        with self.assertLogs("core.trabajos", "ERROR"):
+            trabajos.ejecutar(trabajo)
+        trabajo.refresh_from_db()
+        self.assertEqual(trabajo.estado, "fallido")
+        self.assertIn("Exportación desconocida", trabajo.mensaje)
+
+    def test_importacion_desde_el_admin_avisa_el_avance(self):
+        mensajes = self._escuchar()
+        self.client.force_login(self.admin)
+        archivo = SimpleUploadedFile("lista.csv", "Clave,Descripcion,Categoria,Precio\nT-1,Taladro,Ferreteria,900\n".encode())
+        respuesta = self.client.post(reverse("admin:core_producto_importacion_masiva"), {"archivo": archivo})
+        trabajo = Trabajo.objects.get(tipo="importar_productos")
+        self.assertRedirects(respuesta, reverse("admin:core_trabajo_change", args=[trabajo.pk]))
+        self.assertFalse(Producto.objects.exists())
+
+        # Fuera de una transacción de prueba: el aviso final se guarda desde el hilo de la bandeja
+        trabajos.ejecutar(trabajos.tomar_siguiente())
+        events.esperar()
+        trabajo.refresh_from_db()
+        self.assertEqual(trabajo.estado, "terminado")
+        self.assertTrue(trabajo.mensaje.startswith("1 nuevos"))
+        self.assertEqual(Producto.objects.get().clave, "T-1")
+        avisos = mensajes()
+        self.assertEqual({aviso["type"] for aviso in avisos}, {"progreso_trabajo"})
+        self.assertEqual(avisos[-1]["estado"], "terminado")
+
+    def test_run_worker_manda_los_avisos_antes_de_salir(self):
+        mensajes = self._escuchar()
+        archivo = SimpleUploadedFile("lista.csv", "Clave,Descripcion,Categoria,Precio\nT-1,Taladro,Ferreteria,900\n".encode())
+        trabajo = trabajos.encolar("importar_productos", usuario=self.admin, archivo=archivo)
+        enviar_lote = bandeja_salida.enviar_lote
+
+        def lento(lote):
+            # Una capa lenta: el comando no debe salir antes de que se envíe
+            time.sleep(0.3)
+            enviar_lote(lote)
+
+        with mock.patch.object(bandeja_salida, "enviar_lote", lento):
+            call_command("run_worker", "--una-vez", stdout=StringIO())
+
+        # Sin events.esperar() aquí: el comando ya vació la bandeja y los agrupados
+        self.assertEqual(events._agrupador._pendientes, {})
+        self.assertTrue(Aviso.objects.filter(contenido__id=trabajo.pk, contenido__estado="terminado").exists())
+        avisos = mensajes()
+        self.assertEqual(avisos[-1]["estado"], "terminado")
+
+
+class MiniaturasTests(CarpetasTemporales, CapaTemporal, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.categoria = Categoria.objects.create(nombre="Ferretería")
+
+    def _imagen(self, nombre="foto.png", color="red"):
+        salida = BytesIO()
+        Image.new("RGB", (1000, 500), color).save(salida, "PNG")
+        return SimpleUploadedFile(nombre, salida.getvalue(), content_type="image/png")
+
+    def _producto(self, clave, imagen):
+        return Producto.objects.create(nombre="Pala", clave=clave, precio=1, categoria=self.categoria, imagen=imagen)
+
+    def test_genera_webp_con_el_hash_del_contenido(self):
+        producto = self._producto("P-1", self._imagen())
+        url = producto.imagen_thumb_url
+        self.assertRegex(url, r"^/media/productos/miniaturas/[0-9a-f]{20}-thumb\.webp$")
+        with Image.open(producto.imagen.storage.path(url[len("/media/"):])) as miniatura:
+            self.assertEqual((miniatura.format, miniatura.size), ("WEBP", (120, 60)))
+
+        # La misma foto subida otra vez (con otro nombre) reutiliza la miniatura
+        copia = self._producto("P-2", self._imagen("otra.png"))
+        self.assertEqual(copia.imagen_thumb_url, url)
+        self.assertNotEqual(self._producto("P-3", self._imagen("azul.png", "blue")).imagen_thumb_url, url)
+
+    def test_subir_imagen_encola_el_trabajo(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            producto = self._producto("P-1", self._imagen())
+        with self.captureOnCommitCallbacks(execute=True):
+            producto.precio = 2
+            producto.save()
+        trabajo = Trabajo.objects.get()
+        self.assertEqual((trabajo.tipo, trabajo.parametros), ("generar_miniaturas", {"modelo": "producto", "pk": producto.pk}))
+
+        trabajos.ejecutar(trabajos.tomar_siguiente())
+        trabajo.refresh_from_db()
+        self.assertEqual(trabajo.mensaje, f"3 miniaturas de {producto.imagen.name}")
+
+    def test_respaldo_sin_miniaturas_para_archivos_rotos(self):
+        producto = self._producto("P-1", SimpleUploadedFile("rota.jpg", b"no es una imagen"))
+        with self.assertLogs("core.miniaturas", "WARNING"):
+            self.assertEqual(producto.imagen_card_url, producto.imagen.url)
+
+    def test_respaldo_para_imagenes_demasiado_grandes(self):
+        producto = self._producto("P-1", self._imagen("enorme.png", "purple"))
+        # Con un límite bajo la foto de 1000x500 es una "bomba de descompresión" para Pillow
+        with mock.patch.object(Image, "MAX_IMAGE_PIXELS", 100), self.assertLogs("core.miniaturas", "WARNING"):
+            self.assertEqual(producto.imagen_card_url, producto.imagen.url)
+
+    def test_comando_de_relleno(self):
+        producto = self._producto("P-1", self._imagen())
+        salida = StringIO()
+        call_command("generar_miniaturas", stdout=salida, stderr=StringIO())
+        self.assertIn("para 1 imágenes, 0 con error", salida.getvalue())
+        # Quedaron en caché: pedir la URL ya no lee el original
+        producto.imagen.storage.delete(producto.imagen.name)
+        self.assertTrue(producto.imagen_detalle_url.endswith("-detalle.webp"))
+
+
+class AlmacenamientoPorContenidoTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        self.media = directorio.name
+        ajustes = self.settings(MEDIA_ROOT=self.media)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.categoria = Categoria.objects.create(nombre="Ferretería")
+
+    def _producto(self, clave, nombre, contenido):
+        return Producto.objects.create(
+            nombre="Pala", clave=clave, precio=1, categoria=self.categoria,
+            imagen=SimpleUploadedFile(nombre, contenido),
+        )
+
+    def _archivos(self, carpeta="productos"):
+        return sorted(os.listdir(os.path.join(self.media, carpeta)))
+
+    def test_la_misma_imagen_se_guarda_una_vez(self):
+        primero = self._producto("P-1", "Pala.JPG", b"contenido")
+        segundo = self._producto("P-2", "pala_roja.jpg", b"contenido")
+        self.assertEqual(primero.imagen.name, segundo.imagen.name)
+        self.assertRegex(primero.imagen.name, r"^productos/[0-9a-f]{32}\.jpg$")
+        self.assertEqual(self._archivos(), [os.path.basename(primero.imagen.name)])
+
+    def test_limpieza_de_archivos_sin_referencia(self):
+        salida = BytesIO()
+        Image.new("RGB", (300, 300), "green").save(salida, "PNG")
+        usado = self._producto("P-1", "foto.png", salida.getvalue())
+        usado.imagen_thumb_url  # genera la miniatura
+        huerfano = self._producto("P-2", "vieja.png", b"otra")
+        Producto.objects.filter(pk=huerfano.pk).update(imagen="")
+
+        salida = StringIO()
+        call_command("limpiar_media", "--minutos", "0", stdout=salida)
+        self.assertIn(huerfano.imagen.name, salida.getvalue())
+        self.assertIn("Sin referencia: 1 archivos", salida.getvalue())
+        self.assertEqual(len(self._archivos()), 3)  # nada se borró sin --borrar
+
+        call_command("limpiar_media", "--minutos", "0", "--borrar", stdout=StringIO())
+        self.assertEqual(self._archivos(), sorted([os.path.basename(usado.imagen.name), "miniaturas"]))
+        self.assertEqual(len(self._archivos("productos/miniaturas")), 1)
+
+    def test_convertir_nombres_viejos_deduplica(self):
+        os.makedirs(os.path.join(self.media, "productos"))
+        for nombre in ("cemento.webp", "cemento_0plEVrh.webp"):
+            with open(os.path.join(self.media, "productos", nombre), "wb") as archivo:
+                archivo.write(b"cemento")
+        Producto.objects.create(nombre="Cemento", clave="C-1", precio=1, categoria=self.categoria, imagen="productos/cemento.webp")
+        Producto.objects.create(nombre="Cemento", clave="C-2", precio=1, categoria=self.categoria, imagen="productos/cemento_0plEVrh.webp")
+
+        call_command("limpiar_media", "--minutos", "0", "--convertir", "--borrar", stdout=StringIO())
+        nombres = set(Producto.objects.values_list("imagen", flat=True))
+        self.assertEqual(len(nombres), 1)
+        self.assertEqual(self._archivos(), [os.path.basename(nombres.pop())])
+
+
+class ServirMediaTests(TestCase):
+    def setUp(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        self.media = directorio.name
+        ajustes = self.settings(MEDIA_ROOT=self.media, STATIC_ROOT=os.path.join(self.media, "static"))
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.contenido = bytes(range(256)) * 4
+        self._escribir("productos/" + "a" * 32 + ".png", self.contenido)
+        self._escribir("promociones/banner.png", self.contenido)
+
+    def _escribir(self, ruta, contenido):
+        ruta = os.path.join(self.media, ruta)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        with open(ruta, "wb") as archivo:
+            archivo.write(contenido)
+
+    def _cuerpo(self, respuesta):
+        return b"".join(respuesta.streaming_content)
+
+    def test_nombre_por_contenido_es_inmutable_y_responde_304(self):
+        respuesta = self.client.get("/media/productos/" + "a" * 32 + ".png")
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(self._cuerpo(respuesta), self.contenido)
+        self.assertIn("immutable", respuesta["Cache-Control"])
+        self.assertEqual(respuesta["Content-Type"], "image/png")
+
+        otra = self.client.get("/media/productos/" + "a" * 32 + ".png", HTTP_IF_NONE_MATCH=respuesta["ETag"])
+        self.assertEqual(otra.status_code, 304)
+        otra = self.client.get("/media/productos/" + "a" * 32 + ".png", HTTP_IF_MODIFIED_SINCE=respuesta["Last-Modified"])
+        self.assertEqual(otra.status_code, 304)
+
+        comun = self.client.get("/media/promociones/banner.png")
+        self.assertNotIn("immutable", comun["Cache-Control"])
+
+    def test_rangos(self):
+        url = "/media/promociones/banner.png"
+        parcial = self.client.get(url, HTTP_RANGE="bytes=10-19")
+        self.assertEqual(parcial.status_code, 206)
+        self.assertEqual(parcial["Content-Range"], "bytes 10-19/1024")
+        self.assertEqual(parcial["Content-Length"], "10")
+        self.assertEqual(self._cuerpo(parcial), self.contenido[10:20])
+
+        final = self.client.get(url, HTTP_RANGE="bytes=-24")
+        self.assertEqual(self._cuerpo(final), self.contenido[-24:])
+        self.assertEqual(self.client.get(url, HTTP_RANGE="bytes=5000-").status_code, 416)
+        # If-Range viejo: el archivo completo
+        viejo = self.client.get(url, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE='"otro"')
+        self.assertEqual(viejo.status_code, 200)
+
+    def test_rutas_fuera_de_media(self):
+        self.assertEqual(self.client.get("/media/../ferreteria/settings.py").status_code, 404)
+        self.assertEqual(self.client.get("/media/productos/").status_code, 404)
+        self.assertEqual(self.client.post("/media/promociones/banner.png").status_code, 405)
+
+    def test_solo_las_carpetas_del_catalogo_son_publicas(self):
+        self._escribir("trabajos/clientes-1.xlsx", b"datos de clientes")
+        self._escribir("otra/archivo.txt", b"x")
+        self.assertEqual(self.client.get("/media/trabajos/clientes-1.xlsx").status_code, 404)
+        self.assertEqual(self.client.get("/media/productos/../trabajos/clientes-1.xlsx").status_code, 404)
+        self.assertEqual(self.client.get("/media/otra/archivo.txt").status_code, 404)
+        self.assertEqual(self.client.get("/media/promociones/banner.png").status_code, 200)
+
+    def test_estaticos_precomprimidos(self):
+        self._escribir("static/app.0123456789ab.css", b"body{}" * 200)
+        self._escribir("static/app.0123456789ab.css.gz", b"gz")
+        url = "/static/app.0123456789ab.css"
+        gz = self.client.get(url, HTTP_ACCEPT_ENCODING="br, gzip")
+        self.assertEqual(gz["Content-Encoding"], "gzip")
+        self.assertEqual(gz["Content-Type"], "text/css")
+        self.assertEqual(gz["Vary"], "Accept-Encoding")
+        self.assertIn("immutable", gz["Cache-Control"])
+        self.assertEqual(self._cuerpo(gz), b"gz")
+
+        plano = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip;q=0")
+        self.assertFalse(plano.has_header("Content-Encoding"))
+        self.assertNotEqual(plano["ETag"], gz["ETag"])
+
+
+class CachePaginasTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.categoria = Categoria.objects.create(nombre="Plomería")
+        cls.producto = Producto.objects.create(nombre="Llave de paso", clave="LL-1", precio=Decimal("80.00"), categoria=cls.categoria)
+
+    def setUp(self):
+        cache.clear()
+
+    def _consultas(self, url):
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get(url)
+        self.assertEqual(respuesta.status_code, 200)
+        return respuesta, len(consultas)
+
+    def test_anonimos_reciben_la_pagina_guardada(self):
+        url = reverse("producto_detalle", args=[self.producto.pk])
+        primera, _ = self._consultas(url)
+        segunda, consultas = self._consultas(url)
+        self.assertEqual(consultas, 0)
+        self.assertEqual(primera.content, segunda.content)
+        self.assertNotIn(b"csrfmiddlewaretoken", segunda.content)
+
+    def test_la_consulta_es_parte_de_la_clave(self):
+        Producto.objects.create(nombre="Codo", clave="CO-1", precio=Decimal("5.00"), categoria=self.categoria)
+        codo, _ = self._consultas(reverse("productos") + "?q=codo")
+        llave, _ = self._consultas(reverse("productos") + "?q=llave")
+        self.assertNotContains(codo, "Llave de paso")
+        self.assertContains(llave, "Llave de paso")
+
+    def test_guardar_producto_invalida(self):
+        url = reverse("producto_detalle", args=[self.producto.pk])
+        self._consultas(url)
+        self.producto.precio = Decimal("95.00")
+        self.producto.save()
+        respuesta, consultas = self._consultas(url)
+        self.assertGreater(consultas, 0)
+        self.assertContains(respuesta, "95.00")
+
+    def test_ticker_invalida_inicio(self):
+        self._consultas(reverse("inicio"))
+        PromocionTicker.objects.create(texto="2x1 en brochas")
+        respuesta, _ = self._consultas(reverse("inicio"))
+        self.assertContains(respuesta, "2X1 EN BROCHAS")
+
+    def test_usuarios_con_sesion_no_usan_la_cache(self):
+        url = reverse("producto_detalle", args=[self.producto.pk])
+        self._consultas(url)
+        self.client.force_login(User.objects.create_user(username="plomero"))
+        respuesta, consultas = self._consultas(url)
+        self.assertGreater(consultas, 0)
+        self.assertContains(respuesta, "csrfmiddlewaretoken")
+
+    def test_sin_cache_compartida_no_se_guardan_paginas(self):
+        # run_worker y los demás procesos no podrían invalidar una caché en memoria
+        self.assertFalse(cache_por_proceso())
+        url = reverse("producto_detalle", args=[self.producto.pk])
+        with override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}):
+            self._consultas(url)
+            _, consultas = self._consultas(url)
+        self.assertGreater(consultas, 0)
+
+
+class CapaSQLiteTests(TestCase):
+    def setUp(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        self.ruta = os.path.join(directorio.name, "canales.sqlite3")
+
+    def _capa(self, **config):
+        return CapaSQLite(self.ruta, **config)
+
+    def test_benchmark_canales(self):
+        salida = StringIO()
+        call_command("benchmark_canales", "--procesos", "1", "--sockets", "2", "--mensajes", "1", "--intervalo", "0", stdout=salida)
+        self.assertIn("2 sockets en 1 procesos, 1 avisos, 2 entregas", salida.getvalue())
+
+    def test_group_send_llega_a_otros_procesos(self):
+        emisor, worker_1, worker_2 = self._capa(), self._capa(), self._capa()
+
+        async def escenario():
+            canales = [await worker_1.new_channel(), await worker_1.new_channel(), await worker_2.new_channel()]
+            for canal, capa in zip(canales, (worker_1, worker_1, worker_2)):
+                await capa.group_add("notificaciones_admin", canal)
+            await emisor.group_send("notificaciones_admin", {"type": "enviar_alerta", "mensaje": "Pedido #1"})
+            recibidos = await asyncio.gather(
+                worker_1.receive(canales[0]), worker_1.receive(canales[1]), worker_2.receive(canales[2])
+            )
+            await worker_2.group_discard("notificaciones_admin", canales[2])
+            await emisor.group_send("notificaciones_admin", {"type": "enviar_alerta", "mensaje": "Pedido #2"})
+            segundo = await worker_1.receive(canales[0])
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(worker_2.receive(canales[2]), 0.2)
+            return recibidos, segundo
+
+        recibidos, segundo = async_to_sync(escenario)()
+        self.assertEqual([m["mensaje"] for m in recibidos], ["Pedido #1"] * 3)
+        self.assertEqual(segundo["mensaje"], "Pedido #2")
+
+    def test_capacidad_por_canal(self):
+        capa = self._capa(capacity=2)
+
+        async def escenario():
+            canal = await capa.new_channel()
+            await capa.group_add("grupo", canal)
+            await capa.send(canal, {"type": "a"})
+            await capa.group_send("grupo", {"type": "b"})
+            # Lleno: group_send lo omite, send avisa
+            await capa.group_send("grupo", {"type": "c"})
+            with self.assertRaises(ChannelFull):
+                await capa.send(canal, {"type": "d"})
+            return [(await capa.receive(canal))["type"] for _ in range(2)]
+
+        self.assertEqual(async_to_sync(escenario)(), ["a", "b"])
+
+    def test_mensajes_en_json_y_filas_ilegibles_se_descartan(self):
+        capa = self._capa()
+
+        async def escenario():
+            canal = await capa.new_channel()
+            await capa.group_add("grupo", canal)
+            # Una fila que no es JSON (p. ej. un pickle) no se interpreta
+            await capa._en_hilo(capa._insertar, canal, b"\x80\x04cos\nsystem\n")
+            await capa.group_send("grupo", {"type": "aviso", "ids": (1, 2)})
+            return await asyncio.wait_for(capa.receive(canal), 1)
+
+        with self.assertLogs("core.capa_canales", "WARNING"):
+            self.assertEqual(async_to_sync(escenario)(), {"type": "aviso", "ids": [1, 2]})
+        with self.assertRaises(TypeError):
+            async_to_sync(capa.send)("otro", {"type": "aviso", "objeto": object()})
+
+    def test_mensajes_vencidos_sacan_al_canal_del_grupo(self):
+        emisor, worker = self._capa(expiry=0.05), self._capa(expiry=0.05)
+
+        async def escenario():
+            canal = await worker.new_channel()
+            await worker.group_add("grupo", canal)
+            await emisor.group_send("grupo", {"type": "viejo"})
+            await asyncio.sleep(0.1)
+            await emisor.group_send("grupo", {"type": "nuevo"})
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(worker.receive(canal), 0.2)
+
+        async_to_sync(escenario)()
+
+
+class BandejaSalidaTests(CapaTemporal, TransactionTestCase):
+    def setUp(self):
+        self.capa = get_channel_layer()
+        self.canal = async_to_sync(self.capa.new_channel)()
+        async_to_sync(self.capa.group_add)("notificaciones_admin", self.canal)
+        self.addCleanup(async_to_sync(self.capa.group_discard), "notificaciones_admin", self.canal)
+        usuario = User.objects.create_user(username="ferreteria_lupita")
+        self.cliente = Cliente.objects.create(usuario=usuario, nombre="Lupita", correo="l@example.com", rfc="LUP000000XX1")
+
+    def _recibir(self):
+        async def recibir():
+            return await asyncio.wait_for(self.capa.receive(self.canal), 0.5)
+        return async_to_sync(recibir)()
+
+    def test_aviso_se_completa_despues_del_commit(self):
+        with CaptureQueriesContext(connection) as consultas:
+            with transaction.atomic():
+                pedido = Pedido.objects.create(cliente=self.cliente, total=0)
+                Pedido.objects.filter(pk=pedido.pk).update(total=Decimal("150.00"))
+        # La petición no consulta al cliente ni a su usuario
+        self.assertFalse([c for c in consultas if "auth_user" in c["sql"] or "core_cliente" in c["sql"]])
+
+        bandeja_salida.esperar()
+        aviso = self._recibir()
+        self.assertEqual((aviso["type"], aviso["pedido_id"]), ("pedido_nuevo", pedido.pk))
+        self.assertEqual(aviso["total"], "150.00")
+        self.assertEqual(aviso["cliente"], "ferreteria_lupita")
+
+    def test_transaccion_revertida_no_avisa(self):
+        with transaction.atomic():
+            Pedido.objects.create(cliente=self.cliente, total=0)
+            transaction.set_rollback(True)
+        bandeja_salida.esperar()
+        with self.assertRaises(asyncio.TimeoutError):
+            self._recibir()
+
+    def test_secuencias_sin_ids_del_bulk_create(self):
+        # Como en MySQL: bulk_create no devuelve los ids
+        with mock.patch.object(type(connection.features), "can_return_rows_from_bulk_insert", False):
+            mensajes = [{"type": "pedido_nuevo", "pedido_id": i} for i in range(3)]
+            with CaptureQueriesContext(connection) as consultas:
+                bandeja_salida._guardar([("notificaciones_admin", mensaje) for mensaje in mensajes])
+        self.assertEqual(sum(c["sql"].startswith("INSERT") for c in consultas), 3)
+        secuencias = [mensaje["secuencia"] for mensaje in mensajes]
+        self.assertEqual(secuencias, sorted(secuencias))
+        self.assertEqual(
+            [(a.pk, a.contenido["pedido_id"]) for a in Aviso.objects.order_by("pk")],
+            list(zip(secuencias, range(3))),
+        )
+
+
+class ProgresoRapido(events.ProgresoTrabajo):
+    intervalo = 0.2
+
+
+class NotificacionLenta(NotificacionConsumer):
+    COLA_MAXIMA = 3
+    # asyncio.Event: mientras esté apagado el navegador no lee
+    leyendo = None
+
+    async def send(self, *args, **kwargs):
+        await self.leyendo.wait()
+        await super().send(*args, **kwargs)
+
+
+class NotificacionConLatidos(NotificacionConsumer):
+    LATIDO_SEGUNDOS = 0.1
+    INACTIVO_SEGUNDOS = 0.35
+
+
+class EventosWebsocketTests(CapaTemporal, TransactionTestCase):
+    async def _conectar(self, usuario, consumer=NotificacionConsumer):
+        comunicador = WebsocketCommunicator(consumer.as_asgi(), "/ws/notifications/")
+        comunicador.scope["user"] = usuario
+        conectado, _ = await comunicador.connect()
+        if conectado:
+            # Lo último que manda al conectar: la secuencia hasta la que está al día
+            self.assertIn("secuencia", await comunicador.receive_json_from(timeout=1))
+        return comunicador, conectado
+
+    async def _publicar(self, *eventos):
+        def publicar():
+            for evento in eventos:
+                events.publicar(evento)
+            events.esperar()
+        await sync_to_async(publicar)()
+
+    def _convertir(self):
+        categoria = Categoria.objects.create(nombre="Eléctrico")
+        producto = Producto.objects.create(nombre="Cable", clave="CAB-1", precio=Decimal("12.50"), existencia=100, categoria=categoria)
+        usuario = User.objects.create_user(username="electricista", first_name="Ana", last_name="Ruiz")
+        cliente = Cliente.objects.create(usuario=usuario, nombre="Ana", correo="ana@example.com", rfc="RUA000000XX1")
+        cotizacion = CotizacionService.crear_desde_carrito({str(producto.id): 4}, cliente)
+        pedido = PedidoService.crear_desde_cotizacion(cotizacion, cliente)
+        events.esperar()
+        return cotizacion, pedido
+
+    async def test_solo_el_staff_se_conecta(self):
+        _, conectado = await self._conectar(AnonymousUser())
+        self.assertFalse(conectado)
+        _, conectado = await self._conectar(User(username="mostrador", is_staff=False))
+        self.assertFalse(conectado)
+
+    async def test_conversion_avisa_una_sola_vez(self):
+        comunicador, _ = await self._conectar(User(username="gerente", is_staff=True))
+        cotizacion, pedido = await sync_to_async(self._convertir)()
+
+        # Sólo el aviso de la cotización: el pedido nuevo no suena otra vez
+        convertida = await comunicador.receive_json_from(timeout=1)
+        self.assertEqual(convertida["mensaje"], f"La cotización #{cotizacion.id} ha sido convertida")
+        self.assertEqual((convertida["total"], convertida["cliente"]), ("50.00", "Ana Ruiz"))
+        self.assertTrue(await comunicador.receive_nothing())
+        await comunicador.disconnect()
+
+    async def test_avances_se_agrupan(self):
+        comunicador, _ = await self._conectar(User(username="gerente", is_staff=True))
+        await self._publicar(*[
+            ProgresoRapido(id=7, titulo="Importación #7", estado="en_proceso", progreso=i) for i in range(50)
+        ])
+        self.assertEqual((await comunicador.receive_json_from(timeout=1))["progreso"], 0)
+        # Los otros 49 llegan como uno solo, el último, al vencer el intervalo
+        self.assertEqual((await comunicador.receive_json_from(timeout=1))["progreso"], 49)
+
+        await self._publicar(
+            ProgresoRapido(id=7, titulo="Importación #7", estado="en_proceso", progreso=80),
+            ProgresoRapido(id=7, titulo="Importación #7", estado="en_proceso", progreso=90),
+            ProgresoRapido(id=7, titulo="Importación #7", estado="terminado", progreso=100),
+        )
+        avisos = [await comunicador.receive_json_from(timeout=1)]
+        while not await comunicador.receive_nothing(timeout=0.4):
+            avisos.append(await comunicador.receive_json_from())
+        # El terminado sale de inmediato y descarta el avance que esperaba
+        self.assertEqual(avisos[-1]["estado"], "terminado")
+        self.assertNotIn(90, [aviso["progreso"] for aviso in avisos])
+        await comunicador.disconnect()
+
+    async def test_reconectar_repite_los_avisos_perdidos(self):
+        gerente = User(username="gerente", is_staff=True)
+        comunicador, _ = await self._conectar(gerente)
+        await self._publicar(events.PedidoNuevo(pedido_id=1))
+        ultima = (await comunicador.receive_json_from(timeout=1))["secuencia"]
+        await comunicador.disconnect()
+
+        # Mientras estaba desconectado; el avance no se guarda, el resultado sí
+        await self._publicar(
+            events.PedidoNuevo(pedido_id=2),
+            events.ProgresoTrabajo(id=3, titulo="Exportación #3", estado="en_proceso", progreso=50),
+            events.ProgresoTrabajo(id=3, titulo="Exportación #3", estado="terminado", progreso=100),
+        )
+        comunicador = WebsocketCommunicator(NotificacionConsumer.as_asgi(), f"/ws/notifications/?desde={ultima}")
+        comunicador.scope["user"] = gerente
+        await comunicador.connect()
+        perdidos = [await comunicador.receive_json_from(timeout=1) for _ in range(3)]
+        self.assertEqual(perdidos[0]["mensaje"], "Pedido #2 recibido")
+        self.assertEqual(perdidos[1]["estado"], "terminado")
+        self.assertEqual(perdidos[2], {"secuencia": perdidos[1]["secuencia"]})
+        self.assertLess(ultima, perdidos[0]["secuencia"])
+        self.assertTrue(await comunicador.receive_nothing())
+        await comunicador.disconnect()
+
+    async def test_cliente_lento_pierde_los_avisos_mas_viejos(self):
+        NotificacionLenta.leyendo = asyncio.Event()
+        NotificacionLenta.leyendo.set()
+        comunicador, _ = await self._conectar(User(username="gerente", is_staff=True), consumer=NotificacionLenta)
+        NotificacionLenta.leyendo.clear()
+        capa = get_channel_layer()
+        for i in range(20):
+            evento = events.ProgresoTrabajo(id=9, titulo="Importación #9", estado="en_proceso", progreso=i)
+            await capa.group_send(evento.grupo, evento.contenido())
+        await asyncio.sleep(0.5)
+        NotificacionLenta.leyendo.set()
+
+        recibidos = []
+        while not await comunicador.receive_nothing(timeout=0.3):
+            recibidos.append((await comunicador.receive_json_from())["progreso"])
+        # El que ya se estaba mandando y los 3 más nuevos; el consumer nunca se detuvo
+        self.assertEqual(len(recibidos), 4)
+        self.assertEqual(recibidos[1:], [17, 18, 19])
+        with self.assertLogs("core.consumers", "WARNING"):
+            await comunicador.disconnect()
+
+    async def test_latidos_y_cierre_por_inactividad(self):
+        comunicador, _ = await self._conectar(User(username="gerente", is_staff=True), consumer=NotificacionConLatidos)
+        for _ in range(4):
+            self.assertEqual(await comunicador.receive_json_from(timeout=1), {"latido": True})
+            await comunicador.send_to(text_data="latido")
+
+        # Sin contestar: el servidor cierra
+        while (salida := await comunicador.receive_output(timeout=1))["type"] == "websocket.send":
+            self.assertEqual(json.loads(salida["text"]), {"latido": True})
+        self.assertEqual(salida, {"type": "websocket.close", "code": 4408})
+        await comunicador.disconnect()
+
+
+class ProductosEnVivoTests(CapaTemporal, TransactionTestCase):
+    def setUp(self):
+        self.categoria = Categoria.objects.create(nombre="Pinturas")
+        # bulk_create: sin señales, así no hay avisos pendientes al empezar
+        self.vinilica, = Producto.objects.bulk_create([
+            Producto(nombre="Vinílica", clave="VIN-1", precio=Decimal("300.00"), existencia=8, categoria=self.categoria),
+        ])
+        # Misma cubeta que la vinílica, pero no está en pantalla
+        self.esmalte, = Producto.objects.bulk_create([Producto(
+            id=self.vinilica.id + events.CUBETAS_PRODUCTOS, nombre="Esmalte", clave="ESM-1",
+            precio=Decimal("150.00"), existencia=4, categoria=self.categoria,
+        )])
+
+    async def _suscribir(self, *productos):
+        comunicador = WebsocketCommunicator(ProductosConsumer.as_asgi(), "/ws/productos/")
+        comunicador.scope["user"] = AnonymousUser()
+        conectado, _ = await comunicador.connect()
+        self.assertTrue(conectado)
+        await comunicador.send_json_to({"productos": [p.id for p in productos]})
+        # Primero los valores actuales de lo que tiene en pantalla
+        actuales = {str(p.id): [p.existencia, str(p.precio)] for p in productos}
+        self.assertEqual(await comunicador.receive_json_from(timeout=1), {"productos": actuales})
+        self.assertTrue(await comunicador.receive_nothing(0.1))
+        return comunicador
+
+    async def test_al_suscribirse_recibe_los_valores_actuales(self):
+        # Cambio sin señales (update()): la página guardada en la caché ya no coincide
+        await sync_to_async(Producto.objects.filter(pk=self.vinilica.pk).update)(existencia=2)
+        comunicador = WebsocketCommunicator(ProductosConsumer.as_asgi(), "/ws/productos/")
+        comunicador.scope["user"] = AnonymousUser()
+        await comunicador.connect()
+        await comunicador.send_json_to({"productos": [self.vinilica.id, 999999]})
+        self.assertEqual(
+            await comunicador.receive_json_from(timeout=1),
+            {"productos": {str(self.vinilica.id): [2, "300.00"], "999999": None}},
+        )
+        # La misma lista otra vez no repite nada
+        await comunicador.send_json_to({"productos": [self.vinilica.id, 999999]})
+        self.assertTrue(await comunicador.receive_nothing(0.1))
+        await comunicador.disconnect()
+
+    async def test_recibe_solo_lo_que_tiene_en_pantalla(self):
+        comunicador = await self._suscribir(self.vinilica)
+
+        def cambiar():
+            self.esmalte.precio = Decimal("160.00")
+            self.esmalte.save()
+            self.vinilica.precio = Decimal("320.00")
+            self.vinilica.save()
+            events.esperar()
+        await sync_to_async(cambiar)()
+
+        # Los dos cambios de la cubeta salen juntos; al socket sólo llega el suyo
+        self.assertEqual(await comunicador.receive_json_from(timeout=1), {"productos": {str(self.vinilica.id): [8, "320.00"]}})
+        self.assertTrue(await comunicador.receive_nothing(0.7))
+        await comunicador.disconnect()
+
+    async def test_importacion_y_apartados_sin_senales(self):
+        comunicador = await self._suscribir(self.vinilica, self.esmalte)
+
+        def importar():
+            ImportadorProductos().importar([
+                ImportacionMasivaTests.CABECERA,
+                ("VIN-1", "Vinílica", "Pinturas", "", "", "", "310", "8"),
+            ])
+            events.esperar()
+        await sync_to_async(importar)()
+        self.assertEqual(await comunicador.receive_json_from(timeout=1), {"productos": {str(self.vinilica.id): [8, "310.00"]}})
+
+        def apartar():
+            inventario.reservar([(self.vinilica.id, 3), (self.esmalte.id, 1)])
+            events.esperar()
+        await sync_to_async(apartar)()
+        # Dentro del intervalo: los dos salen en un solo mensaje al vencer
+        cambios = (await comunicador.receive_json_from(timeout=1))["productos"]
+        self.assertEqual(cambios, {str(self.vinilica.id): [5, "310.00"], str(self.esmalte.id): [3, "150.00"]})
+        await comunicador.disconnect()
+
+    async def test_demasiadas_suscripciones_cierran_el_socket(self):
+        comunicador = await self._suscribir(self.vinilica)
+        # Un mensaje demasiado grande se ignora (pero cuenta)
+        await comunicador.send_to(text_data=json.dumps({"productos": list(range(5000))}))
+        for _ in range(ProductosConsumer.SUSCRIPCIONES_POR_MINUTO - 2):
+            await comunicador.send_json_to({"productos": [self.esmalte.id]})
+        # Sólo la primera lista con el esmalte trae valores; las repetidas no
+        self.assertEqual(await comunicador.receive_json_from(timeout=1), {"productos": {str(self.esmalte.id): [4, "150.00"]}})
+        self.assertTrue(await comunicador.receive_nothing(0.1))
+        await comunicador.send_json_to({"productos": [self.vinilica.id]})
+        self.assertEqual(await comunicador.receive_output(1), {"type": "websocket.close", "code": 4429})
+        await comunicador.disconnect()
@@ -0,0 +1,201 @@
+"""
+Cola de trabajos en la base de datos.
+
+Las vistas llaman ``encolar`` y responden de inmediato; ``manage.py run_worker``
+toma los pendientes y los ejecuta. No hace falta Redis ni Celery: un trabajo
+se "toma" con un UPDATE condicional (``estado='pendiente'``), así dos
+trabajadores nunca ejecutan el mismo. El avance se guarda en la fila y se
+avisa al WebSocket del staff (``events.ProgresoTrabajo``).
+"""
+import logging
+import os
+import secrets
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib import admin
+from django.core.files import File
+from django.db.models import Subquery
+from django.http import HttpRequest, QueryDict
+from django.urls import reverse
+from django.utils import timezone
+
+from . import events, exportacion, miniaturas
+from .importacion import ImportadorProductos, contar_filas, leer_filas
+from .models import Producto, Promocion, Trabajo
+
+logger = logging.getLogger(__name__)
+
+TAREAS = {}
+
+
+def tarea(tipo):
+    """Registra ``funcion(trabajo)`` como la que ejecuta los trabajos de ``tipo``."""
+    def registrar(funcion):
+        TAREAS[tipo] = funcion
+        return funcion
+    return registrar
+
+
+def encolar(tipo, usuario=None, archivo=None, **parametros):
+    if tipo not in TAREAS:
+        raise ValueError(f"Tipo de trabajo desconocido: {tipo}")
+    trabajo = Trabajo(tipo=tipo, parametros=parametros, usuario=usuario)
+    if archivo is not None:
+        trabajo.archivo.save(nombre_privado(os.path.basename(archivo.name)), archivo, save=False)
+    trabajo.save()
+    avisar(trabajo)
+    return trabajo
+
+
+def nombre_privado(nombre):
+    """``nombre`` con una parte al azar: los archivos de los trabajos no deben poder adivinarse."""
+    base, extension = os.path.splitext(nombre)
+    return f"{base}-{secrets.token_urlsafe(12)}{extension}"
+
+
+def filtrar_como_el_admin(queryset, filtros, usuario):
+    """
+    ``queryset`` con los filtros de la lista del admin: ``filtros`` es su
+    querystring (``?categoria__id__exact=3&q=codo``) y se vuelve a aplicar tal
+    como lo haría la lista para ``usuario``. Se guardan los parámetros y no la
+    consulta: un pickle en la base se ejecutaría al leerlo en el trabajador.
+    """
+    if usuario is None:
+        raise ValueError("El trabajo ya no tiene usuario para aplicar los filtros")
+    peticion = HttpRequest()
+    peticion.method = "GET"
+    peticion.GET = QueryDict(filtros)
+    peticion.user = usuario
+    lista = admin.site.get_model_admin(queryset.model).get_changelist_instance(peticion).get_queryset(peticion)
+    # Se conservan las anotaciones de ``queryset`` y el orden de la lista
+    return queryset.filter(pk__in=Subquery(lista.values("pk"))).order_by(*lista.query.order_by)
+
+
+def tomar_siguiente():
+    """Marca como en proceso el pendiente más antiguo y lo devuelve, o None si no hay."""
+    while True:
+        trabajo = Trabajo.objects.filter(estado="pendiente").order_by("id").first()
+        if trabajo is None:
+            return None
+        ahora = timezone.now()
+        # Si otro trabajador lo tomó primero el UPDATE no cambia nada y se busca el siguiente
+        if Trabajo.objects.filter(pk=trabajo.pk, estado="pendiente").update(estado="en_proceso", iniciado=ahora):
+            trabajo.estado = "en_proceso"
+            trabajo.iniciado = ahora
+            return trabajo
+
+
+def recuperar_abandonados():
+    """
+    Marca como fallidos los trabajos en proceso desde hace más de
+    ``TRABAJOS_ABANDONADOS_SEGUNDOS``: su trabajador murió (un reinicio, un
+    kill) y nadie los va a terminar. No se vuelven a encolar porque el mismo
+    trabajo pudo ser lo que tiró al trabajador. Devuelve cuántos marcó.
+    """
+    limite = timezone.now() - timedelta(seconds=settings.TRABAJOS_ABANDONADOS_SEGUNDOS)
+    marcados = 0
+    for trabajo in Trabajo.objects.filter(estado="en_proceso", iniciado__lt=limite):
+        trabajo.estado = "fallido"
+        trabajo.mensaje = "El trabajador se detuvo antes de terminar; vuelve a intentarlo."
+        trabajo.terminado = timezone.now()
+        # Condicional, como en tomar_siguiente: si ya terminó no se toca
+        if Trabajo.objects.filter(pk=trabajo.pk, estado="en_proceso").update(
+            estado=trabajo.estado, mensaje=trabajo.mensaje, terminado=trabajo.terminado,
+        ):
+            marcados += 1
+            avisar(trabajo)
+    return marcados
+
+
+def ejecutar(trabajo):
+    try:
+        TAREAS[trabajo.tipo](trabajo)
+    except Exception as e:
+        logger.exception("Falló el trabajo %s", trabajo.pk)
+        trabajo.estado = "fallido"
+        trabajo.mensaje = str(e) or e.__class__.__name__
+    else:
+        trabajo.estado = "terminado"
+        trabajo.progreso = 100
+    trabajo.terminado = timezone.now()
+    trabajo.save(update_fields=["estado", "progreso", "mensaje", "resultado", "terminado"])
+    avisar(trabajo)
+
+
+def reportar(trabajo, progreso, mensaje="", guardar=True):
+    """
+    Manda el avance (0-100) al WebSocket del staff y, con ``guardar``, lo deja
+    en la tabla. No se debe guardar con un cursor de lectura abierto: en SQLite
+    ese UPDATE puede chocar con el de otro trabajador ("database is locked").
+    """
+    trabajo.progreso = max(0, min(100, int(progreso)))
+    trabajo.mensaje = mensaje
+    if guardar:
+        Trabajo.objects.filter(pk=trabajo.pk).update(progreso=trabajo.progreso, mensaje=mensaje)
+    avisar(trabajo)
+
+
+def avisar(trabajo):
+    # Sale al confirmarse la transacción; los avances de un mismo trabajo se agrupan (uno por segundo)
+    events.publicar(events.ProgresoTrabajo(
+        id=trabajo.pk,
+        titulo=str(trabajo),
+        estado=trabajo.estado,
+        progreso=trabajo.progreso,
+        mensaje=trabajo.mensaje,
+        resultado=reverse("admin:core_trabajo_resultado", args=[trabajo.pk]) if trabajo.resultado else None,
+    ))
+
+
+# --- TAREAS ---
+
+@tarea("importar_productos")
+def importar_productos(trabajo):
+    dry_run = trabajo.parametros.get("dry_run", False)
+    ruta = trabajo.archivo.path
+    total = contar_filas(ruta)
+    procesadas = 0
+
+    def al_terminar_lote(numero_lote, filas, resultado):
+        nonlocal procesadas
+        procesadas += filas
+        reportar(trabajo, 100 * procesadas / total if total else 0, str(resultado))
+
+    resultado = ImportadorProductos(dry_run=dry_run).importar(leer_filas(ruta), al_terminar_lote=al_terminar_lote)
+
+    errores = "".join(f"\nFila {numero}: {mensaje}" for numero, mensaje in resultado.errores[:50])
+    trabajo.mensaje = ("Sin escribir nada: " if dry_run else "") + str(resultado) + errores
+
+
+@tarea("exportar")
+def exportar(trabajo):
+    """Genera el XLSX de ``parametros["nombre"]``; con ``filtros`` sólo esos registros (filtros del admin)."""
+    nombre = trabajo.parametros["nombre"]
+    queryset = exportacion.queryset_base(nombre)
+    if trabajo.parametros.get("filtros"):
+        queryset = filtrar_como_el_admin(queryset, trabajo.parametros["filtros"], trabajo.usuario)
+    total = queryset.count()
+
+    def al_avanzar(filas):
+        # Se llama a media lectura (iterator): sólo se avisa, no se guarda
+        reportar(trabajo, 100 * filas / total if total else 0, f"{filas} de {total} filas", guardar=False)
+
+    with tempfile.TemporaryFile(suffix=".xlsx") as archivo:
+        exportacion.escribir_xlsx(archivo, nombre, queryset, al_avanzar)
+        archivo.seek(0)
+        trabajo.resultado.save(nombre_privado(f"{nombre}-{trabajo.pk}.xlsx"), File(archivo), save=False)
+    trabajo.mensaje = f"{total} filas exportadas"
+
+
+@tarea("generar_miniaturas")
+def generar_miniaturas(trabajo):
+    modelo = {"producto": Producto, "promocion": Promocion}[trabajo.parametros["modelo"]]
+    instancia = modelo.objects.filter(pk=trabajo.parametros["pk"]).first()
+    if instancia is None or not instancia.imagen:
+        trabajo.mensaje = "Sin imagen"
+        return
+    generadas = miniaturas.generar(instancia.imagen)
+    trabajo.mensaje = f"{len(generadas)} miniaturas de {instancia.imagen.name}"
+
@@ -0,0 +1,62 @@
+import unicodedata
+
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+
+def normalizar_texto(texto):
+    if not texto or str(texto).strip().lower() == 'none':
+        return ""
+    texto_normalizado = unicodedata.normalize('NFD', str(texto))
+    texto_sin_acentos = "".join([c for c in texto_normalizado if unicodedata.category(c) != 'Mn'])
+    return texto_sin_acentos.strip().lower()
+
+
+class ResolutorNombres:
+    """
+    Busca registros de Categoria, Marca o Proveedor por nombre ignorando acentos
+    y mayúsculas, con la columna indexada ``nombre_normalizado``. Los nombres
+    que no existen se crean; lo ya resuelto se recuerda durante la importación.
+    """
+    def __init__(self, model, field="nombre"):
+        self.model = model
+        self.field = field
+        self._por_nombre = {}
+
+    def reiniciar(self):
+        self._por_nombre = {}
+
+    def obtener(self, nombre, crear=True):
+        return self.obtener_varios([nombre], crear).get(normalizar_texto(nombre))
+
+    def obtener_varios(self, nombres, crear=True):
+        """
+        Resuelve muchos nombres a la vez: {nombre normalizado: objeto}, con una
+        consulta para los que no se conocían y un bulk_create para los que faltan.
+        """
+        por_nombre = self._por_nombre
+        claves = {}
+        for nombre in nombres:
+            clave = normalizar_texto(nombre)
+            if clave:
+                claves.setdefault(clave, nombre.strip())
+
+        desconocidas = [clave for clave in claves if clave not in por_nombre]
+        if desconocidas:
+            por_nombre.update(self.model.objects.in_bulk(desconocidas, field_name="nombre_normalizado"))
+        faltantes = [clave for clave in desconocidas if clave not in por_nombre]
+        if faltantes and crear:
+            # ignore_conflicts: si otra importación lo creó al mismo tiempo, el índice único gana y se relee
+            self.model.objects.bulk_create(
+                [self.model(**{self.field: claves[clave], "nombre_normalizado": clave}) for clave in faltantes],
+                ignore_conflicts=True,
+            )
+            por_nombre.update(self.model.objects.in_bulk(faltantes, field_name="nombre_normalizado"))
+        return {clave: por_nombre.get(clave) for clave in claves}
+
+
+def cache_por_proceso(alias="default"):
+    """
+    True si la caché ``alias`` vive en la memoria de cada proceso (LocMemCache):
+    lo que se invalide en un proceso (run_worker, otro Daphne) no llega a los demás.
+    """
+    return isinstance(caches[alias], LocMemCache)
@@ -1,15 +1,21 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required, user_passes_test
-from .models import Producto, Promocion, Cotizacion, CotizacionItem, Cliente, Pedido, PedidoItem, Marca, Proveedor, Categoria, PromocionTicker
-from decimal import Decimal
+from .models import Producto, Promocion, Cotizacion, CotizacionItem, Cliente, Pedido, PedidoItem, PromocionTicker
 from django.contrib import messages
-from django.db.models import Q
 from .forms import ClienteForm
+from .busqueda import buscar_productos
+from .utils import normalizar_texto
+from .facetas import obtener_facetas
+from .paginacion import PaginadorCursor
+from . import carrito as carrito_sesion
+from . import exportacion
+from .cache_paginas import cache_publica
+from .services import CotizacionService, PedidoService
+from .inventario import StockInsuficiente
 from django.contrib.auth.models import User
 from django.core.paginator import Paginator
-from django.db import transaction
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
+from django.http import Http404
+from django.db.models import Count, Prefetch
 
 # --- FUNCIONES DE PERMISOS ---
 def es_vendedor_o_admin(user): 
@@ -18,7 +24,12 @@ def es_vendedor_o_admin(user):
 def es_admin(user):
     return user.is_staff or user.is_superuser
 
+def avisar_faltantes(request, error):
+    for faltante in error.faltantes:
+        messages.error(request, f"Sin existencia suficiente de {faltante.nombre}: pediste {faltante.solicitado}, hay {faltante.disponible}.")
+
 # --- VISTAS GENERALES ---
+@cache_publica
 def inicio(request):
     promociones = PromocionTicker.objects.filter(activo=True)
     # ... tus otras variables (categorias, productos, etc)
@@ -29,18 +40,12 @@ def inicio(request):
 def inventario_view(request):
     query = request.GET.get('q', '').strip()
     cat_id = request.GET.get('categoria', '').strip()
-    categorias = Categoria.objects.all()
+    categorias = obtener_facetas()["categorias"]
 
     if not query and not cat_id:
         productos = Producto.objects.none()
     else:
-        productos = Producto.objects.all()
-        if query:
-            productos = productos.filter(
-                Q(descripcion__icontains=query) | 
-                Q(clave__icontains=query) |
-                Q(departamento__icontains=query)
-            )
+        productos = buscar_productos(query)
         if cat_id:
             productos = productos.filter(categoria_id=cat_id)
 
@@ -50,30 +55,35 @@ def inventario_view(request):
     })
 
 # --- VISTAS DE PRODUCTOS ---
+@cache_publica
 def productos(request):
     query = request.GET.get('q', '')
     categoria_nombre = request.GET.get('categoria', '')
     marca_nombre = request.GET.get('marca', '')
     proveedor_nombre = request.GET.get('proveedor', '')
 
-    productos_list = Producto.objects.all()
+    productos_list = buscar_productos(query)
 
-    if query:
-        productos_list = productos_list.filter(
-            Q(nombre__icontains=query) | 
-            Q(descripcion__icontains=query) |
-            Q(clave__icontains=query)
-        )
+    # Por la columna normalizada (indexada): "ferreteria" encuentra "Ferretería"
     if categoria_nombre:
-        productos_list = productos_list.filter(categoria__nombre=categoria_nombre)
+        productos_list = productos_list.filter(categoria__nombre_normalizado=normalizar_texto(categoria_nombre))
     if marca_nombre:
-        productos_list = productos_list.filter(marca__nombre=marca_nombre)
+        productos_list = productos_list.filter(marca__nombre_normalizado=normalizar_texto(marca_nombre))
     if proveedor_nombre:
-        productos_list = productos_list.filter(proveedor__nombre=proveedor_nombre)
+        productos_list = productos_list.filter(proveedor__nombre_normalizado=normalizar_texto(proveedor_nombre))
+
+    # Con búsqueda se conserva el orden por relevancia; el id desempata
+    if "relevancia" in productos_list.query.annotations:
+        orden = ("relevancia", "nombre", "id")
+    else:
+        orden = ("nombre", "id")
 
-    paginator = Paginator(productos_list, 12) 
     page_number = request.GET.get("page")
-    page_obj = paginator.get_page(page_number)
+    if page_number and page_number.isdigit():
+        # Enlaces anteriores con número de página
+        page_obj = Paginator(productos_list.order_by(*orden), 12).get_page(page_number)
+    else:
+        page_obj = PaginadorCursor(productos_list, 12, orden).get_page(page_number)
 
     context = {
         'page_obj': page_obj,
@@ -81,21 +91,22 @@ def productos(request):
         'categoria': categoria_nombre,
         'marca': marca_nombre,
         'proveedor': proveedor_nombre,
-        'categorias': Categoria.objects.all(),
-        'marcas': Marca.objects.all(),
-        'proveedores': Proveedor.objects.all(),
+        **obtener_facetas(),
     }
     return render(request, 'productos.html', context)
 
+@cache_publica
 def producto_detalle(request, producto_id):
     producto = get_object_or_404(Producto, id=producto_id)
     return render(request, 'producto_detalle.html', {'producto': producto})
 
 # --- PROMOCIONES ---
+@cache_publica
 def lista_promociones(request): 
     promociones = Promocion.objects.all() 
     return render(request, 'promociones.html', {'promociones': promociones})
 
+@cache_publica
 def promocion_detalle(request, promocion_id): 
     promocion = get_object_or_404(Promocion, id=promocion_id)  
     return render(request, 'promocion_detalle.html', {'promocion': promocion})
@@ -106,24 +117,22 @@ def cotizar_productos(request):
     productos_res = Producto.objects.none()
 
     if query:
-        productos_res = Producto.objects.filter(
-            Q(nombre__icontains=query) | Q(clave__icontains=query)
-        )
+        productos_res = buscar_productos(query)
 
     if "cotizacion_items" not in request.session:
-        request.session["cotizacion_items"] = {}
+        carrito_sesion.vaciar(request.session)
 
     if request.method == "POST":
-        carrito = request.session["cotizacion_items"]
+        lineas = []
         for prod in productos_res:
             cantidad_val = request.POST.get(f"cantidad_{prod.id}", 0)
             if cantidad_val:
                 cantidad = int(cantidad_val)
                 if cantidad > 0:
-                    carrito[str(prod.id)] = carrito.get(str(prod.id), 0) + cantidad
+                    lineas.append((prod, cantidad))
 
-        request.session["cotizacion_items"] = carrito
-        request.session.modified = True
+        carrito_sesion.agregar(request.session, lineas)
+        carrito = request.session["cotizacion_items"]
 
         if "agregar" in request.POST:
             messages.success(request, "Productos agregados al carrito.")
@@ -135,25 +144,12 @@ def cotizar_productos(request):
                 messages.error(request, "No tienes un cliente dado de alta.")
                 return redirect("crear_cliente")
 
-            id_viejo = request.session.get("editando_cotizacion_id")
+            id_viejo = request.session.pop("editando_cotizacion_id", None)
             if id_viejo:
-                Cotizacion.objects.filter(id=id_viejo).delete()
-                del request.session["editando_cotizacion_id"]
-
-            cotizacion = Cotizacion.objects.create(cliente=cliente, total=0)
-            total = Decimal("0.00")
-            for p_id, cant in carrito.items():
-                try:
-                    p = Producto.objects.get(id=p_id)
-                    sub = p.precio * cant
-                    CotizacionItem.objects.create(cotizacion=cotizacion, producto=p, cantidad=cant, subtotal=sub)
-                    total += sub
-                except Producto.DoesNotExist: continue
-
-            cotizacion.total = total
-            cotizacion.save()
-            request.session["cotizacion_items"] = {}
-            request.session.modified = True
+                cotizacion = CotizacionService.reemplazar_desde_carrito(id_viejo, carrito, cliente)
+            else:
+                cotizacion = CotizacionService.crear_desde_carrito(carrito, cliente)
+            carrito_sesion.vaciar(request.session)
             messages.success(request, f"Cotización #{cotizacion.id} guardada.")
             return redirect("detalle_cotizacion", cotizacion_id=cotizacion.id)
 
@@ -186,21 +182,24 @@ def crear_cliente(request):
 
 def carrito_view(request):
     carrito = request.session.get("cotizacion_items", {})
+    productos_carrito = Producto.objects.in_bulk([int(p_id) for p_id in carrito])
     items_list = []
+    lineas = []
     total = 0
     for p_id, cant in carrito.items():
-        p = get_object_or_404(Producto, id=p_id)
-        sub = p.precio * cant
+        p = productos_carrito.get(int(p_id))
+        if p is None:
+            continue
+        sub = (p.precio or 0) * cant
         items_list.append({"producto": p, "cantidad": cant, "subtotal": sub})
+        lineas.append((p, cant))
         total += sub
+    # Con los precios ya cargados se refresca el resumen que usa el badge
+    carrito_sesion.reemplazar(request.session, lineas)
     return render(request, "carrito.html", {"productos": items_list, "total": total})
 
 def eliminar_del_carrito(request, producto_id):
-    carrito = request.session.get('cotizacion_items', {})
-    if str(producto_id) in carrito:
-        del carrito[str(producto_id)]
-        request.session['cotizacion_items'] = carrito
-        request.session.modified = True
+    if carrito_sesion.quitar(request.session, producto_id):
         messages.success(request, "Eliminado.")
     return redirect('carrito')
 
@@ -209,7 +208,7 @@ def eliminar_del_carrito(request, producto_id):
 def pedidos(request):
     if request.user.is_staff or request.user.is_superuser:
         # Los admins ven todo lo que no sea borrador
-        pedidos_list = Pedido.objects.exclude(estado="pendiente").order_by("-fecha")
+        pedidos_list = Pedido.objects.exclude(estado="pendiente")
     else:
         # Intentamos obtener el perfil del cliente de forma segura
         cliente_perfil = Cliente.objects.filter(usuario=request.user).first()
@@ -220,19 +219,45 @@ def pedidos(request):
             return redirect("crear_cliente")
         
         # Filtramos los pedidos del cliente encontrado
-        pedidos_list = Pedido.objects.filter(cliente=cliente_perfil).order_by("-fecha")
-    
-    return render(request, "pedidos.html", {"pedidos": pedidos_list})
+        pedidos_list = Pedido.objects.filter(cliente=cliente_perfil)
+
+    pedidos_list = pedidos_list.select_related("cliente").annotate(num_items=Count("items")).order_by("-fecha", "-id")
+    page_obj = None
+    if request.user.is_staff or request.user.is_superuser:
+        # La lista de admins incluye los pedidos de todos los clientes: se pagina
+        page_obj = Paginator(pedidos_list, 25).get_page(request.GET.get("page"))
+        pedidos_list = page_obj
+
+    return render(request, "pedidos.html", {"pedidos": pedidos_list, "page_obj": page_obj})
+
+@login_required
+@user_passes_test(es_admin)
+def exportar_pedidos(request, tipo, formato):
+    """Pedidos (tipo "pedidos") o sus líneas ("pedido_items") en CSV o XLSX, sin los borradores."""
+    if tipo not in ("pedidos", "pedido_items"):
+        raise Http404("Exportación desconocida")
+    queryset = exportacion.queryset_base(tipo)
+    if tipo == "pedidos":
+        queryset = queryset.exclude(estado="pendiente")
+    else:
+        queryset = queryset.exclude(pedido__estado="pendiente")
+    return exportacion.respuesta(tipo, formato, queryset)
+
+def _pedido_con_detalle():
+    return Pedido.objects.select_related("cliente").annotate(num_items=Count("items")).prefetch_related(
+        Prefetch("items", queryset=PedidoItem.objects.select_related("producto").order_by("id"))
+    )
+
 @login_required
 def detalle_pedido(request, pedido_id):
     if request.user.is_staff or request.user.is_superuser:
         # Los admins pueden ver cualquier pedido
-        pedido = get_object_or_404(Pedido, id=pedido_id)
+        pedido = get_object_or_404(_pedido_con_detalle(), id=pedido_id)
     else:
         # Para clientes, buscamos primero su perfil
         cliente_perfil = get_object_or_404(Cliente, usuario=request.user)
         # Luego buscamos el pedido que le pertenezca a ese perfil específico
-        pedido = get_object_or_404(Pedido, id=pedido_id, cliente=cliente_perfil)
+        pedido = get_object_or_404(_pedido_con_detalle(), id=pedido_id, cliente=cliente_perfil)
     
     return render(request, "detalle_pedido.html", {"pedido": pedido})
 
@@ -243,50 +268,24 @@ def convertir_a_pedido(request, cotizacion_id):
         cotizacion = get_object_or_404(Cotizacion, id=cotizacion_id, cliente=cliente_instancia)
         
         try:
-            with transaction.atomic():
-                # 1. Crear el Pedido
-                nuevo_pedido = Pedido.objects.create(
-                    cliente=cliente_instancia, 
-                    total=cotizacion.total,
-                    estado="procesado"
-                )
-
-                # 2. Copiar los productos
-                for item in cotizacion.items.all():
-                    PedidoItem.objects.create(
-                        pedido=nuevo_pedido,
-                        producto=item.producto,
-                        cantidad=item.cantidad,
-                        precio_unitario=item.producto.precio
-                    )
-
-                # 3. Marcar cotización como convertida (la oculta de la lista)
-                cotizacion.convertida_en_pedido = True
-                cotizacion.save()
-
-                # --- LÓGICA DE NOTIFICACIÓN EN TIEMPO REAL ---
-                channel_layer = get_channel_layer()
-                async_to_sync(channel_layer.group_send)(
-                    'notifications',  # El grupo que definiste en tu Consumer
-                    {
-                        'type': 'send_notification', # Debe coincidir con el método en tu Consumer
-                        'titulo': '¡Nuevo Pedido Confirmado! 📦',
-                        'mensaje': f'La cotización #{cotizacion.id} ha sido convertida',
-                        'total': str(cotizacion.total),
-                        'cliente': cliente_instancia.usuario.get_full_name() or cliente_instancia.usuario.username
-                    }
-                )
-
+            nuevo_pedido = PedidoService.crear_desde_cotizacion(cotizacion, cliente_instancia)
             messages.success(request, f"¡Pedido #{nuevo_pedido.id} generado con éxito!")
             return redirect('pedidos')
 
+        except StockInsuficiente as e:
+            avisar_faltantes(request, e)
+            return redirect('cotizaciones_cliente')
+
         except Exception as e:
             messages.error(request, f"Error: {e}")
             return redirect('cotizaciones_cliente')
         
 # --- OTRAS VISTAS ---
 def detalle_cotizacion(request, cotizacion_id):
-    cotizacion = get_object_or_404(Cotizacion, id=cotizacion_id)
+    cotizaciones = Cotizacion.objects.select_related("cliente").prefetch_related(
+        Prefetch("items", queryset=CotizacionItem.objects.select_related("producto").order_by("id"))
+    )
+    cotizacion = get_object_or_404(cotizaciones, id=cotizacion_id)
     return render(request, "detalle_cotizacion.html", {"cotizacion": cotizacion})
 
 def cotizaciones_cliente(request):
@@ -295,7 +294,7 @@ def cotizaciones_cliente(request):
         cotizaciones = Cotizacion.objects.filter(
             cliente__usuario=request.user, 
             convertida_en_pedido=False
-        ).order_by('-fecha') # Las más recientes primero
+        ).order_by('-fecha', '-id') # Las más recientes primero
     else:
         cotizaciones = Cotizacion.objects.none()
         
@@ -315,20 +314,16 @@ def eliminar_pedido(request, pedido_id):
         pedido = get_object_or_404(Pedido, id=pedido_id, cliente__usuario=request.user)
     
     if request.method == "POST":
-        pedido.delete()
+        PedidoService.eliminar(pedido)
         messages.success(request, "Pedido eliminado correctamente.")
         return redirect("pedidos")
     return render(request, "confirmar_eliminar.html", {"objeto": pedido})
 
 def editar_cotizacion(request, cotizacion_id):
     cotizacion = get_object_or_404(Cotizacion, id=cotizacion_id)
-    carrito = {}
-    for item in cotizacion.cotizacionitem_set.all():
-        carrito[str(item.producto.id)] = item.cantidad
-    
-    request.session["cotizacion_items"] = carrito
+    items = cotizacion.items.select_related("producto")
+    carrito_sesion.reemplazar(request.session, [(item.producto, item.cantidad) for item in items])
     request.session["editando_cotizacion_id"] = cotizacion.id 
-    request.session.modified = True
     
     messages.info(request, f"Editando Cotización #{cotizacion.id}. Al guardar, la anterior se actualizará.")
     return redirect('carrito')
@@ -342,17 +337,7 @@ def agregar_carrito(request, producto_id):
         messages.error(request, "Debes completar tu perfil de cliente primero.")
         return redirect("crear_cliente")
 
-    pedido, creado = Pedido.objects.get_or_create(cliente=cliente, estado="pendiente", defaults={"total": 0})
-    detalle, creado_detalle = PedidoItem.objects.get_or_create(
-        pedido=pedido, producto=producto,
-        defaults={"cantidad": 1, "precio_unitario": producto.precio}
-    )
-    if not creado_detalle:
-        detalle.cantidad += 1
-        detalle.save()
-
-    pedido.total = sum(item.subtotal() for item in pedido.pedidoitem_set.all())
-    pedido.save()
+    PedidoService.agregar_producto(cliente, producto)
     messages.success(request, f"{producto.nombre} añadido al carrito.")
     return redirect("productos")
 
@@ -365,9 +350,12 @@ def confirmar_pedido(request, pedido_id):
     # Quitamos filtros de estado para que el 404 no salte si ya está procesado
     pedido = get_object_or_404(Pedido, id=pedido_id, cliente=cliente_perfil)
     
-    # 3. Cambiamos el estado
-    pedido.estado = "procesado"
-    pedido.save()
+    # 3. Cambiamos el estado apartando las existencias de todas las líneas
+    try:
+        PedidoService.confirmar(pedido)
+    except StockInsuficiente as e:
+        avisar_faltantes(request, e)
+        return redirect("detalle_pedido", pedido_id=pedido.id)
     
     messages.success(request, f"¡Pedido #{pedido.id} confirmado con éxito!")
     return redirect("pedidos")
\ No newline at end of file
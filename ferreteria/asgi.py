@@ -1,16 +1,19 @@
 import os
 from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ferreteria.settings')
+# Primero Django: las rutas de los sockets importan los modelos (core.events)
+django_asgi_app = get_asgi_application()
+
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 import core.routing # Aquí definiremos las rutas de los sockets
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ferreteria.settings')
-
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
+    "http": django_asgi_app,
     "websocket": AuthMiddlewareStack(
         URLRouter(
             core.routing.websocket_urlpatterns
         )
     ),
-})
\ No newline at end of file
+})
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -76,12 +77,27 @@ TEMPLATES = [
 WSGI_APPLICATION = 'ferreteria.wsgi.application'
 ASGI_APPLICATION = 'ferreteria.asgi.application'
 
+# Capa compartida por todos los workers de Daphne de esta máquina (core.capa_canales).
+# Con varios servidores: "channels_redis.core.RedisChannelLayer".
 CHANNEL_LAYERS = {
     "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer",
+        "BACKEND": "core.capa_canales.CapaSQLite",
+        "CONFIG": {
+            "ruta": BASE_DIR / "canales.sqlite3",
+            "expiry": 60,
+            "capacity": 100,
+        },
     },
 }
 
+# Avisos a los admins que se repiten al reconectar el WebSocket (core.models.Aviso)
+AVISOS_HISTORIAL_SEGUNDOS = 60 * 60
+
+# Un trabajo "en proceso" desde hace más que esto se da por abandonado (el
+# trabajador murió o se reinició a media tarea): run_worker lo marca como
+# fallido al arrancar. Debe ser mayor que el trabajo más largo esperado.
+TRABAJOS_ABANDONADOS_SEGUNDOS = 2 * 60 * 60
+
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
@@ -90,9 +106,42 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Esperar a que se libere el candado de escritura en vez de fallar al instante
+        'OPTIONS': {'timeout': 20},
+        # Las pruebas de concurrencia (hilos de reserva, bandeja de salida, procesos de
+        # benchmark_canales) necesitan un archivo: la BD en memoria no admite escritores en
+        # paralelo ni otros procesos. Va en el directorio temporal, fuera del proyecto.
+        'TEST': {'NAME': Path(tempfile.gettempdir()) / 'ferreteria_test_db.sqlite3'},
+    }
+}
+
+
+# Caché (páginas públicas, facetas del catálogo, versión de precios del carrito).
+# Tiene que ser compartida: las invalidaciones salen también de run_worker, de
+# importar_productos y de cada proceso de Daphne. En archivos sirve para todos
+# los procesos de una máquina; con varias máquinas usar una caché de red
+# (Redis, Memcached) o 'django.core.cache.backends.db.DatabaseCache' (requiere
+# `python manage.py createcachetable`). Con LocMemCache cada proceso tendría la
+# suya: las páginas no se guardan y lo demás dura poco (core.utils.cache_por_proceso).
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+        # Cada set() lista la carpeta para depurarla; las páginas viejas vencen solas
+        'OPTIONS': {'MAX_ENTRIES': 5000},
     }
 }
 
+# Las pruebas usan su propia carpeta de caché (core.pruebas)
+TEST_RUNNER = 'core.pruebas.EjecutorPruebas'
+
+# Páginas públicas del catálogo para visitantes anónimos (core.cache_paginas).
+# Se invalidan al editar el catálogo; la duración es el respaldo por si algún
+# cambio no pasa por las señales (p. ej. update() directo, los apartados). Los
+# precios y existencias en pantalla los corrige ws/productos/ al cargar la página
+# (ProductosConsumer manda los valores actuales al suscribirse).
+CACHE_PAGINAS_SEGUNDOS = 10 * 60
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -129,6 +178,23 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/5.2/howto/static-files/
 
 STATIC_URL = '/static/'
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+# Con ESTATICOS_CON_HASH, `collectstatic` copia los archivos con el hash del
+# contenido en el nombre (app.3f2a9c1b7e4d.css) y deja junto a cada uno sus
+# versiones .gz (y .br si está instalado `brotli`). Necesita haber corrido
+# collectstatic, por eso en desarrollo queda apagado.
+ESTATICOS_CON_HASH = not DEBUG
+
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {
+        'BACKEND': (
+            'core.almacenamiento.EstaticosComprimidos' if ESTATICOS_CON_HASH
+            else 'django.contrib.staticfiles.storage.StaticFilesStorage'
+        ),
+    },
+}
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -139,6 +205,20 @@ import os
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Archivos de los trabajos (listas importadas, exportaciones con datos de
+# clientes): fuera de MEDIA_ROOT, sólo se descargan desde el admin.
+ARCHIVOS_PRIVADOS_ROOT = os.path.join(BASE_DIR, 'privado')
+
+# Django sirve /media/ y /static/ (core.medios, con ETag, Range y caché larga),
+# con DEBUG o sin él. De /media/ sólo salen las imágenes del catálogo
+# (productos/, promociones/). Si el servidor web (nginx, Apache) ya sirve esas
+# carpetas se puede apagar con la variable de entorno SERVIR_MEDIA=0; lo mismo
+# para /static/ con SERVIR_ESTATICOS.
+SERVIR_MEDIA = os.environ.get('SERVIR_MEDIA', '1') != '0'
+SERVIR_ESTATICOS = os.environ.get('SERVIR_ESTATICOS', '1') != '0'
+# Caché del navegador para archivos que pueden cambiar de contenido con el
+# mismo nombre; los nombrados por hash se marcan "immutable" por un año.
+MEDIA_CACHE_SEGUNDOS = 60 * 60
 
 LOGIN_URL = '/login/'
 LOGIN_REDIRECT_URL = 'inicio'
@@ -1,9 +1,7 @@
-from django.conf import settings
-from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 from django.contrib.auth import views as auth_views
-from core import views
+from core import medios, views
 from core.views import (
     inicio, 
     productos,          
@@ -60,6 +58,7 @@ urlpatterns = [
     path("pedidos/", pedidos, name="pedidos"),
     path("pedidos/<int:pedido_id>/", detalle_pedido, name="detalle_pedido"),
     path("pedidos/<int:pedido_id>/eliminar/", eliminar_pedido, name="eliminar_pedido"),
+    path("pedidos/exportar/<str:tipo>/<str:formato>/", views.exportar_pedidos, name="exportar_pedidos"),
     
     # Carrito y Pedidos
     path("producto/<int:producto_id>/agregar/", views.agregar_carrito, name="agregar_carrito"),
@@ -71,5 +70,5 @@ urlpatterns = [
     path('cotizacion/convertir/<int:cotizacion_id>/', views.convertir_a_pedido, name='convertir_a_pedido'),
 ]
 
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+# /media/ y /static/ con caché y Range; ver SERVIR_MEDIA / SERVIR_ESTATICOS en settings
+urlpatterns += medios.urls()